@@ -0,0 +1,169 @@
+import os
+import threading
+
+import numpy as np
+
+
+def _sq_distances(queries, points, point_sq_norms=None):
+    """Squared euclidean distances between every query and every point"""
+    if point_sq_norms is None:
+        point_sq_norms = np.einsum('ij,ij->i', points, points)
+    sq = np.einsum('ij,ij->i', queries, queries)[:, None] + point_sq_norms[None, :]
+    sq -= 2.0 * (queries @ points.T)
+    np.maximum(sq, 0.0, out=sq)
+    return sq
+
+
+def cluster_sums(points, labels, n_clusters):
+    """Per-cluster sum of the points labelled with it; zero rows for empty clusters"""
+    sums = np.zeros((n_clusters, points.shape[1]), dtype=np.float64)
+    np.add.at(sums, labels, points)
+    return sums
+
+
+def kmeans(points, n_clusters, n_iter=20, sample_size=None, seed=0):
+    """Lloyd's k-means on a (sub)sample of points, returns the centroids"""
+    rng = np.random.default_rng(seed)
+    if sample_size and len(points) > sample_size:
+        points = points[rng.choice(len(points), sample_size, replace=False)]
+    n_clusters = min(n_clusters, len(points))
+    centroids = points[rng.choice(len(points), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        labels = np.argmin(_sq_distances(points, centroids), axis=1)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = cluster_sums(points, labels, n_clusters)
+        empty = counts == 0
+        # Re-seed empty clusters from random points so every list stays usable
+        if empty.any():
+            sums[empty] = points[rng.choice(len(points), int(empty.sum()))]
+            counts[empty] = 1
+        new_centroids = sums / counts[:, None]
+        if np.allclose(new_centroids, centroids, atol=1e-6):
+            centroids = new_centroids
+            break
+        centroids = new_centroids
+    return centroids.astype(points.dtype, copy=False)
+
+
+class IVFIndex:
+    """Inverted-file index: k-means partitions searched n_probe at a time
+
+    Rows are the row numbers of the owning FaceGallery matrix; the index only
+    keeps the list assignment of each row, distances are always computed
+    against the gallery matrix itself.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, min_size=5000, retrain_growth=2.0, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_size = min_size
+        self.retrain_growth = retrain_growth
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._lock = threading.RLock()
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self._lists = None
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def needs_retrain(self, size):
+        if size < self.min_size:
+            return False
+        return not self.is_trained or size > self.trained_size * self.retrain_growth
+
+    def build(self, matrix):
+        """Train centroids on the gallery and assign every row"""
+        with self._lock:
+            n_lists = self.n_lists or max(1, int(np.sqrt(len(matrix))))
+            self.centroids = kmeans(matrix, n_lists, sample_size=64 * n_lists, seed=self.seed)
+            self.trained_size = len(matrix)
+            self._assignments = np.empty(max(len(matrix), 1024), dtype=np.int32)
+            self._size = 0
+            self.assign_rows(0, matrix)
+
+    def nearest_lists(self, vectors, count=1):
+        sq = _sq_distances(vectors, self.centroids)
+        if count >= sq.shape[1]:
+            return np.argsort(sq, axis=1)
+        return np.argpartition(sq, count - 1, axis=1)[:, :count]
+
+    def assign_rows(self, start, vectors):
+        """Assign consecutive gallery rows starting at `start` to their nearest list"""
+        with self._lock:
+            labels = self.nearest_lists(vectors)[:, 0].astype(np.int32)
+            end = start + len(labels)
+            if end > len(self._assignments):
+                grown = np.empty(max(end, 2 * len(self._assignments)), dtype=np.int32)
+                grown[:self._size] = self._assignments[:self._size]
+                self._assignments = grown
+            self._assignments[start:end] = labels
+            self._size = max(self._size, end)
+            self._lists = None
+
+    def set_assignments(self, assignments):
+        with self._lock:
+            self._assignments = np.array(assignments, dtype=np.int32)
+            self._size = len(assignments)
+            self._lists = None
+
+    def move_row(self, source, target):
+        """Mirror FaceGallery.remove: row `source` moves into `target`, size shrinks by one"""
+        with self._lock:
+            self._assignments[target] = self._assignments[source]
+            self._size -= 1
+            self._lists = None
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            assignments = self._assignments[:self._size]
+            order = np.argsort(assignments, kind='stable').astype(np.int64)
+            bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, bounds)
+        return self._lists
+
+    def search(self, queries, matrix, sq_norms, n_probe=None):
+        """Best (row, distance) per query, scanning only the n_probe closest lists"""
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        with self._lock:
+            order, bounds = self._inverted_lists()
+            probes = self.nearest_lists(queries, n_probe)
+
+        rows = np.full(len(queries), -1, dtype=np.int64)
+        distances = np.full(len(queries), np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([order[bounds[p]:bounds[p + 1]] for p in probes[i]])
+            if len(candidates) == 0:
+                continue
+            sq = _sq_distances(query[None, :], matrix[candidates], sq_norms[candidates])[0]
+            best = int(np.argmin(sq))
+            rows[i] = candidates[best]
+            distances[i] = np.sqrt(sq[best])
+        return rows, distances
+
+    def save(self, path, ids):
+        """Persist centroids and per-employee list assignments"""
+        with self._lock:
+            if not self.is_trained:
+                return
+            tmp_path = path + '.tmp.npz'
+            np.savez(tmp_path,
+                     centroids=self.centroids,
+                     trained_size=np.int64(self.trained_size),
+                     ids=np.array(ids, dtype=str),
+                     assignments=self._assignments[:self._size])
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Load a saved index; returns {employee_id: list} or None if unavailable"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            with self._lock:
+                self.centroids = data['centroids']
+                self.trained_size = int(data['trained_size'])
+            return dict(zip(data['ids'].tolist(), data['assignments'].tolist()))
@@ -1,84 +1,216 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import (Blueprint, Flask, current_app, render_template, request, jsonify, send_file,
+                   Response, stream_with_context)
 from database import Database
-from facial_recognition import FaceRecognitionSystem
-from camera import IPCameraSystem
-import sqlite3
-from datetime import datetime, timedelta
-import csv
-import io
-
-app = Flask(__name__)
-db = Database()
-face_system = FaceRecognitionSystem()
-camera_system = IPCameraSystem()
-
-
-@app.route('/')
+from attendance import ShiftTable
+from payroll import PayrollEngine
+from config import Config
+from listing import RESOURCES, parse_args, query_page, stream_json
+from export import csv_chunks, export_params, gzip_chunks, iter_rows, write_xlsx
+from dashboard import DashboardStats
+from archive import attendance_summary
+from ipc import RecognitionClient, RecognitionError
+import metrics
+from datetime import date, datetime, timedelta
+import json
+import os
+import shutil
+import tempfile
+
+ROLES = ('all', 'web')
+
+bp = Blueprint('payroll', __name__)
+
+
+class Services:
+    """Per-app state: database handles, caches and the recognition backend for the role"""
+
+    def __init__(self, role):
+        self.role = role
+        self.db = Database()
+        self.payroll_engine = PayrollEngine(self.db)
+        if role == 'web':
+            self.recognition = RecognitionClient()
+            self.shifts = ShiftTable(self.db)
+        else:
+            # Imported here so 'web' workers never load the gallery or the camera stack
+            from recognition_service import RecognitionService
+
+            self.recognition = RecognitionService()
+            self.shifts = self.recognition.camera_system.attendance.shifts
+        self.dashboard_stats = DashboardStats(self.db)
+        if role == 'web':
+            self.recognition.subscribe(self.dashboard_stats.apply, self.invalidate)
+        else:
+            self.recognition.listeners.append(self.dashboard_stats.apply)
+
+    def invalidate(self):
+        """Drop this process's cached staff data"""
+        self.shifts.invalidate()
+        self.dashboard_stats.invalidate()
+
+    def staff_changed(self):
+        """Drop cached staff data here, in the recognition service and in every other web worker"""
+        self.invalidate()
+        try:
+            self.recognition.staff_changed()
+        except (OSError, RecognitionError) as e:
+            self.db.log_event('WARNING', 'Staff', f'Recognition service not notified: {str(e)}')
+
+
+def create_app(role=None):
+    """Build the Flask app for a process role (see Config.APP_ROLE)
+
+    'all' owns the gallery and cameras in this process. 'web' loads neither
+    and forwards face work to recognition_service.py, so any number of web
+    workers can run under a WSGI server (see wsgi.py).
+    """
+    role = role or Config.APP_ROLE
+    if role not in ROLES:
+        raise ValueError(f'role must be one of {", ".join(ROLES)}')
+    app = Flask(__name__)
+    app.extensions['payroll'] = Services(role)
+    app.register_blueprint(bp)
+    return app
+
+
+def services():
+    return current_app.extensions['payroll']
+
+
+@bp.route('/')
 def index():
     return render_template('index.html')
 
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 def dashboard():
     """Main dashboard"""
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-
-    # Get today's attendance stats
-    cursor.execute('''
-        SELECT COUNT(*) as total, 
-               SUM(CASE WHEN time_in IS NOT NULL THEN 1 ELSE 0 END) as present
-        FROM attendance 
-        WHERE date = date('now')
-    ''')
-    stats = cursor.fetchone()
-
-    # Get recent attendance
-    cursor.execute('''
-        SELECT a.employee_id, s.name, a.time_in, a.time_out, a.late_minutes
-        FROM attendance a
-        JOIN staff s ON a.employee_id = s.employee_id
-        WHERE a.date = date('now')
-        ORDER BY a.time_in DESC
-        LIMIT 10
-    ''')
-    recent_attendance = cursor.fetchall()
-
-    conn.close()
+    svc = services()
+    # Today's figures come from the in-memory cache fed by the attendance write path
+    stats = svc.dashboard_stats.snapshot()
+
+    # Month-to-date payroll from the running accruals
+    payroll_so_far = svc.payroll_engine.preview(datetime.now().strftime('%Y-%m'))
 
     return render_template('dashboard.html',
-                           total_employees=stats[0],
-                           present_today=stats[1],
-                           recent_attendance=recent_attendance)
+                           total_employees=stats['total_employees'],
+                           present_today=stats['present_today'],
+                           late_today=stats['late_today'],
+                           recent_attendance=stats['recent'],
+                           recent_limit=svc.dashboard_stats.recent_size,
+                           payroll_so_far=payroll_so_far)
 
 
-@app.route('/staff')
+@bp.route('/api/dashboard')
+def dashboard_snapshot():
+    """Today's dashboard figures"""
+    return jsonify({'success': True, **services().dashboard_stats.snapshot()})
+
+
+@bp.route('/api/dashboard/updates')
+def dashboard_updates():
+    """Long-poll: deltas after ?since=<version>, waiting up to ?timeout= seconds
+
+    Returns a full snapshot instead when the client has fallen too far behind,
+    or its version came from another worker process or before a restart.
+    """
+    since = request.args.get('since')
+    try:
+        timeout = min(float(request.args.get('timeout', 25)), 60)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'timeout must be a number'})
+    dashboard_stats = services().dashboard_stats
+    deltas = dashboard_stats.wait_for_changes(since, timeout)
+    if deltas is None:
+        return jsonify({'success': True, 'snapshot': dashboard_stats.snapshot()})
+    return jsonify({'success': True, 'deltas': deltas})
+
+
+@bp.route('/api/dashboard/stream')
+def dashboard_stream():
+    """Server-sent events: a snapshot, then a delta per attendance event"""
+    dashboard_stats = services().dashboard_stats
+
+    def events(since):
+        if not since:
+            snapshot = dashboard_stats.snapshot()
+            since = snapshot['version']
+            yield f'event: snapshot\ndata: {json.dumps(snapshot)}\n\n'
+        while True:
+            deltas = dashboard_stats.wait_for_changes(since, 15)
+            if deltas is None:
+                snapshot = dashboard_stats.snapshot()
+                since = snapshot['version']
+                yield f'event: snapshot\ndata: {json.dumps(snapshot)}\n\n'
+            elif not deltas:
+                # Keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+            for delta in deltas or ():
+                since = delta['version']
+                yield f'id: {since}\nevent: delta\ndata: {json.dumps(delta)}\n\n'
+
+    return Response(stream_with_context(events(request.headers.get('Last-Event-ID'))), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+def list_page(name, **defaults):
+    """One page of a listing for a template: (rows, next_cursor)"""
+    args = {**defaults, **request.args.to_dict()}
+    fields, sort, filters, cursor, limit = parse_args(RESOURCES[name], args)
+    with services().db.read() as conn:
+        page = query_page(conn, name, fields, sort, filters, cursor, limit)
+        rows = list(page)
+    return rows, page.next_cursor
+
+
+def list_response(name):
+    """Stream one keyset page of a listing as JSON"""
+    try:
+        fields, sort, filters, cursor, limit = parse_args(RESOURCES[name], request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    return Response(stream_with_context(stream_json(services().db, name, fields, sort, filters,
+                                                    cursor, limit)),
+                    mimetype='application/json')
+
+
+@bp.route('/staff')
 def staff_management():
     """Staff management page"""
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM staff')
-    staff_members = cursor.fetchall()
-    conn.close()
+    try:
+        staff_members, next_cursor = list_page('staff')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    with services().db.read() as conn:
+        total = conn.execute('SELECT COUNT(*) FROM staff').fetchone()[0]
+
+    # Filters and sort carry over to the page links; the cursor only makes sense with them
+    page_args = {name: value for name, value in request.args.items() if name != 'cursor'}
+    return render_template('staff.html', staff_members=staff_members, total_staff=total,
+                           next_cursor=next_cursor, page_args=page_args)
 
-    return render_template('staff.html', staff_members=staff_members)
 
+@bp.route('/api/staff', methods=['GET'])
+def list_staff():
+    """Staff list; supports fields, sort, limit, cursor and department/position/q filters"""
+    return list_response('staff')
 
-@app.route('/api/staff', methods=['POST'])
+
+@bp.route('/api/staff', methods=['POST'])
 def add_staff():
     """Add new staff member"""
+    svc = services()
+    db = svc.db
     data = request.json
     try:
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO staff (employee_id, name, department, position, salary, shift_start, shift_end)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (data['employee_id'], data['name'], data['department'],
-              data['position'], data['salary'], data['shift_start'], data['shift_end']))
-        conn.commit()
-        conn.close()
-
+        with db.write() as batch:
+            batch.execute('''
+                INSERT INTO staff (employee_id, name, department, position, salary, shift_start, shift_end)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (data['employee_id'], data['name'], data['department'],
+                  data['position'], data['salary'], data['shift_start'], data['shift_end']))
+
+        svc.staff_changed()
         db.log_event('INFO', 'Staff', f'Added staff member: {data["employee_id"]}')
         return jsonify({'success': True, 'message': 'Staff member added successfully'})
     except Exception as e:
@@ -86,94 +218,127 @@ def add_staff():
         return jsonify({'success': False, 'message': str(e)})
 
 
-@app.route('/attendance')
+@bp.route('/api/staff/import', methods=['POST'])
+def import_staff():
+    """Bulk import: multipart 'staff' CSV plus optional 'photos' zip
+
+    Streams one JSON progress object per line; the last line is the summary
+    with per-row and per-image failures.
+    """
+    if 'staff' not in request.files:
+        return jsonify({'success': False, 'message': 'Missing staff CSV'})
+    svc = services()
+    # Upload streams are closed once the view returns, so keep our own copies for the
+    # streamed response. The archive goes to a temp file the recognition service can open.
+    staff_csv = request.files['staff'].read().decode('utf-8-sig')
+    photos = None
+    if 'photos' in request.files:
+        with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as photos_file:
+            shutil.copyfileobj(request.files['photos'].stream, photos_file)
+        photos = photos_file.name
+
+    def progress_lines():
+        try:
+            for progress in svc.recognition.import_staff(staff_csv, photos):
+                yield json.dumps(progress if progress['stage'] == 'done' else
+                                 {**progress, 'failures': len(progress['failures'])}) + '\n'
+        except Exception as e:
+            svc.db.log_event('ERROR', 'Import', f'Bulk import failed: {str(e)}')
+            yield json.dumps({'stage': 'error', 'message': str(e)}) + '\n'
+        finally:
+            if photos is not None:
+                os.remove(photos)
+            svc.invalidate()
+
+    return Response(stream_with_context(progress_lines()), mimetype='application/x-ndjson')
+
+
+@bp.route('/attendance')
 def attendance_view():
     """Attendance records page"""
     date_filter = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
-
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT a.*, s.name, s.department
-        FROM attendance a
-        JOIN staff s ON a.employee_id = s.employee_id
-        WHERE a.date = ?
-        ORDER BY a.time_in DESC
-    ''', (date_filter,))
-    attendance_records = cursor.fetchall()
-    conn.close()
+    try:
+        attendance_records, next_cursor = list_page(
+            'attendance', date=date_filter, sort='-id',
+            fields='id,employee_id,name,department,date,time_in,time_out,late_minutes,'
+                   'overtime_minutes,status')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
 
     return render_template('attendance.html',
                            attendance_records=attendance_records,
-                           selected_date=date_filter)
+                           selected_date=date_filter,
+                           next_cursor=next_cursor)
+
+
+@bp.route('/api/attendance')
+def list_attendance():
+    """Attendance list; supports fields, sort, limit, cursor and date/date_from/date_to filters"""
+    return list_response('attendance')
+
 
+@bp.route('/api/attendance/summary')
+def attendance_totals():
+    """Attendance totals per day (date_from/date_to) or per month (month_from/month_to)
 
-@app.route('/payroll')
+    Archived months come from their rollups, so long ranges stay cheap.
+    """
+    args = request.args
+    try:
+        if args.get('month_from') or args.get('month_to'):
+            month_to = args.get('month_to') or datetime.now().strftime('%Y-%m')
+            month_from = args.get('month_from') or month_to
+            monthly = True
+            start, end = month_from, month_to
+        else:
+            try:
+                end = date.fromisoformat(args.get('date_to') or date.today().isoformat())
+                start = date.fromisoformat(args.get('date_from') or (end - timedelta(days=30)).isoformat())
+            except ValueError:
+                raise ValueError('date_from and date_to must be YYYY-MM-DD')
+            monthly = False
+            start, end = start.isoformat(), end.isoformat()
+        if end < start:
+            raise ValueError('The range ends before it starts')
+        with services().db.read() as conn:
+            rows = attendance_summary(conn, start, end, monthly)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    return jsonify({'success': True, 'items': rows})
+
+
+@bp.route('/payroll')
 def payroll_management():
     """Payroll management page"""
     month_year = request.args.get('month_year', datetime.now().strftime('%Y-%m'))
-
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT p.*, s.name
-        FROM payroll p
-        JOIN staff s ON p.employee_id = s.employee_id
-        WHERE p.month_year = ?
-        ORDER BY s.name
-    ''', (month_year,))
-    payroll_records = cursor.fetchall()
-    conn.close()
+    try:
+        payroll_records, next_cursor = list_page('payroll', month_year=month_year)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
 
     return render_template('payroll.html',
                            payroll_records=payroll_records,
-                           selected_month=month_year)
+                           selected_month=month_year,
+                           next_cursor=next_cursor)
 
 
-@app.route('/api/generate_payroll', methods=['POST'])
+@bp.route('/api/payroll')
+def list_payroll():
+    """Payroll list; supports fields, sort, limit, cursor and month_year/department filters"""
+    return list_response('payroll')
+
+
+@bp.route('/api/generate_payroll', methods=['POST'])
 def generate_payroll():
     """Generate payroll for all employees for given month"""
+    db = services().db
     data = request.json
     month_year = data.get('month_year', datetime.now().strftime('%Y-%m'))
 
     try:
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-
-        # Get all staff
-        cursor.execute('SELECT employee_id, salary FROM staff')
-        staff_members = cursor.fetchall()
-
-        for employee_id, salary in staff_members:
-            # Calculate attendance metrics for the month
-            cursor.execute('''
-                SELECT SUM(late_minutes), SUM(overtime_minutes)
-                FROM attendance 
-                WHERE employee_id = ? AND strftime('%Y-%m', date) = ?
-            ''', (employee_id, month_year))
-            result = cursor.fetchone()
-
-            late_minutes = result[0] or 0
-            overtime_minutes = result[1] or 0
-
-            # Calculate deductions and bonuses
-            hourly_rate = salary / (22 * 8)  # Assuming 22 working days, 8 hours per day
-            late_deductions = (late_minutes / 60) * hourly_rate
-            overtime_bonus = (overtime_minutes / 60) * hourly_rate * 1.5  # 1.5x for overtime
-
-            net_salary = salary - late_deductions + overtime_bonus
-
-            # Insert or update payroll record
-            cursor.execute('''
-                INSERT OR REPLACE INTO payroll 
-                (employee_id, month_year, basic_salary, late_deductions, overtime_bonus, net_salary)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (employee_id, month_year, salary, late_deductions, overtime_bonus, net_salary))
-
-        conn.commit()
-        conn.close()
-
-        db.log_event('INFO', 'Payroll', f'Payroll generated for {month_year}')
+        count = services().payroll_engine.generate(month_year)
+
+        db.log_event('INFO', 'Payroll', f'Payroll generated for {month_year} ({count} employees)')
         return jsonify({'success': True, 'message': 'Payroll generated successfully'})
 
     except Exception as e:
@@ -181,7 +346,50 @@ def generate_payroll():
         return jsonify({'success': False, 'message': str(e)})
 
 
-@app.route('/api/upload_face', methods=['POST'])
+@bp.route('/api/payroll_so_far')
+def payroll_so_far():
+    """Month-to-date payroll totals from the running accruals"""
+    month_year = request.args.get('month_year', datetime.now().strftime('%Y-%m'))
+    try:
+        return jsonify({'success': True, **services().payroll_engine.preview(month_year)})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+
+@bp.route('/api/export/<kind>')
+def export_data(kind):
+    """Download payroll (month_year) or attendance (date_from/date_to) as CSV, CSV.gz or XLSX"""
+    if kind not in ('payroll', 'attendance'):
+        return jsonify({'success': False, 'message': f'Unknown export {kind}'})
+    db = services().db
+    export_format = request.args.get('format', 'csv')
+    try:
+        params = export_params(kind, request.args)
+        filename = f'{kind}_{"_".join(params)}'
+
+        if export_format == 'xlsx':
+            output = write_xlsx(iter_rows(db, kind, params), kind)
+            return send_file(output, as_attachment=True, download_name=f'{filename}.xlsx',
+                             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        if export_format != 'csv':
+            raise ValueError('format must be csv or xlsx')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+    chunks = csv_chunks(iter_rows(db, kind, params))
+    mimetype = 'text/csv'
+    filename += '.csv'
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = gzip_chunks(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+
+    db.log_event('INFO', 'Export', f'Exported {kind} {" to ".join(params)} as {filename}')
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+@bp.route('/api/upload_face', methods=['POST'])
 def upload_face_image():
     """Upload face image for employee"""
     if 'file' not in request.files or 'employee_id' not in request.form:
@@ -193,16 +401,11 @@ def upload_face_image():
     if file.filename == '':
         return jsonify({'success': False, 'message': 'No file selected'})
 
-    # Save uploaded file temporarily
-    temp_path = f'temp_{employee_id}.jpg'
-    file.save(temp_path)
-
-    # Add face to recognition system
-    success = face_system.add_employee_face(temp_path, employee_id)
-
-    # Clean up temp file
-    import os
-    os.remove(temp_path)
+    # Encoded by the recognition service, which also updates its gallery
+    try:
+        success = services().recognition.add_face(file.read(), employee_id)
+    except (OSError, RecognitionError) as e:
+        return jsonify({'success': False, 'message': f'Recognition service unavailable: {str(e)}'})
 
     if success:
         return jsonify({'success': True, 'message': 'Face added successfully'})
@@ -210,37 +413,81 @@ def upload_face_image():
         return jsonify({'success': False, 'message': 'Failed to process face image'})
 
 
-@app.route('/logs')
+@bp.route('/api/camera_stats')
+def camera_stats():
+    """Camera pipeline latency, drop counters and queue depths"""
+    try:
+        return jsonify(services().recognition.stats())
+    except (OSError, RecognitionError) as e:
+        return jsonify({'running': False, 'message': f'Recognition service unavailable: {str(e)}'})
+
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    """Counters, gauges and stage latency histograms in Prometheus text format"""
+    if not metrics.REGISTRY.enabled:
+        return jsonify({'success': False, 'message': 'Metrics are disabled'}), 404
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/metrics/recognition')
+def recognition_metrics():
+    """The recognition service's own metrics (the same as /metrics in the 'all' role)"""
+    try:
+        text = services().recognition.metrics_text()
+    except (OSError, RecognitionError) as e:
+        return jsonify({'success': False, 'message': f'Recognition service unavailable: {str(e)}'}), 503
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/api/profiler', methods=['GET', 'POST'])
+def sampling_profiler():
+    """POST {"action": "start"|"stop"} toggles the profiler; GET returns folded stacks
+
+    GET ?format=json returns the profiler state instead of the stacks.
+    """
+    if request.method == 'POST':
+        action = (request.json or {}).get('action')
+        if action == 'start':
+            started = metrics.PROFILER.start()
+            message = 'Profiler started' if started else 'Profiler already running'
+        elif action == 'stop':
+            metrics.PROFILER.stop()
+            message = 'Profiler stopped'
+        else:
+            return jsonify({'success': False, 'message': 'action must be start or stop'})
+        services().db.log_event('INFO', 'Profiler', message)
+        return jsonify({'success': True, 'message': message, **metrics.PROFILER.stats()})
+
+    if request.args.get('format') == 'json':
+        return jsonify({'success': True, **metrics.PROFILER.stats()})
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit must be a number'})
+    return Response(metrics.PROFILER.folded(limit), mimetype='text/plain')
+
+
+@bp.route('/logs')
 def system_logs():
     """System logs page"""
     level_filter = request.args.get('level', '')
+    try:
+        logs, next_cursor = list_page('logs')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
 
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-
-    if level_filter:
-        cursor.execute('''
-            SELECT * FROM system_logs 
-            WHERE level = ? 
-            ORDER BY timestamp DESC 
-            LIMIT 100
-        ''', (level_filter,))
-    else:
-        cursor.execute('''
-            SELECT * FROM system_logs 
-            ORDER BY timestamp DESC 
-            LIMIT 100
-        ''')
+    return render_template('logs.html', logs=logs, selected_level=level_filter,
+                           next_cursor=next_cursor)
 
-    logs = cursor.fetchall()
-    conn.close()
 
-    return render_template('logs.html', logs=logs, selected_level=level_filter)
+@bp.route('/api/logs')
+def list_logs():
+    """System log list, newest first; supports limit, cursor and level/module filters"""
+    return list_response('logs')
 
 
 if __name__ == '__main__':
-    # Start camera system
-    camera_system.start_capture()
+    from run import main
 
-    # Start Flask app
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    main()
@@ -0,0 +1,375 @@
+"""Monthly attendance partitions: closed months move out of payroll.db into their own files
+
+payroll.db keeps the open months (the hot partition). Archiving a closed
+month copies its attendance and system_logs rows to <db>.archive/YYYY-MM.db,
+stores daily and monthly rollups of it in attendance_daily and
+attendance_monthly, then deletes the rows from payroll.db in one writer
+transaction; attendance_archives is the catalog. Queries route by date
+range: segments() splits a range into pieces that are each served by one
+partition, and attached() opens an archive on a read connection while it
+is queried. payroll_accruals is never archived, so payroll for any month
+still reads one row per employee.
+
+    python archive.py list
+    python archive.py archive                  # every month older than ARCHIVE_AFTER_MONTHS
+    python archive.py archive 2024-01 2024-02
+    python archive.py compact [--hot]          # VACUUM the archives (and payroll.db)
+    python archive.py reopen 2024-01           # move a month back into payroll.db
+"""
+import argparse
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from config import Config
+from payroll import month_range
+
+# Detects rows that changed between copying a month out and deleting it from payroll.db
+FINGERPRINT = '''
+    SELECT COUNT(*), TOTAL(id), COUNT(time_out), TOTAL(late_minutes), TOTAL(overtime_minutes),
+           TOTAL(worked_minutes), TOTAL(early_leave_minutes)
+    FROM attendance WHERE date >= ? AND date < ?
+'''
+
+ROLLUP_COLUMNS = ('records', 'present', 'late', 'late_minutes', 'overtime_minutes',
+                  'worked_minutes', 'early_leave_minutes')
+ROLLUP_SELECT = '''
+    COUNT(*), COUNT(time_in), SUM(late_minutes > 0), COALESCE(SUM(late_minutes), 0),
+    COALESCE(SUM(overtime_minutes), 0), COALESCE(SUM(worked_minutes), 0),
+    COALESCE(SUM(early_leave_minutes), 0)
+'''
+
+
+def archive_dir(conn):
+    """<db stem>.archive beside the main database file of conn"""
+    path = next(row[2] for row in conn.execute('PRAGMA database_list') if row[1] == 'main')
+    return os.path.splitext(path)[0] + '.archive'
+
+
+def archived_months(conn):
+    return [row[0] for row in conn.execute('SELECT month_year FROM attendance_archives ORDER BY month_year')]
+
+
+def _month_last_day(month_year):
+    return (date.fromisoformat(month_range(month_year)[1]) - timedelta(days=1)).isoformat()
+
+
+def segments(conn, date_from=None, date_to=None):
+    """Split [date_from, date_to] into (month_year, lo, hi) pieces, one partition each
+
+    Dates are inclusive ISO strings, None for open-ended. month_year is None
+    for pieces served by payroll.db. Pieces are in date order and never
+    overlap, so results read piece by piece are already sorted by date.
+    """
+    pieces = []
+    cursor = date_from
+    for month_year in archived_months(conn):
+        start, end = month_range(month_year)
+        last = _month_last_day(month_year)
+        if date_to is not None and start > date_to:
+            break
+        if cursor is not None and last < cursor:
+            continue
+        if cursor is None or cursor < start:
+            pieces.append((None, cursor, (date.fromisoformat(start) - timedelta(days=1)).isoformat()))
+        pieces.append((month_year, max(cursor or start, start), min(date_to or last, last)))
+        cursor = end
+    if cursor is None or date_to is None or cursor <= date_to:
+        pieces.append((None, cursor, date_to))
+    return pieces
+
+
+@contextmanager
+def attached(conn, month_year=None):
+    """Schema to read a partition through on conn: 'main', or the month's archive, attached
+
+    The archive is detached again on exit.
+    """
+    if month_year is None:
+        yield 'main'
+        return
+    row = conn.execute('SELECT id, file FROM attendance_archives WHERE month_year = ?',
+                       (month_year,)).fetchone()
+    if row is None:
+        raise ValueError(f'{month_year} is not archived')
+    schema = f'archive_{row[0]}'
+    if schema not in {entry[1] for entry in conn.execute('PRAGMA database_list')}:
+        path = os.path.join(archive_dir(conn), row[1])
+        # ATTACH would silently create an empty database in its place
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'Archive of {month_year} is missing: {path}')
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+    try:
+        yield schema
+    finally:
+        try:
+            conn.execute(f'DETACH DATABASE {schema}')
+        except sqlite3.OperationalError:
+            pass  # a statement on it is still open; it is reused or closed with the connection
+
+
+def archive_month(db, month_year):
+    """Move one closed month's attendance and logs into its archive file"""
+    start, end = month_range(month_year)
+    if end > date.today().isoformat():
+        raise ValueError(f'{month_year} is not over yet')
+    with db.read() as conn:
+        if month_year in archived_months(conn):
+            raise ValueError(f'{month_year} is already archived')
+        directory = archive_dir(conn)
+    os.makedirs(directory, exist_ok=True)
+    file = f'{month_year}.db'
+    path = os.path.join(directory, file)
+    temp_path = path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    log_range = (f'{start} 00:00:00', f'{end} 00:00:00')
+
+    # Copy with a plain connection that reads payroll.db attached; both inserts share one
+    # read snapshot of it
+    conn = sqlite3.connect(temp_path, isolation_level=None)
+    try:
+        conn.execute('ATTACH DATABASE ? AS hot', (os.path.abspath(db.db_path),))
+        for table in ('attendance', 'system_logs'):
+            conn.execute(conn.execute("SELECT sql FROM hot.sqlite_master WHERE type = 'table' AND name = ?",
+                                      (table,)).fetchone()[0])
+        conn.execute('BEGIN')
+        conn.execute('INSERT INTO attendance SELECT * FROM hot.attendance WHERE date >= ? AND date < ?',
+                     (start, end))
+        conn.execute('INSERT INTO system_logs SELECT * FROM hot.system_logs '
+                     'WHERE timestamp >= ? AND timestamp < ?', log_range)
+        conn.execute('COMMIT')
+        conn.execute('DETACH DATABASE hot')
+        fingerprint = conn.execute(FINGERPRINT, (start, end)).fetchone()
+        log_rows = conn.execute('SELECT COUNT(*) FROM system_logs').fetchone()[0]
+        conn.execute('CREATE INDEX idx_attendance_date ON attendance (date)')
+        conn.execute('CREATE UNIQUE INDEX idx_attendance_employee_date ON attendance (employee_id, date)')
+        conn.execute('CREATE INDEX idx_system_logs_time ON system_logs (timestamp)')
+    finally:
+        conn.close()
+    if not fingerprint[0] and not log_rows:
+        os.remove(temp_path)
+        raise ValueError(f'Nothing to archive for {month_year}')
+    os.replace(temp_path, path)
+
+    columns = ', '.join(ROLLUP_COLUMNS)
+
+    def move(cursor):
+        if cursor.execute(FINGERPRINT, (start, end)).fetchone() != fingerprint:
+            raise RuntimeError(f'Attendance for {month_year} changed while it was archived; run again')
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO attendance_daily (date, {columns})
+            SELECT date, {ROLLUP_SELECT} FROM attendance
+            WHERE date >= ? AND date < ? GROUP BY date
+        ''', (start, end))
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO attendance_monthly (month_year, employees, {columns})
+            SELECT substr(date, 1, 7), COUNT(DISTINCT employee_id), {ROLLUP_SELECT} FROM attendance
+            WHERE date >= ? AND date < ? GROUP BY substr(date, 1, 7)
+        ''', (start, end))
+        cursor.execute('DELETE FROM attendance WHERE date >= ? AND date < ?', (start, end))
+        cursor.execute('DELETE FROM system_logs WHERE timestamp >= ? AND timestamp < ?', log_range)
+        cursor.execute('''
+            INSERT INTO attendance_archives (month_year, file, attendance_rows, log_rows)
+            VALUES (?, ?, ?, ?)
+        ''', (month_year, file, fingerprint[0], log_rows))
+
+    try:
+        db.transact(move)
+    except Exception:
+        os.remove(path)
+        raise
+    db.log_event('INFO', 'Archive', f'Archived {month_year}: {fingerprint[0]} attendance rows, '
+                                    f'{log_rows} log entries')
+    return {'month_year': month_year, 'file': file, 'attendance_rows': fingerprint[0],
+            'log_rows': log_rows}
+
+
+def closed_months(db, older_than=None):
+    """Months with attendance still in payroll.db that ended more than older_than months ago"""
+    older_than = Config.ARCHIVE_AFTER_MONTHS if older_than is None else older_than
+    today = date.today()
+    index = today.year * 12 + today.month - 1 - older_than
+    cutoff = date(index // 12, index % 12 + 1, 1).isoformat()
+    with db.read() as conn:
+        return [row[0] for row in conn.execute(
+            'SELECT DISTINCT substr(date, 1, 7) FROM attendance WHERE date < ? ORDER BY 1', (cutoff,))]
+
+
+def reopen_month(db, month_year, chunk_size=5000):
+    """Move an archived month back into payroll.db and drop its rollups
+
+    Rows go back in chunks; the month keeps being read from its archive until
+    the last step removes it from the catalog.
+    """
+    start, end = month_range(month_year)
+    with db.read() as conn:
+        row = conn.execute('SELECT file FROM attendance_archives WHERE month_year = ?',
+                           (month_year,)).fetchone()
+        if row is None:
+            raise ValueError(f'{month_year} is not archived')
+        path = os.path.join(archive_dir(conn), row[0])
+
+    restored = {}
+    source = sqlite3.connect(path)
+    try:
+        for table in ('attendance', 'system_logs'):
+            cursor = source.execute(f'SELECT * FROM {table}')
+            # Named columns, so archives written before a later migration still load
+            columns = [description[0] for description in cursor.description]
+            sql = (f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) '
+                   f'VALUES ({", ".join("?" * len(columns))})')
+            restored[table] = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                with db.write() as batch:
+                    batch.executemany(sql, rows)
+                restored[table] += len(rows)
+    finally:
+        source.close()
+
+    def drop(cursor):
+        cursor.execute('DELETE FROM attendance_archives WHERE month_year = ?', (month_year,))
+        cursor.execute('DELETE FROM attendance_daily WHERE date >= ? AND date < ?', (start, end))
+        cursor.execute('DELETE FROM attendance_monthly WHERE month_year = ?', (month_year,))
+
+    db.transact(drop)
+    os.remove(path)
+    db.log_event('INFO', 'Archive', f'Reopened {month_year}: {restored["attendance"]} attendance rows, '
+                                    f'{restored["system_logs"]} log entries')
+    return {'month_year': month_year, 'attendance_rows': restored['attendance'],
+            'log_rows': restored['system_logs']}
+
+
+def _size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+
+def compact(db, hot=False):
+    """VACUUM and ANALYZE every archive, and payroll.db too with hot=True
+
+    Returns {file: (bytes before, bytes after)}. VACUUM on payroll.db holds
+    the write lock while it runs, so writers in other processes wait (and
+    fail after busy_timeout); run it in a quiet period.
+    """
+    with db.read() as conn:
+        directory = archive_dir(conn)
+        files = [row[0] for row in conn.execute('SELECT file FROM attendance_archives ORDER BY month_year')]
+    sizes = {}
+    for file in files:
+        path = os.path.join(directory, file)
+        before = _size(path)
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            conn.execute('ANALYZE')
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+        sizes[file] = (before, _size(path))
+    if hot:
+        before = _size(db.db_path)
+        conn = db.pool.connect()
+        try:
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+        sizes[os.path.basename(db.db_path)] = (before, _size(db.db_path))
+    return sizes
+
+
+def attendance_summary(conn, start, end, monthly=False):
+    """Per-day (or per-month) attendance totals over [start, end], oldest first
+
+    start and end are ISO dates, or 'YYYY-MM' months when monthly. Archived
+    periods are read from the rollup tables without opening their files;
+    open ones are aggregated from payroll.db.
+    """
+    columns = ', '.join(ROLLUP_COLUMNS)
+    if monthly:
+        key, fields = 'month_year', ('month_year', 'employees') + ROLLUP_COLUMNS
+        start, end = month_range(start)[0], _month_last_day(end)
+    else:
+        key, fields = 'date', ('date',) + ROLLUP_COLUMNS
+    rows = []
+    for month_year, lo, hi in segments(conn, start, end):
+        if month_year is not None and monthly:
+            sql = f'SELECT month_year, employees, {columns} FROM attendance_monthly WHERE month_year = ?'
+            params = (month_year,)
+        elif month_year is not None:
+            sql = f'SELECT date, {columns} FROM attendance_daily WHERE date >= ? AND date <= ? ORDER BY date'
+            params = (lo, hi)
+        elif monthly:
+            sql = f'''
+                SELECT substr(date, 1, 7), COUNT(DISTINCT employee_id), {ROLLUP_SELECT}
+                FROM attendance WHERE date >= ? AND date <= ?
+                GROUP BY substr(date, 1, 7) ORDER BY 1
+            '''
+            params = (lo, hi)
+        else:
+            sql = f'SELECT date, {ROLLUP_SELECT} FROM attendance WHERE date >= ? AND date <= ? ' \
+                  f'GROUP BY date ORDER BY date'
+            params = (lo, hi)
+        rows.extend(dict(zip(fields, row)) for row in conn.execute(sql, params))
+    return sorted(rows, key=lambda row: row[key])
+
+
+def main():
+    from database import Database
+
+    parser = argparse.ArgumentParser(description='Monthly attendance archive commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='archived months and their sizes')
+    archive = commands.add_parser('archive', help='move closed months out of payroll.db')
+    archive.add_argument('months', nargs='*', help='YYYY-MM (default: every month older than '
+                                                   '--older-than)')
+    archive.add_argument('--older-than', type=int, default=None,
+                         help=f'months to keep in payroll.db (default {Config.ARCHIVE_AFTER_MONTHS})')
+    compact_command = commands.add_parser('compact', help='VACUUM the archive files')
+    compact_command.add_argument('--hot', action='store_true', help='VACUUM payroll.db as well')
+    reopen = commands.add_parser('reopen', help='move archived months back into payroll.db')
+    reopen.add_argument('months', nargs='+', help='YYYY-MM')
+    for command in commands.choices.values():
+        command.add_argument('--db', default='payroll.db')
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    try:
+        if args.command == 'list':
+            with db.read() as conn:
+                directory = archive_dir(conn)
+                rows = conn.execute('''
+                    SELECT month_year, file, attendance_rows, log_rows, archived_at
+                    FROM attendance_archives ORDER BY month_year
+                ''').fetchall()
+            for month_year, file, attendance_rows, log_rows, archived_at in rows:
+                path = os.path.join(directory, file)
+                size = f'{_size(path) / 1e6:.1f} MB' if os.path.exists(path) else 'MISSING'
+                print(f'{month_year}  {attendance_rows} attendance rows, {log_rows} log entries, '
+                      f'{size}, archived {archived_at}')
+            print(f'{len(rows)} archived months in {directory}')
+        elif args.command == 'archive':
+            for month_year in args.months or closed_months(db, args.older_than):
+                result = archive_month(db, month_year)
+                print(f"{month_year}: {result['attendance_rows']} attendance rows, "
+                      f"{result['log_rows']} log entries -> {result['file']}")
+        elif args.command == 'compact':
+            for file, (before, after) in compact(db, args.hot).items():
+                print(f'{file}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB')
+        else:
+            for month_year in args.months:
+                result = reopen_month(db, month_year)
+                print(f"{month_year}: {result['attendance_rows']} attendance rows, "
+                      f"{result['log_rows']} log entries restored")
+    except (ValueError, RuntimeError) as e:
+        raise SystemExit(str(e))
+    finally:
+        db.flush_logs()
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+import argparse
+import threading
+import time
+from datetime import date, datetime, time as dt_time
+
+import numpy as np
+
+from config import Config
+from payroll import accrue
+
+
+# First sighting of the day inserts time_in; the next sighting (while time_out is
+# still empty) sets time_out along with its overtime, early-leave and worked
+# minutes. RETURNING reports which of the two happened, and returns nothing
+# when the day is already closed.
+UPSERT_ATTENDANCE = '''
+    INSERT INTO attendance (employee_id, date, time_in, late_minutes)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (employee_id, date) DO UPDATE SET
+        time_out = excluded.time_in,
+        overtime_minutes = ?,
+        early_leave_minutes = ?,
+        worked_minutes = (strftime('%s', excluded.time_in) - strftime('%s', attendance.time_in)) / 60
+    WHERE attendance.time_in IS NOT NULL AND attendance.time_out IS NULL
+    RETURNING time_out IS NULL, late_minutes, overtime_minutes
+'''
+
+# Rows of one date with times and shift bounds as epoch seconds, for finalize_day()
+DAY_ROWS = '''
+    SELECT a.id, a.employee_id, a.overtime_minutes,
+           CAST(strftime('%s', a.time_in) AS INTEGER),
+           CAST(strftime('%s', a.time_out) AS INTEGER),
+           CAST(strftime('%s', a.date || ' ' || s.shift_start) AS INTEGER),
+           CAST(strftime('%s', a.date || ' ' || s.shift_end) AS INTEGER)
+    FROM attendance a
+    LEFT JOIN staff s ON s.employee_id = a.employee_id
+    WHERE a.date = ?
+'''
+
+
+def parse_shift_time(value):
+    """'HH:MM' or 'HH:MM:SS' from the staff table"""
+    return dt_time.fromisoformat(value) if value else None
+
+
+def late_minutes_for(shift_start, time_in):
+    """Whole minutes between shift start and time_in, or 0 when on time"""
+    if shift_start is None or time_in.time() <= shift_start:
+        return 0
+    return int((time_in - datetime.combine(time_in.date(), shift_start)).total_seconds()) // 60
+
+
+def overtime_minutes_for(shift_end, time_out):
+    """Whole minutes worked past shift end"""
+    if shift_end is None or time_out.time() <= shift_end:
+        return 0
+    return int((time_out - datetime.combine(time_out.date(), shift_end)).total_seconds()) // 60
+
+
+def early_leave_minutes_for(shift_end, time_out):
+    """Whole minutes left before shift end"""
+    if shift_end is None or time_out.time() >= shift_end:
+        return 0
+    return int((datetime.combine(time_out.date(), shift_end) - time_out).total_seconds()) // 60
+
+
+def event_messages(event):
+    """Log lines for one attendance event from AttendanceRecorder"""
+    employee_id = event['employee_id']
+    if event['kind'] == 'time_in':
+        messages = [f'Time in recorded for {employee_id}']
+        if event['late_minutes']:
+            messages.append(f'Late minutes calculated: {event["late_minutes"]} for {employee_id}')
+    else:
+        messages = [f'Time out recorded for {employee_id}']
+        if event['overtime_minutes']:
+            messages.append(f'Overtime minutes calculated: {event["overtime_minutes"]} for {employee_id}')
+    return messages
+
+
+def day_durations(time_in, time_out, shift_start, shift_end):
+    """Vectorized (late, overtime, early_leave, worked) minutes from epoch-second arrays
+
+    Missing values are NaN and produce 0 minutes.
+    """
+    def minutes(seconds):
+        return np.nan_to_num(np.floor(np.clip(seconds, 0, None) / 60)).astype(np.int64)
+
+    return (minutes(time_in - shift_start), minutes(time_out - shift_end),
+            minutes(shift_end - time_out), minutes(time_out - time_in))
+
+
+class ShiftTable:
+    """In-memory employee_id -> (shift_start, shift_end) and name cache of the staff table
+
+    Call invalidate() after changing staff; an unknown employee also triggers a
+    reload, and the whole table is re-read at least every ttl seconds to pick
+    up edits made by other processes.
+    """
+
+    def __init__(self, db, ttl=None):
+        self.db = db
+        self.ttl = Config.SHIFT_CACHE_TTL if ttl is None else ttl
+        self.reloads = 0
+        self._shifts = {}
+        self._names = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def name(self, employee_id):
+        self.get(employee_id)
+        return self._names.get(employee_id)
+
+    def get(self, employee_id):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+            self._load()
+        shift = self._shifts.get(employee_id)
+        # Unknown ids reload at most once a second so a newly added employee is picked up
+        if shift is None and time.monotonic() - self._loaded_at >= 1.0:
+            self._load()
+            shift = self._shifts.get(employee_id)
+        return shift
+
+    def _load(self):
+        with self._lock:
+            with self.db.read() as conn:
+                rows = conn.execute('SELECT employee_id, name, shift_start, shift_end FROM staff').fetchall()
+            self._shifts = {
+                employee_id: (parse_shift_time(start), parse_shift_time(end))
+                for employee_id, _, start, end in rows
+            }
+            self._names = {employee_id: name for employee_id, name, _, _ in rows}
+            self._loaded_at = time.monotonic()
+            self.reloads += 1
+
+
+class AttendanceRecorder:
+    """Records time-in/time-out with one upsert per event
+
+    Late minutes are worked out from the cached shift table before the event
+    reaches the database. Events are handed to the writer thread without
+    waiting, so sightings from every camera are committed together in group
+    commits. The (employee_id, date) unique key keeps concurrent sightings
+    of the same person from creating two rows.
+
+    Callables in listeners get the list of committed events after each job
+    commits, on the writer thread, so they must not block.
+    """
+
+    def __init__(self, db, shifts=None):
+        self.db = db
+        self.shifts = shifts or ShiftTable(db)
+        self.listeners = []
+
+    def record(self, employee_id, when=None):
+        """Queue one sighting; returns a Future of the events it produced"""
+        return self.record_many([(employee_id, when or datetime.now())])
+
+    def record_many(self, sightings):
+        """Queue (employee_id, datetime) sightings as one job; returns a Future of event dicts"""
+        rows = []
+        # Names ride along in the events so listeners never look them up on the writer thread
+        names = {}
+        for employee_id, when in sightings:
+            shift_start, shift_end = self.shifts.get(employee_id) or (None, None)
+            names[employee_id] = self.shifts.name(employee_id)
+            # Both outcomes are prepared; the upsert keeps whichever applies
+            rows.append((employee_id, when.date().isoformat(), when.isoformat(' '),
+                         late_minutes_for(shift_start, when),
+                         overtime_minutes_for(shift_end, when),
+                         early_leave_minutes_for(shift_end, when)))
+        future = self.db.submit(lambda cursor: self._upsert(cursor, rows, names))
+        if self.listeners:
+            future.add_done_callback(self._notify)
+        return future
+
+    def _notify(self, future):
+        if future.exception() is not None:
+            return
+        events = future.result()
+        if events:
+            for listener in self.listeners:
+                listener(events)
+
+    def _upsert(self, cursor, rows, names):
+        """Runs on the writer thread inside its transaction"""
+        events = []
+        for row in rows:
+            employee_id, day, timestamp = row[0], row[1], row[2]
+            result = cursor.execute(UPSERT_ATTENDANCE, row).fetchall()
+            if not result:
+                continue
+            is_time_in, late_minutes, overtime_minutes = result[0]
+            if is_time_in:
+                accrue(cursor, employee_id, day, late_minutes=late_minutes, days_present=1)
+            elif overtime_minutes:
+                accrue(cursor, employee_id, day, overtime_minutes=overtime_minutes)
+            events.append({
+                'employee_id': employee_id,
+                'name': names.get(employee_id),
+                'kind': 'time_in' if is_time_in else 'time_out',
+                'date': day,
+                'time': timestamp,
+                'late_minutes': late_minutes,
+                'overtime_minutes': 0 if is_time_in else overtime_minutes,
+            })
+        return events
+
+    def finalize_day(self, day):
+        """Recompute overtime, early-leave and worked minutes for every row of a date
+
+        Meant to run nightly. Times are read as epoch seconds and worked out
+        for the whole day at once with NumPy; accruals are adjusted by any
+        change in overtime. Rows still missing a time-out are marked
+        'No time-out'. Returns counts of rows updated and left open.
+        """
+        day = day.isoformat() if isinstance(day, date) else day
+
+        def finalize(cursor):
+            rows = cursor.execute(DAY_ROWS, (day,)).fetchall()
+            if not rows:
+                return {'date': day, 'updated': 0, 'open': 0}
+            ids, employee_ids, old_overtime, *times = zip(*rows)
+            time_in, time_out, shift_start, shift_end = (np.array(column, dtype=np.float64)
+                                                         for column in times)
+            _, overtime, early_leave, worked = day_durations(time_in, time_out,
+                                                                shift_start, shift_end)
+            closed = ~np.isnan(time_out)
+
+            cursor.executemany('''
+                UPDATE attendance
+                SET overtime_minutes = ?, early_leave_minutes = ?, worked_minutes = ?
+                WHERE id = ?
+            ''', zip(overtime[closed].tolist(), early_leave[closed].tolist(),
+                     worked[closed].tolist(), np.array(ids)[closed].tolist()))
+            cursor.executemany(
+                "UPDATE attendance SET status = 'No time-out' WHERE id = ?",
+                [(row_id,) for row_id in np.array(ids)[~closed].tolist()]
+            )
+
+            delta = np.where(closed, overtime, 0) - np.array(old_overtime, dtype=np.int64)
+            for index in np.flatnonzero(delta).tolist():
+                accrue(cursor, employee_ids[index], day, overtime_minutes=int(delta[index]))
+            return {'date': day, 'updated': int(closed.sum()), 'open': int((~closed).sum())}
+
+        return self.db.transact(finalize)
+
+
+def main():
+    from database import Database
+
+    parser = argparse.ArgumentParser(description='Attendance maintenance commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+    finalize = commands.add_parser('finalize', help='compute overtime and worked minutes for a date')
+    finalize.add_argument('date', nargs='?', help='YYYY-MM-DD (default: yesterday)')
+    finalize.add_argument('--db', default='payroll.db')
+    args = parser.parse_args()
+
+    day = args.date or date.fromordinal(date.today().toordinal() - 1).isoformat()
+    db = Database(args.db)
+    try:
+        result = AttendanceRecorder(db).finalize_day(day)
+        print(f"{result['date']}: {result['updated']} rows finalized, {result['open']} without time-out")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Compare IVF approximate search against exact search on a synthetic gallery
+
+    python -m benchmarks.ann_benchmark --sizes 10000 50000 --probes 1 4 8 16
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex
+from gallery import EMBEDDING_DIM, FaceGallery
+
+
+def synthetic_gallery(size, rng, n_groups=64):
+    """Face-like encodings: identities scattered around a few dense regions"""
+    centers = rng.normal(0, 0.35, size=(n_groups, EMBEDDING_DIM))
+    groups = rng.integers(0, n_groups, size)
+    gallery = centers[groups] + rng.normal(0, 0.06, size=(size, EMBEDDING_DIM))
+    return gallery.astype(np.float32)
+
+
+def probe_queries(gallery, count, rng, noise=0.025):
+    """Noisy re-captures of known faces (~0.3 away from their enrolled encoding)"""
+    rows = rng.choice(len(gallery), count, replace=False)
+    queries = gallery[rows] + rng.normal(0, noise, size=(count, EMBEDDING_DIM))
+    return queries.astype(np.float32)
+
+
+def timed_match(gallery, queries, batch, exact):
+    start = time.perf_counter()
+    results = []
+    for i in range(0, len(queries), batch):
+        results.extend(gallery.match(queries[i:i + batch], tolerance=float('inf'), exact=exact))
+    elapsed = time.perf_counter() - start
+    return [employee_id for employee_id, _ in results], elapsed * 1000 / len(queries)
+
+
+def run(size, probes, n_queries, batch, seed):
+    rng = np.random.default_rng(seed)
+    encodings = synthetic_gallery(size, rng)
+    queries = probe_queries(encodings, n_queries, rng)
+    ids = [f'EMP{i:06d}' for i in range(size)]
+
+    index = IVFIndex(min_size=0)
+    gallery = FaceGallery(index=index)
+    start = time.perf_counter()
+    gallery.load(ids, encodings)
+    build_s = time.perf_counter() - start
+
+    truth, exact_ms = timed_match(gallery, queries, batch, exact=True)
+    print(f'\nsize={size} lists={len(index.centroids)} build={build_s:.2f}s '
+          f'exact={exact_ms:.3f} ms/query')
+    print(f'{"n_probe":>8} {"recall@1":>9} {"ms/query":>9} {"speedup":>8}')
+    for n_probe in probes:
+        index.n_probe = n_probe
+        found, ann_ms = timed_match(gallery, queries, batch, exact=False)
+        recall = np.mean([a == b for a, b in zip(found, truth)])
+        print(f'{n_probe:>8} {recall:>9.4f} {ann_ms:>9.3f} {exact_ms / ann_ms:>7.1f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=1, help='faces per frame')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        run(size, args.probes, args.queries, args.batch, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Sustained attendance events per second: atomic upsert vs the legacy read-then-write path
+
+Also times the nightly finalize_day() close-out over the same day.
+
+    python -m benchmarks.attendance_benchmark --employees 20000 --cameras 8
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from attendance import AttendanceRecorder
+from benchmarks.synthetic import month_start, populate_staff
+from database import Database
+
+
+def legacy_record(db_path, employee_id, current_time):
+    """The original record_attendance: SELECT, INSERT/UPDATE, then a second connection for late minutes"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    cursor = conn.cursor()
+    today = current_time.date().isoformat()
+    cursor.execute('SELECT id, time_in, time_out FROM attendance WHERE employee_id = ? AND date = ?',
+                   (employee_id, today))
+    record = cursor.fetchone()
+    if not record:
+        cursor.execute('INSERT INTO attendance (employee_id, date, time_in) VALUES (?, ?, ?)',
+                       (employee_id, today, current_time.isoformat(' ')))
+        conn.commit()
+        late_conn = sqlite3.connect(db_path, timeout=30)
+        late_cursor = late_conn.cursor()
+        late_cursor.execute('SELECT shift_start FROM staff WHERE employee_id = ?', (employee_id,))
+        shift_start = datetime.strptime(late_cursor.fetchone()[0], '%H:%M:%S').time()
+        if current_time.time() > shift_start:
+            late_minutes = (current_time - datetime.combine(current_time.date(), shift_start)).seconds // 60
+            late_cursor.execute('UPDATE attendance SET late_minutes = ? WHERE employee_id = ? AND date = ?',
+                                (late_minutes, employee_id, today))
+            late_conn.commit()
+        late_conn.close()
+    elif record[1] and not record[2]:
+        cursor.execute('UPDATE attendance SET time_out = ? WHERE id = ?',
+                       (current_time.isoformat(' '), record[0]))
+        conn.commit()
+    conn.close()
+
+
+def sightings(employee_ids, day):
+    """A time-in and a time-out for every employee"""
+    morning = datetime.combine(day, datetime.min.time()) + timedelta(hours=9)
+    evening = morning + timedelta(hours=9)
+    return [(employee_id, morning) for employee_id in employee_ids] + \
+        [(employee_id, evening) for employee_id in employee_ids]
+
+
+def run_upsert(db, events, cameras):
+    """Each camera thread submits its share of events without waiting, as the pipeline does"""
+    recorder = AttendanceRecorder(db)
+    recorder.shifts.get(events[0][0])
+    futures = [[] for _ in range(cameras)]
+
+    def camera(index):
+        for employee_id, when in events[index::cameras]:
+            futures[index].append(recorder.record(employee_id, when))
+
+    began = time.perf_counter()
+    threads = [threading.Thread(target=camera, args=(i,)) for i in range(cameras)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for camera_futures in futures:
+        for future in camera_futures:
+            future.result()
+    return time.perf_counter() - began
+
+
+def run(employees, cameras, legacy_sample):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        employee_ids = populate_staff(db.db_path, employees)
+        day = month_start()
+
+        events = sightings(employee_ids, day)
+        commits_before = db.pool.commits
+        upsert_s = run_upsert(db, events, cameras)
+        result = {
+            'events': len(events),
+            'cameras': cameras,
+            'upsert_events_per_s': round(len(events) / upsert_s),
+            'commits': db.pool.commits - commits_before,
+        }
+
+        with db.read() as conn:
+            rows, closed = conn.execute(
+                'SELECT COUNT(*), COUNT(time_out) FROM attendance WHERE date = ?',
+                (day.isoformat(),)).fetchone()
+        result['rows_ok'] = rows == closed == employees
+
+        began = time.perf_counter()
+        AttendanceRecorder(db).finalize_day(day)
+        result['finalize_s'] = round(time.perf_counter() - began, 3)
+
+        if legacy_sample:
+            legacy_events = sightings(employee_ids[:legacy_sample], day + timedelta(days=1))
+            began = time.perf_counter()
+            for employee_id, when in legacy_events:
+                legacy_record(db.db_path, employee_id, when)
+            legacy_s = time.perf_counter() - began
+            result['legacy_events_per_s'] = round(len(legacy_events) / legacy_s)
+            result['speedup'] = round(result['upsert_events_per_s'] / result['legacy_events_per_s'], 1)
+        db.close()
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--employees', type=int, nargs='+', default=[20000])
+    parser.add_argument('--cameras', type=int, default=8, help='concurrent submitting threads')
+    parser.add_argument('--legacy-sample', type=int, default=500,
+                        help='employees run through the legacy path (0 to skip)')
+    args = parser.parse_args()
+
+    for employees in args.employees:
+        print(run(employees, args.cameras, args.legacy_sample))
+
+
+if __name__ == '__main__':
+    main()
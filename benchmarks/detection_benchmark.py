@@ -0,0 +1,158 @@
+"""Detection accuracy versus ms/frame for each detector, detection scale and encode mode
+
+Runs over a directory of local test images (.jpg/.png). Ground truth is a
+boxes.json in that directory mapping file names to lists of
+[top, right, bottom, left] face boxes in image pixels; without it, HOG at
+full resolution serves as the reference. For every detector and scale it
+reports detection recall and precision against the reference, and for
+each encode mode ('small': from the downscaled frame, 'full': cropped from
+the full-resolution image) how often the encoding of a found face is within
+FACE_MATCH_TOLERANCE of the reference encoding of the same face.
+
+    python -m benchmarks.detection_benchmark --images faces/ --detectors hog haar --scales 0.25 0.5 1
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import numpy as np
+
+from config import Config
+from detection import DETECTORS, face_crops, match_boxes
+from facial_recognition import detect_faces, encode_crops, encode_faces, prepare_frame, to_frame_box
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def load_images(directory):
+    import cv2
+
+    images = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            image = cv2.imread(os.path.join(directory, name))
+            if image is not None:
+                images[name] = image
+    return images
+
+
+def reference_faces(directory, images):
+    """{name: (boxes, encodings)} from boxes.json, or from HOG at full resolution"""
+    import face_recognition
+
+    path = os.path.join(directory, 'boxes.json')
+    boxes = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            boxes = {name: [tuple(box) for box in value] for name, value in json.load(f).items()}
+    reference = {}
+    for name, image in images.items():
+        rgb = prepare_frame(image, 1.0)
+        faces = boxes.get(name, []) if boxes else face_recognition.face_locations(rgb)
+        reference[name] = (faces, face_recognition.face_encodings(rgb, faces))
+    return reference, ('boxes.json' if boxes else 'hog@1.0')
+
+
+def median_ms(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(samples)
+
+
+def evaluate(images, reference, detector, scale, repeat):
+    """One row per encode mode for this detector and scale"""
+    found = expected = detected = 0
+    detect_ms = []
+    encode = {'small': {'ms': [], 'matched': 0, 'distances': []},
+              'full': {'ms': [], 'matched': 0, 'distances': []}}
+    for name, image in images.items():
+        ref_boxes, ref_encodings = reference[name]
+
+        def detect_once(image=image):
+            small = prepare_frame(image, scale)
+            return small, detect_faces(small, detector)
+
+        (small, locations), ms = median_ms(detect_once, repeat)
+        detect_ms.append(ms)
+        boxes = [to_frame_box(location, scale) for location in locations]
+        pairs = match_boxes(boxes, ref_boxes)
+        found += len(pairs)
+        expected += len(ref_boxes)
+        detected += len(boxes)
+
+        jobs = {'small': lambda: encode_faces(small, locations),
+                'full': lambda: encode_crops(face_crops(image, boxes))}
+        for mode, job in jobs.items():
+            encodings, ms = median_ms(job, repeat)
+            encode[mode]['ms'].append(ms)
+            for i, j in pairs:
+                distance = float(np.linalg.norm(np.asarray(encodings[i]) - np.asarray(ref_encodings[j])))
+                encode[mode]['distances'].append(distance)
+                encode[mode]['matched'] += distance <= Config.FACE_MATCH_TOLERANCE
+
+    detect = statistics.mean(detect_ms)
+    rows = []
+    for mode, result in encode.items():
+        encode_ms = statistics.mean(result['ms'])
+        rows.append({
+            'detector': detector,
+            'scale': scale,
+            'encode': mode,
+            'recall': round(found / expected, 3) if expected else None,
+            'precision': round(found / detected, 3) if detected else None,
+            # Reference faces that were both found and encoded close to their reference encoding
+            'match_rate': round(result['matched'] / expected, 3) if expected else None,
+            'mean_distance': round(statistics.mean(result['distances']), 4) if result['distances'] else None,
+            'detect_ms': round(detect, 2),
+            'encode_ms': round(encode_ms, 2),
+            'frame_ms': round(detect + encode_ms, 2),
+        })
+    return rows
+
+
+def print_table(rows):
+    columns = ('detector', 'scale', 'encode', 'recall', 'precision', 'match_rate', 'mean_distance',
+               'detect_ms', 'encode_ms', 'frame_ms')
+    print('  '.join(f'{column:>13}' for column in columns))
+    for row in rows:
+        print('  '.join(f'{"-" if row[column] is None else row[column]!s:>13}' for column in columns))
+
+
+def run(directory, detectors, scales, repeat):
+    images = load_images(directory)
+    if not images:
+        raise SystemExit(f'No images in {directory}')
+    reference, source = reference_faces(directory, images)
+    rows = []
+    for detector in detectors:
+        for scale in scales:
+            rows.extend(evaluate(images, reference, detector, scale, repeat))
+    return {'images': len(images), 'faces': sum(len(boxes) for boxes, _ in reference.values()),
+            'reference': source, 'rows': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', required=True, help='directory of test images (and boxes.json)')
+    parser.add_argument('--detectors', nargs='+', default=['hog', 'haar'], choices=DETECTORS)
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.25, 0.35, 0.5, 0.75, 1.0])
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per image (median)')
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.images, args.detectors, args.scales, args.repeat)
+    print(f"{results['images']} images, {results['faces']} reference faces ({results['reference']})")
+    print_table(results['rows'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
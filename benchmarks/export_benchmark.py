@@ -0,0 +1,77 @@
+"""Peak memory of the streaming attendance CSV export vs building the file in memory
+
+    python -m benchmarks.export_benchmark --employees 10000 50000 --days 22
+"""
+import argparse
+import csv
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import month_start, populate_attendance, populate_staff, working_days
+from database import Database
+from export import EXPORTS, csv_chunks, gzip_chunks, iter_rows
+
+
+def materialized_export(db, kind, params):
+    """fetchall into a list, csv into one StringIO"""
+    header, sql = EXPORTS[kind]
+    with db.read() as conn:
+        rows = conn.execute(sql.format(schema='main'), params).fetchall()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return len(buffer.getvalue().encode())
+
+
+def streamed_export(db, kind, params, compress=False):
+    chunks = csv_chunks(iter_rows(db, kind, params))
+    if compress:
+        chunks = gzip_chunks(chunks)
+    return sum(len(chunk) for chunk in chunks)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    began = time.perf_counter()
+    size = function(*args)
+    elapsed = time.perf_counter() - began
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+
+def run(employees, days):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        employee_ids = populate_staff(db.db_path, employees)
+        dates = working_days(month_start(), days)
+        populate_attendance(db.db_path, employee_ids, dates)
+        params = (dates[0].isoformat(), dates[-1].isoformat())
+
+        result = {'rows': employees * days}
+        for label, function, extra in (('streamed', streamed_export, ()),
+                                       ('streamed_gzip', streamed_export, (True,)),
+                                       ('materialized', materialized_export, ())):
+            size, elapsed, peak = measure(function, db, 'attendance', params, *extra)
+            result[label] = {'mb': round(size / 1e6, 1), 's': round(elapsed, 2),
+                             'peak_mb': round(peak / 1e6, 2)}
+        db.close()
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--employees', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--days', type=int, default=22)
+    args = parser.parse_args()
+
+    for employees in args.employees:
+        print(run(employees, args.days))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Time set-based payroll generation against the legacy per-employee loop
+
+    python -m benchmarks.payroll_benchmark --sizes 10000 100000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.synthetic import month_start, populate_attendance, populate_staff, working_days
+from database import Database
+from payroll import PayrollEngine
+
+
+def legacy_generate(db_path, month_year, employee_ids):
+    """The original /api/generate_payroll loop, restricted to employee_ids"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    for employee_id in employee_ids:
+        cursor.execute('SELECT salary FROM staff WHERE employee_id = ?', (employee_id,))
+        salary = cursor.fetchone()[0]
+        cursor.execute('''
+            SELECT SUM(late_minutes), SUM(overtime_minutes)
+            FROM attendance
+            WHERE employee_id = ? AND strftime('%Y-%m', date) = ?
+        ''', (employee_id, month_year))
+        result = cursor.fetchone()
+        late_minutes = result[0] or 0
+        overtime_minutes = result[1] or 0
+        hourly_rate = salary / (22 * 8)
+        late_deductions = (late_minutes / 60) * hourly_rate
+        overtime_bonus = (overtime_minutes / 60) * hourly_rate * 1.5
+        cursor.execute('''
+            INSERT OR REPLACE INTO payroll
+            (employee_id, month_year, basic_salary, late_deductions, overtime_bonus, net_salary)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (employee_id, month_year, salary, late_deductions, overtime_bonus,
+              salary - late_deductions + overtime_bonus))
+    conn.commit()
+    conn.close()
+
+
+def payroll_totals(db, month_year, employee_ids):
+    """{employee_id: (late_deductions, overtime_bonus, net_salary)} from the payroll table"""
+    with db.read() as conn:
+        rows = conn.execute(f'''
+            SELECT employee_id, late_deductions, overtime_bonus, net_salary FROM payroll
+            WHERE month_year = ? AND employee_id IN ({", ".join("?" * len(employee_ids))})
+        ''', (month_year, *employee_ids)).fetchall()
+    return {employee_id: totals for employee_id, *totals in rows}
+
+
+def totals_match(expected, actual, tolerance=0.01):
+    return expected.keys() == actual.keys() and all(
+        abs(a - b) <= tolerance for key in expected for a, b in zip(expected[key], actual[key]))
+
+
+def run(size, days, legacy_sample):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        start = month_start()
+        employee_ids = populate_staff(db.db_path, size)
+        populate_attendance(db.db_path, employee_ids, working_days(start, days))
+        month_year = start.strftime('%Y-%m')
+
+        engine = PayrollEngine(db)
+        # Attendance was bulk-loaded around the write path, so rebuild the accruals
+        # generate() reads from
+        engine.reconcile()
+        began = time.perf_counter()
+        engine.generate(month_year)
+        engine_s = time.perf_counter() - began
+
+        result = {'employees': size, 'attendance_rows': size * days, 'engine_s': round(engine_s, 3)}
+        if legacy_sample:
+            sample = employee_ids[:legacy_sample]
+            engine_totals = payroll_totals(db, month_year, sample)
+            began = time.perf_counter()
+            legacy_generate(db.db_path, month_year, sample)
+            legacy_s = (time.perf_counter() - began) * size / len(sample)
+            if not totals_match(engine_totals, payroll_totals(db, month_year, sample)):
+                raise RuntimeError('Set-based and legacy payroll disagree on the sampled employees')
+            result['legacy_s_estimated'] = round(legacy_s, 1)
+            result['speedup'] = round(legacy_s / engine_s, 1)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--days', type=int, default=22, help='working days of attendance')
+    parser.add_argument('--legacy-sample', type=int, default=50,
+                        help='employees timed with the legacy loop, extrapolated to the full size '
+                             '(0 to skip)')
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        print(run(size, args.days, args.legacy_sample))
+
+
+if __name__ == '__main__':
+    main()
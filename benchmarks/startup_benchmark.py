@@ -0,0 +1,95 @@
+"""Startup time and resident memory of a fresh process per app role
+
+Each run is a new interpreter that imports app and calls create_app(role)
+against a synthetic database, then reports its wall time, peak RSS and
+whether OpenCV, face_recognition or dlib ended up loaded. The 'web' role
+needs no recognition service for this; its event subscription just keeps
+retrying in the background.
+
+    python -m benchmarks.startup_benchmark --employees 20000 --runs 5
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import populate_staff
+from database import Database
+from gallery import EMBEDDING_DIM, EMBEDDING_DTYPE, EMBEDDING_VERSION
+
+HEAVY_MODULES = ('cv2', 'face_recognition', 'dlib')
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def populate_embeddings(db, employee_ids, seed=0):
+    rng = np.random.default_rng(seed)
+    with db.write() as batch:
+        batch.executemany('INSERT INTO face_embeddings (employee_id, version, embedding) VALUES (?, ?, ?)',
+                          ((employee_id, EMBEDDING_VERSION,
+                            rng.standard_normal(EMBEDDING_DIM).astype(EMBEDDING_DTYPE).tobytes())
+                           for employee_id in employee_ids))
+
+
+def child(role):
+    """Runs in the measured process; prints one JSON line"""
+    began = time.perf_counter()
+    from app import create_app
+
+    create_app(role)
+    elapsed = time.perf_counter() - began
+    # ru_maxrss is in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'s': elapsed, 'peak_rss_mb': peak_mb,
+                      'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules]}))
+
+
+def measure(role, cwd, env):
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.startup_benchmark', '--child', role],
+                            cwd=cwd, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(employees, runs, roles):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'payroll.db'))
+        populate_embeddings(db, populate_staff(db.db_path, employees))
+        db.close()
+
+        # The benchmark package must stay importable from the temp working directory
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [REPO, os.environ.get('PYTHONPATH')])),
+               'PAYROLL_RECOGNITION_PORT': '1'}
+        result = {'employees': employees}
+        for role in roles:
+            samples = [measure(role, tmp, env) for _ in range(runs)]
+            result[role] = {
+                'median_s': round(statistics.median(sample['s'] for sample in samples), 3),
+                'max_s': round(max(sample['s'] for sample in samples), 3),
+                'peak_rss_mb': round(max(sample['peak_rss_mb'] for sample in samples), 1),
+                'heavy_modules': samples[-1]['heavy_modules'],
+            }
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--employees', type=int, default=20000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--roles', nargs='+', default=['all', 'web'])
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+    else:
+        print(json.dumps(run(args.employees, args.runs, args.roles), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""Offline benchmark suite: gallery matching, recognition, attendance ingest, payroll and routes
+
+Everything runs on synthetic data in a temporary directory. Results are
+written as JSON and can be compared against a stored baseline; the exit
+status is 1 when any metric regressed by more than the tolerance.
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --baseline bench.json --tolerance 0.25
+    python -m benchmarks.suite --profile full --only gallery payroll
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from ann_index import IVFIndex
+from attendance import AttendanceRecorder
+from benchmarks.ann_benchmark import probe_queries, synthetic_gallery
+from benchmarks.attendance_benchmark import run_upsert, sightings
+from benchmarks.synthetic import month_start, populate_attendance, populate_staff, working_days
+from database import Database
+from gallery import FaceGallery
+from payroll import PayrollEngine
+
+PROFILES = {
+    'quick': {'gallery_sizes': [100, 1000, 10000], 'faces_per_frame': 4, 'frames': 200,
+              'employees': 2000, 'years': 1, 'cameras': 4, 'repeat': 5, 'route_requests': 20},
+    'full': {'gallery_sizes': [100, 1000, 10000, 100000], 'faces_per_frame': 4, 'frames': 500,
+             'employees': 10000, 'years': 2, 'cameras': 8, 'repeat': 5, 'route_requests': 50},
+}
+
+CASES = ('gallery', 'recognition', 'attendance', 'payroll', 'routes')
+
+FRAME_SHAPE = (720, 1280, 3)
+
+
+def latency(samples_ms):
+    """Median and p95 of per-call timings; lower is better"""
+    samples = np.asarray(samples_ms)
+    return {'value': round(float(np.median(samples)), 4),
+            'p95': round(float(np.percentile(samples, 95)), 4),
+            'unit': 'ms', 'better': 'lower', 'samples': len(samples)}
+
+
+def rate(count, seconds, unit):
+    return {'value': round(count / seconds, 1), 'unit': unit, 'better': 'higher'}
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - began) * 1000)
+    return samples
+
+
+def bench_gallery(settings, dataset, metrics):
+    """Batched matching of one frame's faces against galleries of each size"""
+    rng = np.random.default_rng(settings['seed'])
+    faces = settings['faces_per_frame']
+    for size in settings['gallery_sizes']:
+        encodings = synthetic_gallery(size, rng)
+        queries = probe_queries(encodings, min(settings['frames'] * faces, size), rng)
+        ids = [f'EMP{i:06d}' for i in range(size)]
+        frames = [queries[i:i + faces] for i in range(0, len(queries), faces)]
+
+        gallery = FaceGallery()
+        metrics[f'gallery.load.{size}'] = latency(
+            timed(lambda: gallery.load(ids, encodings), settings['repeat']))
+        metrics[f'gallery.match_exact.{size}'] = latency(
+            [timed(lambda frame=frame: gallery.match(frame, exact=True), 1)[0] for frame in frames])
+
+        if size >= 10000:
+            indexed = FaceGallery(index=IVFIndex(min_size=0))
+            indexed.load(ids, encodings)
+            metrics[f'gallery.match_ivf.{size}'] = latency(
+                [timed(lambda frame=frame: indexed.match(frame), 1)[0] for frame in frames])
+
+
+def bench_recognition(settings, dataset, metrics):
+    """recognize_face() cost split into downscale + match on pre-computed detections, and detection"""
+    from facial_recognition import DETECTION_SCALE, FaceRecognitionSystem, detect_faces, prepare_frame
+
+    rng = np.random.default_rng(settings['seed'])
+    size = max(settings['gallery_sizes'])
+    encodings = synthetic_gallery(size, rng)
+    face_system = FaceRecognitionSystem()
+    face_system.gallery.load([f'EMP{i:06d}' for i in range(size)], encodings)
+
+    faces = settings['faces_per_frame']
+    frame = rng.integers(0, 256, size=FRAME_SHAPE, dtype=np.uint8)
+    small_h, small_w = int(FRAME_SHAPE[0] * DETECTION_SCALE), int(FRAME_SHAPE[1] * DETECTION_SCALE)
+    # Evenly spaced boxes in the downscaled frame, as face_locations() would return them
+    step = small_w // faces
+    locations = [(small_h // 4, step * i + step - 4, small_h // 4 + step - 8, step * i + 4)
+                 for i in range(faces)]
+
+    samples = []
+    for _ in range(settings['frames']):
+        detections = probe_queries(encodings, faces, rng)
+        # match_detections draws on the frame; the copy is not part of the measured work
+        target = frame.copy()
+        began = time.perf_counter()
+        prepare_frame(frame, DETECTION_SCALE)
+        face_system.match_detections(target, locations, detections, DETECTION_SCALE)
+        samples.append((time.perf_counter() - began) * 1000)
+    metrics[f'recognition.prepare_and_match.{size}'] = latency(samples)
+
+    try:
+        import face_recognition  # noqa: F401
+    except ImportError:
+        dataset['skipped']['recognition.detect'] = 'face_recognition is not installed'
+        return
+    small = prepare_frame(frame, DETECTION_SCALE)
+    metrics['recognition.detect'] = latency(timed(lambda: detect_faces(small), settings['repeat']))
+
+
+def bench_attendance(settings, dataset, metrics):
+    """Sustained time-in/time-out events per second from concurrent camera threads"""
+    db = dataset['db']
+    day = dataset['days'][-1] + timedelta(days=1)
+    events = sightings(dataset['employee_ids'], day)
+    seconds = run_upsert(db, events, settings['cameras'])
+    metrics['attendance.ingest'] = rate(len(events), seconds, 'events/s')
+
+    metrics['attendance.finalize_day'] = latency(
+        timed(lambda: AttendanceRecorder(db).finalize_day(day), 1))
+
+
+def bench_payroll(settings, dataset, metrics):
+    """Generating and previewing the latest month over years of attendance"""
+    engine = PayrollEngine(dataset['db'])
+    month_year = dataset['month_year']
+    metrics['payroll.generate'] = latency(timed(lambda: engine.generate(month_year), settings['repeat']))
+    # Preview is cheap enough that a handful of samples is mostly noise
+    metrics['payroll.preview'] = latency(timed(lambda: engine.preview(month_year), settings['repeat'] * 10))
+
+
+def bench_routes(settings, dataset, metrics):
+    """Every read route plus payroll generation through the Flask test client"""
+    from app import create_app
+
+    client = create_app('all').test_client()
+    day = dataset['days'][-1].isoformat()
+    month_year = dataset['month_year']
+    requests = [
+        ('dashboard', 'GET', '/dashboard'),
+        ('api_dashboard', 'GET', '/api/dashboard'),
+        ('staff', 'GET', '/staff'),
+        ('api_staff', 'GET', '/api/staff?limit=100'),
+        ('attendance', 'GET', f'/attendance?date={day}'),
+        ('api_attendance', 'GET', f'/api/attendance?date={day}&limit=100'),
+        ('payroll', 'GET', f'/payroll?month_year={month_year}'),
+        ('api_payroll', 'GET', f'/api/payroll?month_year={month_year}&limit=100'),
+        ('payroll_so_far', 'GET', f'/api/payroll_so_far?month_year={month_year}'),
+        ('export_payroll_csv', 'GET', f'/api/export/payroll?month_year={month_year}'),
+        ('logs', 'GET', '/logs'),
+        ('api_logs', 'GET', '/api/logs?limit=100'),
+        ('generate_payroll', 'POST', '/api/generate_payroll'),
+    ]
+
+    for name, method, url in requests:
+        def call():
+            if method == 'POST':
+                response = client.post(url, json={'month_year': month_year})
+            else:
+                response = client.get(url)
+            response.get_data()  # drain streamed bodies
+            return response.status_code
+
+        # Warm up templates and caches; a broken route is reported, not timed
+        status = call()
+        if status != 200:
+            dataset['skipped'][f'route.{name}'] = f'{method} {url} returned {status}'
+            continue
+        metrics[f'route.{name}'] = latency(timed(call, settings['route_requests']))
+
+
+BENCHMARKS = {
+    'gallery': bench_gallery,
+    'recognition': bench_recognition,
+    'attendance': bench_attendance,
+    'payroll': bench_payroll,
+    'routes': bench_routes,
+}
+
+
+def build_dataset(settings):
+    """Staff plus `years` of daily attendance in ./payroll.db, where app.py looks for it"""
+    db = Database('payroll.db')
+    employee_ids = populate_staff(db.db_path, settings['employees'], seed=settings['seed'])
+    days = working_days(month_start(2024 - settings['years'], 1), 261 * settings['years'])
+    populate_attendance(db.db_path, employee_ids, days, seed=settings['seed'])
+    # Accruals are normally kept by the write path; rebuild them for the bulk-loaded rows
+    PayrollEngine(db).reconcile()
+    return {'db': db, 'employee_ids': employee_ids, 'days': days,
+            'month_year': days[-1].strftime('%Y-%m'), 'skipped': {}}
+
+
+def run(profile, cases, seed=0):
+    settings = dict(PROFILES[profile], seed=seed)
+    metrics = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            began = time.perf_counter()
+            dataset = build_dataset(settings)
+            setup_s = time.perf_counter() - began
+            for case in cases:
+                print(f'{case}...', file=sys.stderr, flush=True)
+                try:
+                    BENCHMARKS[case](settings, dataset, metrics)
+                except ImportError as e:
+                    dataset['skipped'][case] = str(e)
+            dataset['db'].close()
+        finally:
+            os.chdir(cwd)
+
+    return {
+        'meta': {
+            'profile': profile,
+            'settings': settings,
+            'cases': list(cases),
+            'attendance_rows': settings['employees'] * len(dataset['days']),
+            'setup_s': round(setup_s, 1),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'metrics': metrics,
+        'skipped': dataset['skipped'],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Per-metric change against the baseline; returns (rows, regressed metric names)"""
+    rows, regressions = [], []
+    for name, metric in sorted(results['metrics'].items()):
+        base = baseline.get('metrics', {}).get(name)
+        if not base or not base['value']:
+            rows.append((name, metric, None, ''))
+            continue
+        change = metric['value'] / base['value'] - 1
+        worse = change > tolerance if metric['better'] == 'lower' else change < -tolerance
+        if worse:
+            regressions.append(name)
+        rows.append((name, metric, change, 'REGRESSION' if worse else ''))
+    return rows, regressions
+
+
+def print_table(rows):
+    print(f'{"metric":<44} {"value":>12} {"unit":<9} {"change":>8}')
+    for name, metric, change, flag in rows:
+        change_text = '' if change is None else f'{change:+.1%}'
+        print(f'{name:<44} {metric["value"]:>12} {metric["unit"]:<9} {change_text:>8} {flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    parser.add_argument('--only', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown before a metric counts as a regression')
+    args = parser.parse_args()
+
+    results = run(args.profile, args.only, args.seed)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    baseline = {'metrics': {}}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        baseline_profile = baseline.get('meta', {}).get('profile')
+        if baseline_profile != args.profile:
+            print(f'warning: baseline was recorded with profile {baseline_profile}', file=sys.stderr)
+    rows, regressions = compare(results, baseline, args.tolerance)
+    print_table(rows)
+    for name, reason in results['skipped'].items():
+        print(f'skipped {name}: {reason}')
+    if regressions:
+        print(f'{len(regressions)} regressions beyond {args.tolerance:.0%}: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
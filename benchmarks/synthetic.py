@@ -0,0 +1,72 @@
+"""Synthetic staff and attendance data for offline benchmarks"""
+import random
+import sqlite3
+from datetime import date, datetime, timedelta
+
+
+def populate_staff(db_path, count, seed=0):
+    """Insert `count` employees with 08:00-17:00 or 09:00-18:00 shifts"""
+    rng = random.Random(seed)
+    rows = [
+        (f'EMP{i:06d}', f'Employee {i}', f'Dept {i % 40}', 'Staff',
+         round(rng.uniform(2000, 9000), 2), *rng.choice([('08:00:00', '17:00:00'),
+                                                          ('09:00:00', '18:00:00')]))
+        for i in range(count)
+    ]
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany('''
+            INSERT INTO staff (employee_id, name, department, position, salary, shift_start, shift_end)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def working_days(start, days):
+    """The first `days` weekdays on or after `start`"""
+    current = start
+    result = []
+    while len(result) < days:
+        if current.weekday() < 5:
+            result.append(current)
+        current += timedelta(days=1)
+    return result
+
+
+def populate_attendance(db_path, employee_ids, days, seed=0, batch_size=100000):
+    """One attendance row per employee per day with random late/overtime minutes"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+
+    def rows():
+        for day in days:
+            for employee_id in employee_ids:
+                time_in = datetime.combine(day, datetime.min.time()) + timedelta(
+                    hours=8, minutes=rng.randint(0, 45))
+                time_out = time_in + timedelta(hours=9, minutes=rng.randint(0, 90))
+                yield (employee_id, day.isoformat(), time_in.isoformat(' '), time_out.isoformat(' '),
+                       max(0, rng.randint(-20, 15)), max(0, rng.randint(-60, 60)))
+
+    batch = []
+    with conn:
+        for row in rows():
+            batch.append(row)
+            if len(batch) >= batch_size:
+                conn.executemany('''
+                    INSERT INTO attendance
+                    (employee_id, date, time_in, time_out, late_minutes, overtime_minutes)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', batch)
+                batch.clear()
+        if batch:
+            conn.executemany('''
+                INSERT INTO attendance
+                (employee_id, date, time_in, time_out, late_minutes, overtime_minutes)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', batch)
+    conn.close()
+
+
+def month_start(year=2024, month=3):
+    return date(year, month, 1)
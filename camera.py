@@ -1,128 +1,152 @@
-
-import sqlite3
-import cv2
-import threading
-import time
 from facial_recognition import FaceRecognitionSystem
-from database import Database
+from config import Config
+from tracker import FaceTracker
+from attendance import AttendanceRecorder, event_messages
 from datetime import datetime
+import time
+import metrics
+
+ATTENDANCE_EVENTS = metrics.counter('payroll_attendance_events_total',
+                                    'Committed attendance events by kind, plus errors', ('kind',))
+ATTENDANCE_COMMIT_SECONDS = metrics.histogram('payroll_attendance_commit_seconds',
+                                              'From record_attendance() to its group commit')
 
 
 class IPCameraSystem:
-    def __init__(self, camera_url=0):  # 0 for default camera, or RTSP URL for IP camera
-        self.capture_thread = None
+    def __init__(self, camera_url=0, face_system=None, target_fps=None, workers=None,
+                 headless=None):  # 0 for default camera, or RTSP URL for IP camera
         self.camera_url = camera_url
-        self.face_system = FaceRecognitionSystem()
-        self.db = Database()
-        self.is_running = False
-        self.current_frame = None
+        # Share the caller's gallery so enrollments are visible to recognition
+        self.face_system = face_system or FaceRecognitionSystem()
+        self.db = self.face_system.db
+        self.attendance = AttendanceRecorder(self.db)
+        self.target_fps = Config.CAMERA_TARGET_FPS if target_fps is None else target_fps
+        self.workers = Config.CAMERA_WORKERS if workers is None else workers
+        self.headless = Config.CAMERA_HEADLESS if headless is None else headless
+        self.pipeline = None
+
+    @property
+    def is_running(self):
+        return self.pipeline is not None and self.pipeline.is_running
+
+    @property
+    def current_frame(self):
+        return self.pipeline.current_frame if self.pipeline else None
+
+    def _camera_urls(self):
+        """Mapping of camera name to URL handled by this system"""
+        return {'camera0': self.camera_url}
+
+    def _create_stream(self, name, camera):
+        """Build a stream from a URL, or a dict with 'url' plus per-camera overrides"""
+        # pipeline and motion pull in cv2; import them only once a camera is actually used
+        from detection import ScaleTuner
+        from motion import MotionGate
+        from pipeline import CameraStream
+
+        options = camera if isinstance(camera, dict) else {'url': camera}
+        motion_gate = MotionGate(
+            enabled=options.get('motion_gate', Config.MOTION_GATE_ENABLED),
+            threshold=options.get('motion_threshold', Config.MOTION_GATE_THRESHOLD),
+            min_area=options.get('motion_min_area', Config.MOTION_GATE_MIN_AREA),
+            idle_interval=options.get('motion_idle_interval', Config.MOTION_GATE_IDLE_INTERVAL),
+        )
+        tracker = FaceTracker(
+            iou_threshold=Config.TRACK_IOU_THRESHOLD,
+            max_age=Config.TRACK_MAX_AGE,
+            confirm_matches=Config.TRACK_CONFIRM_MATCHES,
+            max_encodes=Config.TRACK_MAX_ENCODES,
+        )
+        scale = options.get('detection_scale', Config.FACE_DETECTION_SCALE)
+        tuner = None
+        if options.get('autotune', Config.FACE_AUTOTUNE):
+            tuner = ScaleTuner(
+                options.get('autotune_scales', Config.FACE_AUTOTUNE_SCALES),
+                budget_ms=options.get('autotune_budget_ms', Config.FACE_AUTOTUNE_BUDGET_MS),
+                samples=Config.FACE_AUTOTUNE_SAMPLES,
+                recalibrate_interval=Config.FACE_AUTOTUNE_INTERVAL,
+                scale=scale,
+            )
+        return CameraStream(name, options['url'], queue_size=Config.CAMERA_FRAME_QUEUE_SIZE,
+                            target_fps=options.get('target_fps', self.target_fps),
+                            motion_gate=motion_gate, tracker=tracker,
+                            detector=options.get('detector', Config.FACE_DETECTOR),
+                            scale=scale, tuner=tuner)
 
     def start_capture(self):
-        """Start camera capture in separate thread"""
-        self.is_running = True
-        self.capture_thread = threading.Thread(target=self._capture_loop)
-        self.capture_thread.daemon = True
-        self.capture_thread.start()
-        self.db.log_event('INFO', 'Camera', 'Camera capture started')
+        """Start the grab/detect/match/sink pipeline threads"""
+        from pipeline import FramePipeline
+
+        if self.is_running:
+            return
+        streams = [self._create_stream(name, camera) for name, camera in self._camera_urls().items()]
+        self.pipeline = FramePipeline(
+            streams, self.face_system, self.record_attendance,
+            workers=self.workers, headless=self.headless,
+            attendance_cooldown=Config.ATTENDANCE_COOLDOWN,
+            encode_full_res=Config.FACE_ENCODE_FULL_RES, crop_size=Config.FACE_CROP_SIZE
+        )
+        self.pipeline.start()
+        self.db.log_event('INFO', 'Camera', f'Camera capture started ({len(streams)} streams)')
 
     def stop_capture(self):
         """Stop camera capture"""
-        self.is_running = False
+        if self.pipeline:
+            self.pipeline.stop()
         self.db.log_event('INFO', 'Camera', 'Camera capture stopped')
 
-    def _capture_loop(self):
-        """Main capture loop"""
-        cap = cv2.VideoCapture(self.camera_url)
-
-        while self.is_running:
-            ret, frame = cap.read()
-            if ret:
-                # Process frame for face recognition
-                processed_frame, recognized_employees = self.face_system.recognize_face(frame)
-                self.current_frame = processed_frame
-
-                # Record attendance for recognized employees
-                for employee_id in recognized_employees:
-                    self.record_attendance(employee_id)
-
-                # Display frame (optional)
-                cv2.imshow('Payroll System - Face Recognition', processed_frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-
-            time.sleep(1)  # Process 1 frame per second
-
-        cap.release()
-        cv2.destroyAllWindows()
+    def stats(self):
+        """Per-stage latency, drop counters, queue depths and per-camera fps"""
+        if not self.pipeline:
+            return {'running': False}
+        return self.pipeline.stats()
 
     def record_attendance(self, employee_id):
-        """Record employee attendance"""
+        """Queue an attendance event; committed alongside other cameras' events"""
         try:
-            current_time = datetime.now()
-            today = current_time.date()
-
-            conn = sqlite3.connect(self.db.db_path)
-            cursor = conn.cursor()
-
-            # Check if already recorded today
-            cursor.execute(
-                'SELECT id, time_in, time_out FROM attendance WHERE employee_id = ? AND date = ?',
-                (employee_id, today)
-            )
-            record = cursor.fetchone()
-
-            if not record:
-                # First entry today - record time_in
-                cursor.execute(
-                    'INSERT INTO attendance (employee_id, date, time_in) VALUES (?, ?, ?)',
-                    (employee_id, today, current_time)
-                )
-                self.db.log_event('INFO', 'Attendance', f'Time in recorded for {employee_id}')
-
-                # Calculate late minutes
-                self._calculate_late_minutes(employee_id, current_time)
-
-            elif record[1] and not record[2]:
-                # Time in recorded but no time out - record time_out
-                cursor.execute(
-                    'UPDATE attendance SET time_out = ? WHERE id = ?',
-                    (current_time, record[0])
-                )
-                self.db.log_event('INFO', 'Attendance', f'Time out recorded for {employee_id}')
-
-            conn.commit()
-            conn.close()
-
+            started = time.perf_counter()
+            future = self.attendance.record(employee_id, datetime.now())
+            future.add_done_callback(
+                lambda done: ATTENDANCE_COMMIT_SECONDS.observe(time.perf_counter() - started))
+            future.add_done_callback(self._log_attendance)
         except Exception as e:
             self.db.log_event('ERROR', 'Attendance', f'Error recording attendance: {str(e)}')
 
-    def _calculate_late_minutes(self, employee_id, time_in):
-        """Calculate late minutes based on shift timing"""
-        conn = sqlite3.connect(self.db.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            'SELECT shift_start FROM staff WHERE employee_id = ?',
-            (employee_id,)
-        )
-        result = cursor.fetchone()
-
-        if result:
-            shift_start_str = result[0]
-            shift_start = datetime.strptime(shift_start_str, '%H:%M:%S').time()
-            time_in_time = time_in.time()
-
-            if time_in_time > shift_start:
-                late_minutes = (datetime.combine(time_in.date(), time_in_time) -
-                                datetime.combine(time_in.date(), shift_start)).seconds // 60
-
-                cursor.execute(
-                    'UPDATE attendance SET late_minutes = ? WHERE employee_id = ? AND date = ?',
-                    (late_minutes, employee_id, time_in.date())
-                )
+    def _log_attendance(self, future):
+        """Log the outcome once the event's group commit has finished"""
+        try:
+            for event in future.result():
+                ATTENDANCE_EVENTS.labels(event['kind']).inc()
+                for message in event_messages(event):
+                    self.db.log_event('INFO', 'Attendance', message)
+        except Exception as e:
+            ATTENDANCE_EVENTS.labels('error').inc()
+            self.db.log_event('ERROR', 'Attendance', f'Error recording attendance: {str(e)}')
 
-                self.db.log_event('INFO', 'Attendance',
-                                  f'Late minutes calculated: {late_minutes} for {employee_id}')
 
-        conn.commit()
-        conn.close()
\ No newline at end of file
+class CameraManager(IPCameraSystem):
+    """Runs many camera streams against one shared gallery and worker pool"""
+
+    def __init__(self, camera_urls, face_system=None, target_fps=None, workers=None,
+                 headless=None):
+        super().__init__(camera_url=None, face_system=face_system, target_fps=target_fps,
+                         workers=workers, headless=headless)
+        if not isinstance(camera_urls, dict):
+            camera_urls = {f'camera{i}': url for i, url in enumerate(camera_urls)}
+        self.camera_urls = dict(camera_urls)
+
+    def _camera_urls(self):
+        return self.camera_urls
+
+    def add_camera(self, name, camera):
+        """Add a stream (URL or options dict); starts immediately if the manager is running"""
+        self.camera_urls[name] = camera
+        if self.pipeline:
+            self.pipeline.add_stream(self._create_stream(name, camera))
+        self.db.log_event('INFO', 'Camera', f'Camera {name} added')
+
+    def remove_camera(self, name):
+        self.camera_urls.pop(name, None)
+        if self.pipeline:
+            self.pipeline.remove_stream(name)
+        self.db.log_event('INFO', 'Camera', f'Camera {name} removed')
@@ -4,10 +4,87 @@ import os
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
     DATABASE_PATH = 'payroll.db'
+
+    # Process roles: 'all' runs recognition inside the web process (single dev server);
+    # 'web' keeps OpenCV/dlib out of the web workers and talks to recognition_service.py
+    APP_ROLE = os.environ.get('PAYROLL_ROLE', 'all')
+    RECOGNITION_ADDRESS = ('127.0.0.1', int(os.environ.get('PAYROLL_RECOGNITION_PORT', 6001)))
+    # Secret for the recognition socket; without PAYROLL_IPC_KEY the service writes a random
+    # one to RECOGNITION_KEY_FILE (mode 0600) and web workers run as the same user read it
+    RECOGNITION_AUTHKEY = os.environ.get('PAYROLL_IPC_KEY', '').encode() or None
+    RECOGNITION_KEY_FILE = os.environ.get('PAYROLL_IPC_KEY_FILE') or \
+        os.path.splitext(DATABASE_PATH)[0] + '.ipckey'
+    RECOGNITION_TIMEOUT = 30  # Seconds a web worker waits for a recognition service reply
+
+    # System logs are buffered in memory and written in batches
+    LOG_BUFFER_SIZE = 10000  # Entries kept while waiting to flush; oldest dropped when full
+    LOG_BATCH_SIZE = 500  # Flush as soon as this many entries are waiting
+    LOG_FLUSH_INTERVAL = 1.0  # ...or after this many seconds
+    LOG_RETENTION_DAYS = 30  # system_logs rows older than this are pruned (0 to keep)
+    LOG_MAX_ROWS = 1000000  # Keep at most this many system_logs rows (0 for no limit)
+    ARCHIVE_AFTER_MONTHS = 3  # archive.py moves attendance older than this many months to monthly files
     CAMERA_URL = 0  # 0 for default camera, or 'rtsp://username:password@ip:port/stream'
+    # One entry per entrance; a dict maps camera names to a URL or to
+    # {'url': ..., 'motion_gate': False, 'target_fps': 2, 'detector': 'haar',
+    # 'detection_scale': 0.5, 'autotune': True, ...} for per-camera settings
+    CAMERA_URLS = [CAMERA_URL]
+    CAMERA_TARGET_FPS = 5  # Frames sent to recognition per second, per camera
+    CAMERA_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # Detection processes shared by all cameras, 0 to run in a thread
+    CAMERA_HEADLESS = False  # True to skip the cv2.imshow preview window
+    CAMERA_FRAME_QUEUE_SIZE = 2  # Grabbed frames kept; older ones are dropped
+
+    # Motion gating: skip face detection on frames where nothing changed
+    MOTION_GATE_ENABLED = True
+    MOTION_GATE_THRESHOLD = 25  # Per-pixel grayscale change counted as motion
+    MOTION_GATE_MIN_AREA = 0.002  # Fraction of changed pixels needed to run detection
+    MOTION_GATE_IDLE_INTERVAL = 5.0  # Seconds between full-frame checks while idle
+
+    # Face tracking: each tracked face is encoded only until its identity is confirmed
+    TRACK_IOU_THRESHOLD = 0.3  # Box overlap needed to continue a track
+    TRACK_MAX_AGE = 2.0  # Seconds a track survives without a detection
+    TRACK_CONFIRM_MATCHES = 1  # Agreeing gallery matches needed to confirm identity
+    TRACK_MAX_ENCODES = 3  # Encoding attempts per track before giving up
+    ATTENDANCE_COOLDOWN = 300  # Seconds before the same employee is recorded again
+    SHIFT_CACHE_TTL = 300  # Seconds before the cached staff shift table is re-read
+
+    # Dashboard
+    DASHBOARD_CACHE_TTL = 60  # Seconds between re-reads of today's figures from the database
+    DASHBOARD_RECENT_EVENTS = 20  # Attendance events kept for the recent list
+
+    # Instrumentation
+    METRICS_ENABLED = True  # Per-stage histograms and counters served at /metrics
+    PROFILER_INTERVAL = 0.01  # Seconds between stack samples while the profiler runs
+    PROFILER_MAX_SECONDS = 300  # The profiler stops itself after this long
 
     # HR Policies
     WORKING_HOURS_PER_DAY = 8
     WORKING_DAYS_PER_MONTH = 22
     OVERTIME_RATE = 1.5  # 1.5x normal rate
-    LATE_DEDUCTION_RATE = 1.0  # 1x hourly rate per hour late
\ No newline at end of file
+    LATE_DEDUCTION_RATE = 1.0  # 1x hourly rate per hour late
+
+    # Face recognition
+    FACE_MATCH_TOLERANCE = 0.6  # Max euclidean distance for a match
+    FACE_SNAPSHOT_ENABLED = True  # Keep a memory-mapped .npy copy of the gallery beside the database
+
+    # Face detection: find faces on a downscaled frame, then encode each one from the full frame
+    FACE_DETECTOR = 'hog'  # 'hog' (dlib), 'haar' (OpenCV cascade, fastest) or 'dnn' (OpenCV SSD)
+    FACE_DETECTION_SCALE = 0.25  # Frame scale detection runs at
+    FACE_ENCODE_FULL_RES = True  # False to encode from the downscaled detection frame instead
+    FACE_CROP_SIZE = 200  # Faces wider than this (pixels) are shrunk before encoding
+    FACE_HAAR_CASCADE = None  # None for OpenCV's bundled haarcascade_frontalface_default.xml
+    FACE_DNN_PROTOTXT = None  # deploy.prototxt of the res10_300x300_ssd face detector
+    FACE_DNN_MODEL = None  # res10_300x300_ssd_iter_140000.caffemodel
+    FACE_DNN_CONFIDENCE = 0.5  # Minimum SSD score for a face
+
+    # Per-camera detection scale tuning: best recall that fits the per-frame budget
+    FACE_AUTOTUNE = False  # Or {'url': ..., 'autotune': True} for one camera
+    FACE_AUTOTUNE_SCALES = (0.25, 0.35, 0.5, 0.75)
+    FACE_AUTOTUNE_BUDGET_MS = 100  # Detection time per frame the chosen scale must fit in
+    FACE_AUTOTUNE_SAMPLES = 20  # Frames with faces measured per calibration
+    FACE_AUTOTUNE_INTERVAL = 3600  # Seconds between calibrations
+
+    # Approximate search for large galleries: 'exact' or 'ivf'
+    FACE_INDEX = 'exact'
+    FACE_INDEX_LISTS = None  # k-means partitions, None for sqrt(gallery size)
+    FACE_INDEX_PROBES = 8  # Partitions scanned per query; higher = better recall, slower
+    FACE_INDEX_MIN_SIZE = 5000  # Smaller galleries always use exact search
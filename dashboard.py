@@ -0,0 +1,153 @@
+import secrets
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from config import Config
+
+
+class DashboardStats:
+    """Today's attendance figures kept in memory for the dashboard
+
+    The attendance write path pushes committed events into apply(), so
+    snapshot() is O(1). Present and late employees are kept as sets, which
+    makes applying an event the database already reflects harmless. The
+    cache re-reads the database when the local day rolls over or every
+    ttl seconds, to pick up writes from other processes. Each change gets
+    a version number; wait_for_changes() hands out the deltas since a
+    version for SSE and long-poll clients. Clients see versions as
+    '<epoch>.<number>' with an epoch random per instance, so a version from
+    another web worker or from before a restart is recognized as foreign.
+    """
+
+    def __init__(self, db, recent_size=None, ttl=None, history=1000):
+        self.db = db
+        self.recent_size = recent_size or Config.DASHBOARD_RECENT_EVENTS
+        self.ttl = Config.DASHBOARD_CACHE_TTL if ttl is None else ttl
+        self.epoch = secrets.token_hex(4)
+        self.version = 0
+        self.reloads = 0
+        self._day = None
+        self._loaded_at = None
+        self._total_employees = 0
+        self._present = set()
+        self._late = set()
+        self._recent = deque(maxlen=self.recent_size)
+        self._deltas = deque(maxlen=history)
+        self._cond = threading.Condition()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def snapshot(self):
+        """Current figures as a dict; reloads from the database if stale"""
+        self._refresh()
+        with self._cond:
+            return {
+                'version': self._cursor(self.version),
+                'date': self._day,
+                'total_employees': self._total_employees,
+                'present_today': len(self._present),
+                'late_today': len(self._late),
+                'recent': list(self._recent),
+            }
+
+    def apply(self, events):
+        """Fold committed attendance events into the cache (called from the writer thread)"""
+        with self._cond:
+            for event in events:
+                if event['date'] != self._day:
+                    continue
+                entry = self._entry(event['employee_id'], event.get('name'), event['kind'],
+                                    event['time'], event['late_minutes'])
+                if event['kind'] == 'time_in':
+                    self._present.add(event['employee_id'])
+                    if event['late_minutes']:
+                        self._late.add(event['employee_id'])
+                if entry not in self._recent:
+                    self._recent.appendleft(entry)
+                self.version += 1
+                self._deltas.append((self.version, {
+                    'version': self._cursor(self.version),
+                    'present_today': len(self._present),
+                    'late_today': len(self._late),
+                    'event': entry,
+                }))
+            self._cond.notify_all()
+
+    def wait_for_changes(self, since, timeout):
+        """Deltas newer than version `since`, waiting up to timeout seconds for one
+
+        Returns None when the client is too far behind (or the cache was
+        reloaded) and should fetch a fresh snapshot instead. So does a
+        version this instance did not hand out: another worker's, or one
+        from before a restart.
+        """
+        epoch, _, number = str(since or '').partition('.')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        since = int(number)
+        self._refresh()
+        with self._cond:
+            if since > self.version:
+                return None
+            self._cond.wait_for(lambda: self.version > since, timeout)
+            if self.version <= since:
+                return []
+            if not self._deltas or self._deltas[0][0] > since + 1:
+                return None
+            return [delta for version, delta in self._deltas if version > since]
+
+    def _cursor(self, version):
+        return f'{self.epoch}.{version}'
+
+    def _entry(self, employee_id, name, kind, timestamp, late_minutes):
+        return {'employee_id': employee_id, 'name': name or employee_id, 'kind': kind,
+                'time': str(timestamp)[:19], 'late_minutes': late_minutes or 0}
+
+    def _refresh(self):
+        today = datetime.now().date().isoformat()
+        if self._day == today and self._loaded_at is not None \
+                and time.monotonic() - self._loaded_at < self.ttl:
+            return
+
+        # Local date, matching what the attendance write path stores
+        with self.db.read() as conn:
+            total = conn.execute('SELECT COUNT(*) FROM staff').fetchone()[0]
+            present = conn.execute(
+                'SELECT employee_id, late_minutes FROM attendance WHERE date = ? AND time_in IS NOT NULL',
+                (today,)).fetchall()
+            recent = conn.execute('''
+                SELECT a.employee_id, s.name, a.time_in, a.time_out, a.late_minutes
+                FROM attendance a
+                LEFT JOIN staff s ON s.employee_id = a.employee_id
+                WHERE a.date = ?
+                ORDER BY COALESCE(a.time_out, a.time_in) DESC
+                LIMIT ?
+            ''', (today, self.recent_size)).fetchall()
+
+        entries = []
+        for employee_id, name, time_in, time_out, late_minutes in recent:
+            if time_out:
+                entries.append({'employee_id': employee_id, 'name': name or employee_id,
+                                'kind': 'time_out', 'time': str(time_out)[:19],
+                                'late_minutes': late_minutes or 0})
+            if time_in:
+                entries.append({'employee_id': employee_id, 'name': name or employee_id,
+                                'kind': 'time_in', 'time': str(time_in)[:19],
+                                'late_minutes': late_minutes or 0})
+        entries.sort(key=lambda entry: entry['time'], reverse=True)
+
+        with self._cond:
+            self._day = today
+            self._total_employees = total
+            self._present = {employee_id for employee_id, _ in present}
+            self._late = {employee_id for employee_id, late_minutes in present if late_minutes}
+            self._recent = deque(entries[:self.recent_size], maxlen=self.recent_size)
+            # Clients holding older versions must re-read the snapshot
+            self.version += 1
+            self._deltas.clear()
+            self._loaded_at = time.monotonic()
+            self.reloads += 1
+            self._cond.notify_all()
@@ -1,16 +1,683 @@
+import atexit
+import queue
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
 import os
+from config import Config
+import metrics
+
+COMMIT_SECONDS = metrics.histogram('payroll_db_commit_seconds',
+                                   'Writer transaction latency from BEGIN to COMMIT')
+COMMIT_JOBS = metrics.histogram('payroll_db_commit_jobs', 'Jobs folded into one group commit',
+                                buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+JOB_FAILURES = metrics.counter('payroll_db_job_failures_total',
+                               'Write jobs that raised and were rolled back')
+
+# Applied to every connection; journal_mode=WAL is persistent once set on the file
+PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -20000',  # ~20 MB page cache
+    'PRAGMA mmap_size = 268435456',  # 256 MB memory-mapped reads
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+)
+
+
+class WriteBatch:
+    """Statements collected inside Database.write(), run by the writer thread on exit"""
+
+    def __init__(self):
+        self.statements = []
+        self.rowcounts = []
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        self.statements.append((False, sql, params))
+
+    def executemany(self, sql, seq_of_params):
+        self.statements.append((True, sql, seq_of_params))
+
+    @property
+    def rowcount(self):
+        return sum(self.rowcounts)
+
+    def __call__(self, cursor):
+        for many, sql, params in self.statements:
+            if many:
+                cursor.executemany(sql, params)
+            else:
+                cursor.execute(sql, params)
+            self.rowcounts.append(cursor.rowcount)
+        self.lastrowid = cursor.lastrowid
+        return self
+
+
+class LogBuffer:
+    """Non-blocking system_logs writer
+
+    log_event appends to a bounded in-memory ring buffer and returns; when
+    the buffer is full the oldest entry is dropped and counted. A background
+    flusher writes batches through the pool's writer thread, one transaction
+    per batch, whenever batch_size entries are waiting or flush_interval has
+    passed. It also prunes system_logs to the retention limits every
+    prune_interval seconds. Pending entries are flushed at interpreter exit.
+    """
+
+    def __init__(self, pool, capacity=None, batch_size=None, flush_interval=None,
+                 retention_days=None, max_rows=None, prune_interval=3600):
+        self.pool = pool
+        self.batch_size = batch_size or Config.LOG_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.LOG_FLUSH_INTERVAL
+        self.retention_days = Config.LOG_RETENTION_DAYS if retention_days is None else retention_days
+        self.max_rows = Config.LOG_MAX_ROWS if max_rows is None else max_rows
+        self.prune_interval = prune_interval
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.pruned = 0
+        self._entries = deque(maxlen=capacity or Config.LOG_BUFFER_SIZE)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._last_prune = time.monotonic()
+
+    def append(self, level, module, message):
+        # Timestamp at enqueue time, in the same UTC format as CURRENT_TIMESTAMP
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        with self._cond:
+            if len(self._entries) == self._entries.maxlen:
+                self.dropped += 1
+            self._entries.append((timestamp, level, module, message))
+            if len(self._entries) >= self.batch_size:
+                self._cond.notify()
+        if self._thread is None:
+            self._start()
+
+    def flush(self):
+        """Write everything buffered so far; blocks until committed"""
+        while True:
+            with self._cond:
+                batch = [self._entries.popleft()
+                         for _ in range(min(self.batch_size, len(self._entries)))]
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(5)
+        self.flush()
+
+    def stats(self):
+        return {
+            'buffered': len(self._entries),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'pruned': self.pruned,
+        }
+
+    def prune(self):
+        """Delete rows beyond max_rows or older than retention_days, in rowid order"""
+        def delete_old(cursor):
+            cutoff_id = None
+            if self.max_rows:
+                cursor.execute('SELECT id FROM system_logs ORDER BY id DESC LIMIT 1 OFFSET ?',
+                               (self.max_rows,))
+                row = cursor.fetchone()
+                cutoff_id = row[0] + 1 if row else None
+            if self.retention_days:
+                cutoff = (datetime.utcnow() - timedelta(days=self.retention_days)).strftime(
+                    '%Y-%m-%d %H:%M:%S')
+                # ids grow with time, so the first row newer than the cutoff bounds the delete
+                cursor.execute('SELECT id FROM system_logs WHERE timestamp >= ? ORDER BY id LIMIT 1',
+                               (cutoff,))
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('SELECT MAX(id) + 1 FROM system_logs')
+                    row = cursor.fetchone()
+                if row and row[0] is not None:
+                    cutoff_id = max(cutoff_id or 0, row[0])
+            if not cutoff_id:
+                return 0
+            cursor.execute('DELETE FROM system_logs WHERE id < ?', (cutoff_id,))
+            return cursor.rowcount
+
+        self.pruned += self.pool.submit(delete_old).result()
+
+    def _start(self):
+        with self._cond:
+            if self._thread is not None or self._closed:
+                return
+            self._thread = threading.Thread(target=self._flush_loop, name='db-log-flusher',
+                                            daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _write(self, batch):
+        def insert(cursor):
+            cursor.executemany(
+                'INSERT INTO system_logs (timestamp, level, module, message) VALUES (?, ?, ?, ?)',
+                batch
+            )
+        try:
+            self.pool.submit(insert).result()
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._entries) >= self.batch_size,
+                    self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+            if self.prune_interval and time.monotonic() - self._last_prune >= self.prune_interval:
+                self._last_prune = time.monotonic()
+                try:
+                    self.prune()
+                except Exception:
+                    pass
+
+
+class ConnectionPool:
+    """Shared per-file access layer: pooled read connections and one writer thread
+
+    Reads borrow a query_only connection from an idle pool (created on
+    demand, returned after use). All writes are queued to a single writer
+    thread that owns the only write connection; it drains whatever jobs are
+    waiting and runs them in one transaction (group commit), each job in its
+    own savepoint so one failing job does not roll back the others.
+    """
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, db_path, max_idle=8, max_batch=500):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.max_batch = max_batch
+        self.commits = 0
+        self.jobs_written = 0
+        self._idle = queue.LifoQueue()
+        self._jobs = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._closed = False
+        self.log_buffer = LogBuffer(self)
+        metrics.REGISTRY.add_collector(self._collect_metrics)
+
+    @classmethod
+    def for_path(cls, db_path):
+        key = os.path.abspath(db_path)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None or pool._closed:
+                pool = cls._pools[key] = cls(db_path)
+            return pool
+
+    def connect(self, readonly=False):
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        if not readonly:
+            conn.execute('PRAGMA journal_mode = WAL')
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if readonly:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    @contextmanager
+    def reader(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self.connect(readonly=True)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed or self._idle.qsize() >= self.max_idle:
+                conn.close()
+            else:
+                self._idle.put(conn)
+
+    def submit(self, job):
+        """Queue job(cursor) for the writer thread; returns a Future of its result"""
+        if self._closed:
+            raise RuntimeError('Database pool is closed')
+        self._ensure_writer()
+        future = Future()
+        self._jobs.put((job, future))
+        return future
+
+    def close(self, timeout=5):
+        """Flush buffered logs and queued writes, stop the writer and close idle connections"""
+        metrics.REGISTRY.remove_collector(self._collect_metrics)
+        self.log_buffer.close()
+        self._closed = True
+        if self._writer is not None:
+            self._jobs.put(None)
+            self._writer.join(timeout)
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _collect_metrics(self):
+        db = os.path.basename(self.db_path)
+        log_stats = self.log_buffer.stats()
+        return [
+            ('payroll_db_queue_depth', 'gauge', 'Queued writer jobs, idle readers and buffered logs',
+             [({'db': db, 'queue': 'write_jobs'}, self._jobs.qsize()),
+              ({'db': db, 'queue': 'idle_readers'}, self._idle.qsize()),
+              ({'db': db, 'queue': 'log_entries'}, log_stats['buffered'])]),
+            ('payroll_db_log_entries_total', 'counter', 'Log entries by outcome since start',
+             [({'db': db, 'outcome': outcome}, log_stats[outcome])
+              for outcome in ('written', 'dropped', 'failed', 'pruned')]),
+        ]
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._writer_loop, name='db-writer',
+                                                daemon=True)
+                self._writer.start()
+
+    def _writer_loop(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+        stopping = False
+
+        while not stopping:
+            item = self._jobs.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            results = []
+            started = time.perf_counter()
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                for job, _ in batch:
+                    cursor.execute('SAVEPOINT job')
+                    try:
+                        results.append((job(cursor), None))
+                        cursor.execute('RELEASE job')
+                    except Exception as e:
+                        cursor.execute('ROLLBACK TO job')
+                        cursor.execute('RELEASE job')
+                        results.append((None, e))
+                        JOB_FAILURES.inc()
+                cursor.execute('COMMIT')
+                self.commits += 1
+                self.jobs_written += len(batch)
+                COMMIT_SECONDS.observe(time.perf_counter() - started)
+                COMMIT_JOBS.observe(len(batch))
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                results = [(None, e)] * len(batch)
+                JOB_FAILURES.inc(len(batch))
+
+            for (_, future), (result, error) in zip(batch, results):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+        conn.close()
+
+
+def _normalize_dates(cursor):
+    # ISO 'YYYY-MM-DD' / 'YYYY-MM-DD HH:MM:SS' text sorts chronologically, so ranges use indexes
+    cursor.execute('''
+        UPDATE attendance SET date = date(date)
+        WHERE date(date) IS NOT NULL AND date != date(date)
+    ''')
+    for column in ('time_in', 'time_out'):
+        cursor.execute(f'''
+            UPDATE attendance SET {column} = replace({column}, 'T', ' ')
+            WHERE {column} LIKE '____-__-__T%'
+        ''')
+
+
+def _unique_attendance_day(cursor):
+    # Fold duplicate (employee_id, date) rows into the earliest one before adding the constraint
+    cursor.execute('''
+        CREATE TEMP TABLE attendance_dupes AS
+        SELECT employee_id, date, MIN(id) AS keep_id, MIN(time_in) AS time_in,
+               MAX(time_out) AS time_out, MAX(late_minutes) AS late_minutes,
+               MAX(overtime_minutes) AS overtime_minutes
+        FROM attendance
+        GROUP BY employee_id, date
+        HAVING COUNT(*) > 1
+    ''')
+    cursor.execute('''
+        UPDATE attendance SET
+            time_in = (SELECT d.time_in FROM attendance_dupes d WHERE d.keep_id = attendance.id),
+            time_out = (SELECT d.time_out FROM attendance_dupes d WHERE d.keep_id = attendance.id),
+            late_minutes = (SELECT d.late_minutes FROM attendance_dupes d
+                            WHERE d.keep_id = attendance.id),
+            overtime_minutes = (SELECT d.overtime_minutes FROM attendance_dupes d
+                                WHERE d.keep_id = attendance.id)
+        WHERE id IN (SELECT keep_id FROM attendance_dupes)
+    ''')
+    cursor.execute('''
+        DELETE FROM attendance
+        WHERE id NOT IN (SELECT keep_id FROM attendance_dupes)
+          AND (employee_id, date) IN (SELECT employee_id, date FROM attendance_dupes)
+    ''')
+    # Accruals were summed over the duplicates, so recount the affected months
+    cursor.execute('''
+        CREATE TEMP TABLE affected_months AS
+        SELECT DISTINCT employee_id, substr(date, 1, 7) AS month_year FROM attendance_dupes
+    ''')
+    cursor.execute('''
+        DELETE FROM payroll_accruals
+        WHERE (employee_id, month_year) IN (SELECT employee_id, month_year FROM affected_months)
+    ''')
+    cursor.execute('''
+        INSERT INTO payroll_accruals
+        (employee_id, month_year, late_minutes, overtime_minutes, days_present)
+        SELECT employee_id, substr(date, 1, 7),
+               COALESCE(SUM(late_minutes), 0), COALESCE(SUM(overtime_minutes), 0),
+               COUNT(time_in)
+        FROM attendance
+        WHERE (employee_id, substr(date, 1, 7)) IN (SELECT employee_id, month_year FROM affected_months)
+        GROUP BY employee_id, substr(date, 1, 7)
+    ''')
+    cursor.execute('DROP TABLE temp.affected_months')
+    cursor.execute('DROP TABLE temp.attendance_dupes')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_employee_date
+        ON attendance (employee_id, date)
+    ''')
+
+
+def _unique_payroll_month(cursor):
+    # Keep the most recently generated row for each employee and month
+    cursor.execute('''
+        DELETE FROM payroll
+        WHERE id NOT IN (SELECT MAX(id) FROM payroll GROUP BY employee_id, month_year)
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_payroll_employee_month
+        ON payroll (employee_id, month_year)
+    ''')
+
+
+def _route_indexes(cursor):
+    # /dashboard and /attendance: WHERE date = ? ORDER BY time_in DESC
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date_time_in ON attendance (date, time_in)')
+    # /payroll and payroll generation: WHERE month_year = ?
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_payroll_month ON payroll (month_year)')
+    # /logs: optional level filter, newest first
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_system_logs_level_time ON system_logs (level, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_system_logs_time ON system_logs (timestamp)')
+
+
+def _attendance_durations(cursor):
+    cursor.execute('ALTER TABLE attendance ADD COLUMN worked_minutes INTEGER DEFAULT 0')
+    cursor.execute('ALTER TABLE attendance ADD COLUMN early_leave_minutes INTEGER DEFAULT 0')
+
+
+def _listing_indexes(cursor):
+    # Keyset pages order by (key, id); a single-column index already ends in the rowid
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_staff_name ON staff (name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_staff_department ON staff (department)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_staff_salary ON staff (salary)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance (date)')
+
+
+def _face_embeddings_table(cursor):
+    import pickle
+    import numpy as np
+    from gallery import EMBEDDING_BYTES, EMBEDDING_DTYPE, EMBEDDING_VERSION
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_embeddings (
+            employee_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            embedding BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (employee_id) REFERENCES staff (employee_id)
+        )
+    ''')
+    # Bumped by every change to face_embeddings; tells a gallery snapshot whether it is current
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_embeddings_revision (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            revision INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO face_embeddings_revision (id, revision) VALUES (0, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS face_embeddings_{event.lower()}_revision
+            AFTER {event} ON face_embeddings
+            BEGIN
+                UPDATE face_embeddings_revision SET revision = revision + 1 WHERE id = 0;
+            END
+        ''')
+
+    # Move staff.face_embedding (raw float32 or legacy pickle) across as raw float32
+    converted = []
+    for employee_id, blob in cursor.execute(
+            'SELECT employee_id, face_embedding FROM staff WHERE face_embedding IS NOT NULL').fetchall():
+        if len(blob) == EMBEDDING_BYTES:
+            converted.append((employee_id, EMBEDDING_VERSION, bytes(blob)))
+            continue
+        try:
+            encoding = np.asarray(pickle.loads(blob), dtype=EMBEDDING_DTYPE)
+        except Exception:
+            continue  # left in staff.face_embedding; the employee needs re-enrolling
+        if encoding.nbytes == EMBEDDING_BYTES:
+            converted.append((employee_id, EMBEDDING_VERSION, encoding.tobytes()))
+    cursor.executemany(
+        'INSERT OR REPLACE INTO face_embeddings (employee_id, version, embedding) VALUES (?, ?, ?)',
+        converted)
+    cursor.executemany('UPDATE staff SET face_embedding = NULL WHERE employee_id = ?',
+                       [(employee_id,) for employee_id, _, _ in converted])
+
+
+def _attendance_archives(cursor):
+    # Catalog of closed months moved to <db>.archive/YYYY-MM.db (see archive.py); the id
+    # changes whenever a month is archived again, so stale attachments are never reused
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_archives (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            month_year TEXT UNIQUE NOT NULL,
+            file TEXT NOT NULL,
+            attendance_rows INTEGER NOT NULL,
+            log_rows INTEGER NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Rollups of archived months, so summaries never open the archive files
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_daily (
+            date DATE PRIMARY KEY,
+            records INTEGER NOT NULL,
+            present INTEGER NOT NULL,
+            late INTEGER NOT NULL,
+            late_minutes INTEGER NOT NULL,
+            overtime_minutes INTEGER NOT NULL,
+            worked_minutes INTEGER NOT NULL,
+            early_leave_minutes INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_monthly (
+            month_year TEXT PRIMARY KEY,
+            employees INTEGER NOT NULL,
+            records INTEGER NOT NULL,
+            present INTEGER NOT NULL,
+            late INTEGER NOT NULL,
+            late_minutes INTEGER NOT NULL,
+            overtime_minutes INTEGER NOT NULL,
+            worked_minutes INTEGER NOT NULL,
+            early_leave_minutes INTEGER NOT NULL
+        )
+    ''')
+
+
+# Applied in order; PRAGMA user_version records the last one that committed
+MIGRATIONS = [
+    (1, 'normalize attendance dates to ISO text', _normalize_dates),
+    (2, 'unique attendance per employee and day', _unique_attendance_day),
+    (3, 'unique payroll per employee and month', _unique_payroll_month),
+    (4, 'indexes for route queries', _route_indexes),
+    (5, 'worked and early-leave minutes on attendance', _attendance_durations),
+    (6, 'indexes for keyset listing pages', _listing_indexes),
+    (7, 'face embeddings table with format version', _face_embeddings_table),
+    (8, 'attendance archive catalog and rollups', _attendance_archives),
+]
+
+# The query behind each hot path, with sample parameters, for Database.check_query_plans()
+HOT_QUERIES = {
+    'record_attendance': (
+        'SELECT id, time_in, time_out FROM attendance WHERE employee_id = ? AND date = ?',
+        ('E001', '2024-01-01')),
+    'dashboard_stats': (
+        '''SELECT COUNT(*), SUM(CASE WHEN time_in IS NOT NULL THEN 1 ELSE 0 END)
+           FROM attendance WHERE date = ?''',
+        ('2024-01-01',)),
+    'attendance_by_date': (
+        '''SELECT a.*, s.name, s.department FROM attendance a
+           JOIN staff s ON a.employee_id = s.employee_id
+           WHERE a.date = ? ORDER BY a.time_in DESC''',
+        ('2024-01-01',)),
+    'attendance_range': (
+        'SELECT employee_id, date FROM attendance WHERE date >= ? AND date < ?',
+        ('2024-01-01', '2024-02-01')),
+    'payroll_by_month': (
+        '''SELECT p.*, s.name FROM payroll p
+           JOIN staff s ON p.employee_id = s.employee_id
+           WHERE p.month_year = ? ORDER BY s.name''',
+        ('2024-01',)),
+    'payroll_accruals': (
+        '''SELECT s.employee_id, s.salary, a.late_minutes FROM staff s
+           LEFT JOIN payroll_accruals a ON a.employee_id = s.employee_id AND a.month_year = ?''',
+        ('2024-01',)),
+    'logs_by_level': (
+        'SELECT * FROM system_logs WHERE level = ? ORDER BY timestamp DESC LIMIT 100',
+        ('ERROR',)),
+    'logs_recent': (
+        'SELECT * FROM system_logs ORDER BY timestamp DESC LIMIT 100', ()),
+}
 
 
 class Database:
     def __init__(self, db_path='payroll.db'):
         self.db_path = db_path
+        self.pool = ConnectionPool.for_path(db_path)
         self.init_db()
 
+    @contextmanager
+    def read(self):
+        """Borrow a pooled read-only connection"""
+        with self.pool.reader() as conn:
+            yield conn
+
+    @contextmanager
+    def write(self):
+        """Collect statements; on exit they are committed by the writer thread
+
+        Blocks until the group commit containing them has finished and
+        re-raises any error. The yielded batch exposes rowcounts afterwards.
+        """
+        batch = WriteBatch()
+        yield batch
+        if batch.statements:
+            self.pool.submit(batch).result()
+
+    def transact(self, job):
+        """Run job(cursor) inside the writer's transaction and return its result
+
+        For read-modify-write logic that must see its own writes atomically.
+        """
+        return self.pool.submit(job).result()
+
+    def submit(self, job):
+        """Like transact() but returns a Future instead of waiting for the commit"""
+        return self.pool.submit(job)
+
+    def close(self):
+        self.pool.close()
+
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.transact(self._create_schema)
+        self.migrate()
+
+    def schema_version(self):
+        with self.read() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self):
+        """Apply pending MIGRATIONS, each in its own writer transaction; returns the versions applied
+
+        Readers keep working while a migration runs (WAL), so this is safe
+        against a live payroll.db.
+        """
+        applied = []
+        for version, description, migration in MIGRATIONS:
+            def step(cursor, version=version, migration=migration):
+                # Re-check inside the transaction in case another process got here first
+                if cursor.execute('PRAGMA user_version').fetchone()[0] >= version:
+                    return False
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {int(version)}')
+                return True
+
+            if self.schema_version() < version and self.transact(step):
+                applied.append(version)
+                self.log_event('INFO', 'Database', f'Applied migration {version}: {description}')
+        return applied
+
+    def check_query_plans(self):
+        """EXPLAIN QUERY PLAN every HOT_QUERIES entry; returns {name: plan} for those doing a full scan
+
+        An empty result means every hot path is served by an index.
+        """
+        failures = {}
+        # EXPLAIN never checks the schema cookie, and a pooled connection keeps prepared
+        # EXPLAINs from earlier runs, so plans are compiled on a connection of their own
+        with closing(self.pool.connect(readonly=True)) as conn:
+            for name, (sql, params) in HOT_QUERIES.items():
+                plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+                # Scanning staff is expected where every employee is wanted
+                scans = [detail for detail in plan
+                         if detail.startswith('SCAN') and 'USING' not in detail
+                         and detail not in ('SCAN s', 'SCAN staff')]
+                if scans:
+                    failures[name] = plan
+        return failures
+
+    def _create_schema(self, cursor):
 
         # Staff table
         cursor.execute('''
@@ -58,6 +725,32 @@ class Database:
             )
         ''')
 
+        # Running per-employee, per-month totals maintained by the attendance write path
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'payroll_accruals'")
+        accruals_exist = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS payroll_accruals (
+                employee_id TEXT NOT NULL,
+                month_year TEXT NOT NULL,
+                late_minutes INTEGER NOT NULL DEFAULT 0,
+                overtime_minutes INTEGER NOT NULL DEFAULT 0,
+                days_present INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (employee_id, month_year)
+            )
+        ''')
+        if not accruals_exist:
+            # Backfill from attendance recorded before the table existed
+            cursor.execute('''
+                INSERT INTO payroll_accruals
+                (employee_id, month_year, late_minutes, overtime_minutes, days_present)
+                SELECT employee_id, substr(date, 1, 7),
+                       COALESCE(SUM(late_minutes), 0), COALESCE(SUM(overtime_minutes), 0),
+                       COUNT(time_in)
+                FROM attendance
+                GROUP BY employee_id, substr(date, 1, 7)
+            ''')
+
         # System logs table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS system_logs (
@@ -69,15 +762,40 @@ class Database:
             )
         ''')
 
-        conn.commit()
-        conn.close()
-
     def log_event(self, level, module, message):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO system_logs (level, module, message) VALUES (?, ?, ?)',
-            (level, module, message)
-        )
-        conn.commit()
-        conn.close()
\ No newline at end of file
+        """Queue a system log entry; written in the background by the pool's LogBuffer"""
+        self.pool.log_buffer.append(level, module, message)
+
+    def flush_logs(self):
+        self.pool.log_buffer.flush()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Database maintenance commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('migrate', 'apply pending schema migrations'),
+                            ('check-plans', 'exit non-zero if a hot query does a full table scan')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--db', default='payroll.db')
+    args = parser.parse_args()
+
+    # Opening the database applies any pending migrations
+    db = Database(args.db)
+    try:
+        if args.command == 'migrate':
+            print(f'Schema version {db.schema_version()}')
+        else:
+            failures = db.check_query_plans()
+            for name, plan in failures.items():
+                print(f'{name}: ' + '; '.join(plan))
+            print(f'{len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} hot queries use an index')
+            if failures:
+                raise SystemExit(1)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""Face detector backends, full-resolution face crops and per-camera scale tuning
+
+Detection runs on a downscaled frame. With multi-scale encoding the boxes it
+finds are cut out of the full-resolution frame, so a far face that is 20 px
+across at the detection scale is still encoded from its original pixels.
+
+Backends (Config.FACE_DETECTOR, or 'detector' per camera):
+
+- 'hog': dlib HOG through face_recognition; no extra files
+- 'haar': OpenCV Haar cascade; fastest, most false positives
+- 'dnn': OpenCV's ResNet-10 SSD (Caffe); needs FACE_DNN_PROTOTXT and FACE_DNN_MODEL
+
+Detection functions run in the pipeline's worker processes; models are
+loaded once per process, and cv2 / face_recognition only on first use.
+"""
+import os
+import statistics
+import threading
+import time
+
+from config import Config
+from tracker import iou
+
+DETECTORS = ('hog', 'haar', 'dnn')
+
+# Per-process cache of loaded OpenCV models, by detector name
+_models = {}
+
+
+def detect(rgb_image, detector='hog'):
+    """(top, right, bottom, left) face boxes in rgb_image pixels"""
+    if detector == 'hog':
+        import face_recognition
+
+        return face_recognition.face_locations(rgb_image)
+    if detector == 'haar':
+        return _detect_haar(rgb_image)
+    if detector == 'dnn':
+        return _detect_dnn(rgb_image)
+    raise ValueError(f'Unknown face detector {detector}; use one of {", ".join(DETECTORS)}')
+
+
+def _load_model(detector):
+    model = _models.get(detector)
+    if model is not None:
+        return model
+    import cv2
+
+    if detector == 'haar':
+        path = Config.FACE_HAAR_CASCADE or os.path.join(cv2.data.haarcascades,
+                                                        'haarcascade_frontalface_default.xml')
+        model = cv2.CascadeClassifier(path)
+        if model.empty():
+            raise ValueError(f'Could not load Haar cascade {path}')
+    else:
+        if not (Config.FACE_DNN_PROTOTXT and Config.FACE_DNN_MODEL):
+            raise ValueError('The dnn detector needs FACE_DNN_PROTOTXT and FACE_DNN_MODEL in config.py')
+        model = cv2.dnn.readNetFromCaffe(Config.FACE_DNN_PROTOTXT, Config.FACE_DNN_MODEL)
+    _models[detector] = model
+    return model
+
+
+def _detect_haar(rgb_image):
+    import cv2
+
+    gray = cv2.equalizeHist(cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY))
+    faces = _load_model('haar').detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+    return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in faces]
+
+
+def _detect_dnn(rgb_image):
+    import cv2
+
+    height, width = rgb_image.shape[:2]
+    # The SSD expects a 300x300 BGR image with these channel means subtracted
+    blob = cv2.dnn.blobFromImage(cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR), 1.0, (300, 300),
+                                 (104.0, 177.0, 123.0))
+    net = _load_model('dnn')
+    net.setInput(blob)
+    boxes = []
+    for _, _, confidence, x1, y1, x2, y2 in net.forward()[0, 0]:
+        if confidence < Config.FACE_DNN_CONFIDENCE:
+            continue
+        top, right = max(0, int(y1 * height)), min(width, int(x2 * width))
+        bottom, left = min(height, int(y2 * height)), max(0, int(x1 * width))
+        if right > left and bottom > top:
+            boxes.append((top, right, bottom, left))
+    return boxes
+
+
+def face_crops(frame, boxes, max_size=None, margin=0.25):
+    """Cut each (top, right, bottom, left) box, plus a margin, out of a BGR frame
+
+    Returns [(rgb_crop, location)] with location the face box inside the crop.
+    Faces wider than max_size pixels are shrunk to it; the encoder aligns
+    every face to a 150 px chip, so more detail than that is wasted.
+    """
+    import cv2
+
+    max_size = max_size or Config.FACE_CROP_SIZE
+    height, width = frame.shape[:2]
+    crops = []
+    for top, right, bottom, left in boxes:
+        pad_x, pad_y = int((right - left) * margin), int((bottom - top) * margin)
+        x0, y0 = max(0, left - pad_x), max(0, top - pad_y)
+        x1, y1 = min(width, right + pad_x), min(height, bottom + pad_y)
+        crop = frame[y0:y1, x0:x1]
+        shrink = min(1.0, max_size / max(right - left, bottom - top, 1))
+        if shrink < 1.0:
+            crop = cv2.resize(crop, (0, 0), fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA)
+        location = tuple(int(v * shrink) for v in (top - y0, right - x0, bottom - y0, left - x0))
+        crops.append((cv2.cvtColor(crop, cv2.COLOR_BGR2RGB), location))
+    return crops
+
+
+def measure_scales(frame, scales, detector='hog'):
+    """Detect a BGR frame at each scale: [(scale, boxes in frame pixels, seconds)]
+
+    Timings include the resize, as in the pipeline. Run in a worker for ScaleTuner.
+    """
+    import cv2
+
+    results = []
+    for scale in scales:
+        started = time.perf_counter()
+        small = cv2.cvtColor(cv2.resize(frame, (0, 0), fx=scale, fy=scale), cv2.COLOR_BGR2RGB)
+        boxes = detect(small, detector)
+        seconds = time.perf_counter() - started
+        results.append((scale, [tuple(int(v / scale) for v in box) for box in boxes], seconds))
+    return results
+
+
+def match_boxes(boxes, reference, threshold=0.3):
+    """Greedy one-to-one (box index, reference index) pairs overlapping by threshold IoU"""
+    unused = set(range(len(boxes)))
+    pairs = []
+    for j, ref in enumerate(reference):
+        best = max(unused, key=lambda i: iou(boxes[i], ref), default=None)
+        if best is not None and iou(boxes[best], ref) >= threshold:
+            unused.remove(best)
+            pairs.append((best, j))
+    return pairs
+
+
+class ScaleTuner:
+    """Picks a camera's detection scale: the best recall within a per-frame CPU budget
+
+    While calibrating, one frame every sample_interval seconds is detected at
+    every candidate scale (measure_scales in a worker). Recall is measured
+    against the largest candidate, the most detailed view available, over
+    sampled frames where it found a face. Once `samples` such frames are in,
+    the scale with the best recall whose median time fits budget_ms wins
+    (the smaller one on a tie; the fastest if none fit). Calibration repeats
+    every recalibrate_interval seconds to follow lighting and traffic.
+    """
+
+    def __init__(self, scales, budget_ms, samples=20, sample_interval=1.0,
+                 recalibrate_interval=3600.0, scale=None, iou_threshold=0.3):
+        self.scales = tuple(sorted(scales))
+        self.budget_ms = budget_ms
+        self.samples = samples
+        self.sample_interval = sample_interval
+        self.recalibrate_interval = recalibrate_interval
+        self.iou_threshold = iou_threshold
+        self.scale = scale or self.scales[0]
+        self.calibrations = 0
+        self.results = {}
+        self._lock = threading.Lock()
+        self._reset(time.monotonic())
+
+    def _reset(self, now):
+        self.calibrating = True
+        self._next_sample = now
+        self._sampled = 0
+        self._face_frames = 0
+        self._reference = 0
+        self._found = dict.fromkeys(self.scales, 0)
+        self._ms = {scale: [] for scale in self.scales}
+
+    def wants_sample(self, now):
+        """True when this frame should also go to measure_scales()"""
+        with self._lock:
+            if not self.calibrating:
+                if now - self._calibrated_at < self.recalibrate_interval:
+                    return False
+                self._reset(now)
+            if now < self._next_sample:
+                return False
+            self._next_sample = now + self.sample_interval
+            return True
+
+    def add(self, measurements):
+        """Record one measure_scales() result; returns True when a new scale was chosen"""
+        with self._lock:
+            if not self.calibrating:
+                return False
+            self._sampled += 1
+            reference = measurements[-1][1]
+            for scale, boxes, seconds in measurements:
+                self._ms[scale].append(seconds * 1000)
+                self._found[scale] += len(match_boxes(boxes, reference, self.iou_threshold))
+            if reference:
+                self._face_frames += 1
+                self._reference += len(reference)
+            if self._face_frames >= self.samples:
+                self._choose()
+                return True
+            if self._sampled >= self.samples * 10:
+                # Nobody walked past; keep the current scale and try again later
+                self._finish()
+            return False
+
+    def _choose(self):
+        self.results = {
+            scale: {'recall': round(self._found[scale] / self._reference, 3),
+                    'ms': round(statistics.median(self._ms[scale]), 2)}
+            for scale in self.scales
+        }
+        within = [scale for scale in self.scales if self.results[scale]['ms'] <= self.budget_ms]
+        if within:
+            self.scale = max(within, key=lambda scale: (self.results[scale]['recall'], -scale))
+        else:
+            self.scale = min(self.scales, key=lambda scale: self.results[scale]['ms'])
+        self.calibrations += 1
+        self._finish()
+
+    def _finish(self):
+        self.calibrating = False
+        self._calibrated_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'scale': self.scale,
+                'calibrating': self.calibrating,
+                'calibrations': self.calibrations,
+                'budget_ms': self.budget_ms,
+                'results': {str(scale): result for scale, result in self.results.items()},
+            }
@@ -0,0 +1,221 @@
+import argparse
+import csv
+import io
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from config import Config
+from facial_recognition import UPSERT_EMBEDDING, FaceRecognitionSystem, worker_context
+from gallery import EMBEDDING_VERSION, encode_embedding
+
+
+STAFF_COLUMNS = ('employee_id', 'name', 'department', 'position', 'salary', 'shift_start', 'shift_end')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+UPSERT_STAFF = '''
+    INSERT INTO staff (employee_id, name, department, position, salary, shift_start, shift_end)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (employee_id) DO UPDATE SET
+        name = excluded.name,
+        department = excluded.department,
+        position = excluded.position,
+        salary = excluded.salary,
+        shift_start = excluded.shift_start,
+        shift_end = excluded.shift_end
+'''
+
+
+def encode_photo(employee_id, data):
+    """Decode image bytes and encode the largest face; runs in a worker process
+
+    Returns (employee_id, encoding, error) with exactly one of encoding/error set.
+    """
+    import face_recognition
+
+    try:
+        image = face_recognition.load_image_file(io.BytesIO(data))
+    except Exception as e:
+        return employee_id, None, f'Unreadable image: {e}'
+    locations = face_recognition.face_locations(image)
+    if not locations:
+        return employee_id, None, 'No face found'
+    largest = max(locations, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+    encodings = face_recognition.face_encodings(image, known_face_locations=[largest])
+    if not encodings:
+        return employee_id, None, 'No face found'
+    return employee_id, np.asarray(encodings[0], dtype=np.float32), None
+
+
+def _read_file(path):
+    with open(path, 'rb') as image_file:
+        return image_file.read()
+
+
+def iter_photos(source):
+    """Yield (name, read) for each image in a directory, a zip path or a zip file object
+
+    read() returns the bytes, so only in-flight images are ever held in memory.
+    """
+    if isinstance(source, str) and os.path.isdir(source):
+        for entry in sorted(os.scandir(source), key=lambda entry: entry.name):
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.name, lambda path=entry.path: _read_file(path)
+        return
+    archive = zipfile.ZipFile(source)
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if not info.is_dir() and name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.'):
+            yield name, lambda info=info: archive.read(info)
+
+
+class BulkImporter:
+    """Enrolls a staff CSV and a folder or zip of photos in one pass
+
+    Staff rows are upserted in batches. Photos are matched to employees by
+    the CSV's optional 'photo' column or by file name (<employee_id>.jpg),
+    then decoded and encoded in a process pool straight from memory. At
+    most workers * 4 images are in flight at a time. Embeddings are written
+    in batched transactions, and the gallery is updated once at the end.
+    run() is a generator of progress dicts, the last of which is the
+    summary.
+    """
+
+    def __init__(self, face_system, workers=None, batch_size=500):
+        self.face_system = face_system
+        self.db = face_system.db
+        self.workers = workers or Config.CAMERA_WORKERS
+        self.batch_size = batch_size
+
+    def run(self, staff_csv, photos=None):
+        progress = {
+            'stage': 'staff', 'staff_rows': 0, 'staff_written': 0, 'photos': 0,
+            'photos_done': 0, 'faces_enrolled': 0, 'failures': [],
+        }
+        photo_names = {}
+        batch = []
+        for line, row in enumerate(csv.DictReader(staff_csv), start=2):
+            progress['staff_rows'] += 1
+            try:
+                values = self._staff_values(row)
+            except ValueError as e:
+                progress['failures'].append({'item': f'line {line}', 'error': str(e)})
+                continue
+            batch.append(values)
+            if row.get('photo'):
+                photo_names[os.path.basename(row['photo'])] = values[0]
+            if len(batch) == self.batch_size:
+                progress['staff_written'] += self._write_staff(batch)
+                batch = []
+                yield progress
+        if batch:
+            progress['staff_written'] += self._write_staff(batch)
+        self.db.log_event('INFO', 'Import', f'Imported {progress["staff_written"]} staff rows')
+        yield progress
+
+        if photos is not None:
+            progress['stage'] = 'faces'
+            yield from self._enroll_faces(photos, photo_names, progress)
+        progress['stage'] = 'done'
+        yield progress
+
+    @staticmethod
+    def _staff_values(row):
+        missing = [column for column in STAFF_COLUMNS if not (row.get(column) or '').strip()]
+        if missing:
+            raise ValueError(f'Missing {", ".join(missing)}')
+        try:
+            salary = float(row['salary'])
+        except ValueError:
+            raise ValueError(f'Invalid salary {row["salary"]!r}')
+        return (row['employee_id'].strip(), row['name'].strip(), row['department'].strip(),
+                row['position'].strip(), salary, row['shift_start'].strip(), row['shift_end'].strip())
+
+    def _write_staff(self, rows):
+        with self.db.write() as batch:
+            batch.executemany(UPSERT_STAFF, rows)
+        return len(rows)
+
+    def _enroll_faces(self, photos, photo_names, progress):
+        enrolled_ids, enrolled = [], []
+        pending_rows = []
+        in_flight = set()
+
+        def collect(done):
+            for future in done:
+                employee_id, encoding, error = future.result()
+                progress['photos_done'] += 1
+                if error:
+                    progress['failures'].append({'item': employee_id, 'error': error})
+                    continue
+                enrolled_ids.append(employee_id)
+                enrolled.append(encoding)
+                pending_rows.append((EMBEDDING_VERSION, encode_embedding(encoding), employee_id))
+            if len(pending_rows) >= self.batch_size:
+                self._write_embeddings(pending_rows)
+                pending_rows.clear()
+
+        with self.db.read() as conn:
+            known_ids = {row[0] for row in conn.execute('SELECT employee_id FROM staff')}
+
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_context()) as executor:
+            for name, read in iter_photos(photos):
+                employee_id = photo_names.get(name, os.path.splitext(name)[0])
+                progress['photos'] += 1
+                if employee_id not in known_ids:
+                    progress['photos_done'] += 1
+                    progress['failures'].append({'item': name, 'error': f'Unknown employee {employee_id}'})
+                    continue
+                try:
+                    data = read()
+                except (OSError, zipfile.BadZipFile) as e:
+                    progress['photos_done'] += 1
+                    progress['failures'].append({'item': name, 'error': str(e)})
+                    continue
+                in_flight.add(executor.submit(encode_photo, employee_id, data))
+                if len(in_flight) >= self.workers * 4:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                    yield progress
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+                yield progress
+
+        if pending_rows:
+            self._write_embeddings(pending_rows)
+        if enrolled_ids:
+            # One gallery rebuild for the whole import
+            self.face_system.gallery.upsert_many(enrolled_ids, np.stack(enrolled))
+            self.face_system.gallery.save_index(self.face_system.index_path)
+        progress['faces_enrolled'] = len(enrolled_ids)
+        self.db.log_event('INFO', 'Import', f'Enrolled {len(enrolled_ids)} faces, '
+                                            f'{len(progress["failures"])} failures')
+
+    def _write_embeddings(self, rows):
+        with self.db.write() as batch:
+            batch.executemany(UPSERT_EMBEDDING, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import staff and face photos')
+    parser.add_argument('staff_csv', help='CSV with ' + ', '.join(STAFF_COLUMNS) + ' and optional photo')
+    parser.add_argument('photos', nargs='?', help='directory or .zip of photos named <employee_id>.jpg')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    importer = BulkImporter(FaceRecognitionSystem(), workers=args.workers)
+    with open(args.staff_csv, newline='') as staff_csv:
+        for progress in importer.run(staff_csv, args.photos):
+            print(f"\r{progress['stage']}: staff {progress['staff_written']}/{progress['staff_rows']}, "
+                  f"photos {progress['photos_done']}/{progress['photos']}", end='', flush=True)
+    print()
+    for failure in progress['failures']:
+        print(f"{failure['item']}: {failure['error']}")
+    print(f"Enrolled {progress['faces_enrolled']} faces, {len(progress['failures'])} failures")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import csv
+import io
+import tempfile
+import zlib
+from datetime import date
+
+import archive
+from payroll import month_range
+
+# Queries are formatted with the schema to read: 'main', or an attached monthly archive
+EXPORTS = {
+    'payroll': (
+        ['employee_id', 'name', 'department', 'month_year', 'basic_salary', 'late_deductions',
+         'overtime_bonus', 'net_salary', 'generated_at'],
+        '''
+        SELECT p.employee_id, s.name, s.department, p.month_year, p.basic_salary,
+               p.late_deductions, p.overtime_bonus, p.net_salary, p.generated_at
+        FROM payroll p
+        LEFT JOIN staff s ON s.employee_id = p.employee_id
+        WHERE p.month_year = ?
+        ORDER BY p.employee_id
+        ''',
+    ),
+    'attendance': (
+        ['employee_id', 'name', 'department', 'date', 'time_in', 'time_out', 'late_minutes',
+         'overtime_minutes', 'worked_minutes', 'early_leave_minutes', 'status'],
+        '''
+        SELECT a.employee_id, s.name, s.department, a.date, a.time_in, a.time_out,
+               a.late_minutes, a.overtime_minutes, a.worked_minutes, a.early_leave_minutes,
+               a.status
+        FROM {schema}.attendance a
+        LEFT JOIN staff s ON s.employee_id = a.employee_id
+        WHERE a.date >= ? AND a.date <= ?
+        ORDER BY a.date, a.id
+        ''',
+    ),
+}
+
+
+def export_params(kind, args):
+    """Validated query parameters for an export from request args"""
+    if kind == 'payroll':
+        month_year = args.get('month_year') or date.today().strftime('%Y-%m')
+        month_range(month_year)
+        return (month_year,)
+    try:
+        date_from = date.fromisoformat(args.get('date_from') or date.today().isoformat())
+        date_to = date.fromisoformat(args.get('date_to') or date_from.isoformat())
+    except ValueError:
+        raise ValueError('date_from and date_to must be YYYY-MM-DD')
+    if date_to < date_from:
+        raise ValueError('date_to is before date_from')
+    return date_from.isoformat(), date_to.isoformat()
+
+
+def iter_rows(db, kind, params, chunk_size=1000):
+    """Yield the header, then rows straight off a read cursor in fetchmany chunks
+
+    Attendance is read partition by partition in date order, each archived
+    month from its own file.
+    """
+    header, sql = EXPORTS[kind]
+    yield header
+    with db.read() as conn:
+        pieces = [(None, None, None)]
+        if kind == 'attendance':
+            pieces = archive.segments(conn, *params)
+        for month_year, lo, hi in pieces:
+            with archive.attached(conn, month_year) as schema:
+                cursor = conn.execute(sql.format(schema=schema), (lo, hi) if kind == 'attendance' else params)
+                try:
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        yield from rows
+                finally:
+                    cursor.close()
+
+
+def csv_chunks(rows, rows_per_chunk=500):
+    """Encode rows as CSV, yielding one bytes chunk per rows_per_chunk rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count == rows_per_chunk:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a stream of byte chunks into one gzip member as they arrive"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def write_xlsx(rows, title):
+    """Write rows to a temporary .xlsx with openpyxl's write-only mode; returns the open file
+
+    Rows are streamed to disk, so memory does not grow with the row count.
+    Requires openpyxl.
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError('XLSX export requires openpyxl (pip install openpyxl)')
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    for row in rows:
+        sheet.append(row)
+    output = tempfile.TemporaryFile(suffix='.xlsx')
+    workbook.save(output)
+    output.seek(0)
+    return output
@@ -1,59 +1,117 @@
 # facial_recognition.py
-import face_recognition
-import cv2
-import numpy as np
-import pickle
-import sqlite3
-from database import Database
+# face_recognition (dlib) and cv2 are imported where they are used, so web-only
+# processes that just load the gallery never pay for the CV stack
+import multiprocessing
 import os
+from database import Database
+from config import Config
+from gallery import EMBEDDING_VERSION, FaceGallery, encode_embedding, decode_embeddings
+from ann_index import IVFIndex
+import detection
+import metrics
+
+DETECTION_SCALE = Config.FACE_DETECTION_SCALE
+
+STAGE_SECONDS = metrics.histogram('payroll_recognition_stage_seconds',
+                                  'Recognition latency by stage', ('stage',))
+FACES_DETECTED = metrics.counter('payroll_faces_detected_total', 'Faces found by the detector')
+FACE_MATCHES = metrics.counter('payroll_face_matches_total',
+                               'Encoded faces compared with the gallery, by outcome', ('result',))
+
+# Only employees that exist in staff get an embedding; rowcount is 0 otherwise
+UPSERT_EMBEDDING = '''
+    INSERT INTO face_embeddings (employee_id, version, embedding)
+    SELECT employee_id, ?, ? FROM staff WHERE employee_id = ?
+    ON CONFLICT (employee_id) DO UPDATE SET
+        version = excluded.version,
+        embedding = excluded.embedding,
+        updated_at = CURRENT_TIMESTAMP
+'''
 
 
 class FaceRecognitionSystem:
     def __init__(self):
         self.db = Database()
-        self.known_face_encodings = []
-        self.known_face_ids = []
+        self.gallery = FaceGallery(index=self._create_index())
+        self.index_path = os.path.splitext(self.db.db_path)[0] + '.faces.ivf.npz'
+        self.snapshot_path = (os.path.splitext(self.db.db_path)[0] + '.faces.json'
+                              if Config.FACE_SNAPSHOT_ENABLED else None)
+        self.tolerance = Config.FACE_MATCH_TOLERANCE
+        self.detector = Config.FACE_DETECTOR
+        self.scale = DETECTION_SCALE
+        self.encode_full_res = Config.FACE_ENCODE_FULL_RES
         self.load_known_faces()
 
+    @staticmethod
+    def _create_index():
+        if Config.FACE_INDEX == 'ivf':
+            return IVFIndex(n_lists=Config.FACE_INDEX_LISTS,
+                            n_probe=Config.FACE_INDEX_PROBES,
+                            min_size=Config.FACE_INDEX_MIN_SIZE)
+        return None
+
+    @property
+    def known_face_ids(self):
+        return self.gallery.ids
+
     def load_known_faces(self):
-        """Load face encodings from database"""
-        conn = sqlite3.connect(self.db.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT employee_id, face_embedding FROM staff WHERE face_embedding IS NOT NULL')
-
-        for row in cursor.fetchall():
-            employee_id, embedding_blob = row
-            embedding = pickle.loads(embedding_blob)
-            self.known_face_encodings.append(embedding)
-            self.known_face_ids.append(employee_id)
-
-        conn.close()
-        self.db.log_event('INFO', 'FaceRecognition', f'Loaded {len(self.known_face_ids)} known faces')
-
-    def add_employee_face(self, image_path, employee_id):
-        """Add new employee face to system"""
+        """Replace the in-memory gallery from the snapshot if current, else from the database"""
+        with self.db.read() as conn:
+            # Read the revision first: rows read afterwards are at least this new, so a
+            # snapshot labelled with it can only be stale, never ahead
+            revision = conn.execute('SELECT revision FROM face_embeddings_revision').fetchone()[0]
+            if self.snapshot_path and self.gallery.load_snapshot(
+                    self.snapshot_path, revision, index_path=self.index_path):
+                self.db.log_event('INFO', 'FaceRecognition',
+                                  f'Mapped {len(self.gallery)} known faces from snapshot')
+                return
+            rows = conn.execute(
+                'SELECT employee_id, embedding FROM face_embeddings WHERE version = ?',
+                (EMBEDDING_VERSION,)
+            ).fetchall()
+            outdated = conn.execute(
+                'SELECT COUNT(*) FROM face_embeddings WHERE version != ?', (EMBEDDING_VERSION,)
+            ).fetchone()[0]
+
+        employee_ids = [row[0] for row in rows]
+        self.gallery.load(employee_ids, decode_embeddings([row[1] for row in rows]),
+                          index_path=self.index_path)
+        self.gallery.save_index(self.index_path)
+        if self.snapshot_path and employee_ids:
+            try:
+                self.gallery.save_snapshot(self.snapshot_path, revision)
+            except OSError as e:
+                self.db.log_event('WARNING', 'FaceRecognition', f'Could not write gallery snapshot: {e}')
+        if outdated:
+            self.db.log_event('WARNING', 'FaceRecognition',
+                              f'{outdated} faces use an old embedding version and need re-enrolling')
+        self.db.log_event('INFO', 'FaceRecognition', f'Loaded {len(self.gallery)} known faces')
+
+    def add_employee_face(self, image_file, employee_id):
+        """Add new employee face to system from an image path or file object"""
         try:
-            image = face_recognition.load_image_file(image_path)
+            import face_recognition
+
+            image = face_recognition.load_image_file(image_file)
             face_encodings = face_recognition.face_encodings(image)
 
             if len(face_encodings) == 0:
-                self.db.log_event('ERROR', 'FaceRecognition', f'No face found in {image_path}')
+                self.db.log_event('ERROR', 'FaceRecognition', f'No face found for employee {employee_id}')
                 return False
 
             face_encoding = face_encodings[0]
-            embedding_blob = pickle.dumps(face_encoding)
-
-            conn = sqlite3.connect(self.db.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                'UPDATE staff SET face_embedding = ? WHERE employee_id = ?',
-                (embedding_blob, employee_id)
-            )
-            conn.commit()
-            conn.close()
-
-            # Reload known faces
-            self.load_known_faces()
+            embedding_blob = encode_embedding(face_encoding)
+
+            with self.db.write() as batch:
+                batch.execute(UPSERT_EMBEDDING, (EMBEDDING_VERSION, embedding_blob, employee_id))
+
+            if not batch.rowcount:
+                self.db.log_event('ERROR', 'FaceRecognition', f'Unknown employee {employee_id}')
+                return False
+
+            # Update only this employee's row in the gallery
+            self.gallery.upsert(employee_id, face_encoding)
+            self.gallery.save_index(self.index_path)
             self.db.log_event('INFO', 'FaceRecognition', f'Added face for employee {employee_id}')
             return True
 
@@ -64,41 +122,106 @@ class FaceRecognitionSystem:
     def recognize_face(self, frame):
         """Recognize face from camera frame"""
         try:
-            # Resize frame for faster processing
-            small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+            # Detect on a downscaled frame for speed
+            with STAGE_SECONDS.labels('prepare').time():
+                rgb_small_frame = prepare_frame(frame, self.scale)
+
+            with STAGE_SECONDS.labels('detect').time():
+                face_locations = detect_faces(rgb_small_frame, self.detector)
+            FACES_DETECTED.inc(len(face_locations))
+            # ...but encode from the full-resolution pixels, so far faces keep their detail
+            with STAGE_SECONDS.labels('encode').time():
+                if self.encode_full_res:
+                    boxes = [to_frame_box(location, self.scale) for location in face_locations]
+                    face_encodings = encode_crops(detection.face_crops(frame, boxes))
+                else:
+                    face_encodings = encode_faces(rgb_small_frame, face_locations)
+
+            return self.match_detections(frame, face_locations, face_encodings, self.scale)
 
-            # Find all faces in current frame
-            face_locations = face_recognition.face_locations(rgb_small_frame)
-            face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+        except Exception as e:
+            self.db.log_event('ERROR', 'FaceRecognition', f'Recognition error: {str(e)}')
+            return frame, []
 
-            recognized_employees = []
+    def match_detections(self, frame, face_locations, face_encodings, scale=DETECTION_SCALE,
+                         offset=(0, 0)):
+        """Match detected faces against the gallery and annotate the full-size frame
 
-            for face_encoding, face_location in zip(face_encodings, face_locations):
-                # Compare with known faces
-                matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding)
-                face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
+        face_locations are in the coordinates of the downscaled image; offset is
+        the (x, y) of the crop that image was taken from, if any.
+        """
+        recognized_employees = []
 
-                best_match_index = np.argmin(face_distances) if len(face_distances) > 0 else -1
+        # Match every face in the frame with one batched distance computation
+        with STAGE_SECONDS.labels('match').time():
+            matches = self.gallery.match(face_encodings, self.tolerance)
 
-                if best_match_index != -1 and matches[best_match_index]:
-                    employee_id = self.known_face_ids[best_match_index]
-                    recognized_employees.append(employee_id)
+        for (employee_id, _), face_location in zip(matches, face_locations):
+            FACE_MATCHES.labels('unknown' if employee_id is None else 'matched').inc()
+            if employee_id is not None:
+                recognized_employees.append(employee_id)
+                draw_face(frame, to_frame_box(face_location, scale, offset), employee_id)
 
-                    # Scale face location back to original size
-                    top, right, bottom, left = face_location
-                    top *= 4;
-                    right *= 4;
-                    bottom *= 4;
-                    left *= 4
+        return frame, recognized_employees
 
-                    # Draw bounding box
-                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                    cv2.putText(frame, employee_id, (left, top - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
 
-            return frame, recognized_employees
+def to_frame_box(face_location, scale=DETECTION_SCALE, offset=(0, 0)):
+    """Map a (top, right, bottom, left) box from the downscaled crop back to the full frame"""
+    top, right, bottom, left = (int(v / scale) for v in face_location)
+    return top + offset[1], right + offset[0], bottom + offset[1], left + offset[0]
 
-        except Exception as e:
-            self.db.log_event('ERROR', 'FaceRecognition', f'Recognition error: {str(e)}')
-            return frame, []
\ No newline at end of file
+
+def draw_face(frame, box, label):
+    import cv2
+
+    top, right, bottom, left = box
+    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+    cv2.putText(frame, label, (left, top - 10),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+
+
+def prepare_frame(frame, scale=DETECTION_SCALE):
+    """Downscale a BGR camera frame and convert it to RGB for detection"""
+    import cv2
+
+    small_frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
+    return cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+
+
+def worker_context():
+    """multiprocessing context for face worker pools
+
+    The parent already runs threads (database writer, log flusher, IPC,
+    Flask), and a forked child would inherit their locks mid-use. Workers
+    start from the forkserver instead, or are spawned where it is missing.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def detect_faces(rgb_small_frame, detector='hog'):
+    """Run face detection only (see detection.DETECTORS); safe to call in a worker process"""
+    return detection.detect(rgb_small_frame, detector)
+
+
+def encode_faces(rgb_small_frame, face_locations):
+    """Compute 128-d encodings for the given boxes; safe to call in a worker process"""
+    import face_recognition
+
+    return face_recognition.face_encodings(rgb_small_frame, face_locations)
+
+
+def encode_crops(crops):
+    """Encode (rgb_crop, location) pairs from detection.face_crops(); safe to call in a worker process"""
+    import face_recognition
+
+    encodings = []
+    for crop, location in crops:
+        encodings.extend(face_recognition.face_encodings(crop, [location]))
+    return encodings
+
+
+def detect_and_encode(rgb_small_frame, detector='hog'):
+    """Run detection and 128-d encoding; safe to call in a worker process"""
+    face_locations = detect_faces(rgb_small_frame, detector)
+    return face_locations, encode_faces(rgb_small_frame, face_locations)
@@ -0,0 +1,285 @@
+import glob
+import json
+import os
+import threading
+
+import numpy as np
+
+EMBEDDING_DIM = 128
+EMBEDDING_DTYPE = np.float32
+EMBEDDING_BYTES = EMBEDDING_DIM * np.dtype(EMBEDDING_DTYPE).itemsize
+# Stored with every embedding; bump when the encoder model or the byte layout changes
+EMBEDDING_VERSION = 1
+
+
+def encode_embedding(encoding):
+    """Serialize a face encoding as raw fixed-width float32 bytes"""
+    return np.ascontiguousarray(encoding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embedding(blob):
+    """Deserialize a raw float32 face encoding blob"""
+    if len(blob) != EMBEDDING_BYTES:
+        raise ValueError(f'Embedding blob is {len(blob)} bytes, expected {EMBEDDING_BYTES}')
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def decode_embeddings(blobs):
+    """Deserialize many blobs into an (n, dim) matrix in one bulk read"""
+    if not blobs:
+        return np.empty((0, EMBEDDING_DIM), dtype=EMBEDDING_DTYPE)
+    buffer = b''.join(blobs)
+    if len(buffer) != len(blobs) * EMBEDDING_BYTES:
+        raise ValueError('Embedding blobs are not all fixed-width float32')
+    return np.frombuffer(buffer, dtype=EMBEDDING_DTYPE).reshape(-1, EMBEDDING_DIM)
+
+
+class FaceGallery:
+    """In-memory index of known faces backed by a contiguous float32 matrix
+
+    An optional approximate index (see ann_index.IVFIndex) can be attached;
+    matching then scans only the most promising partitions of the matrix.
+    The matrix can also be a read-only memory map of a snapshot file (see
+    save_snapshot); it is copied into private memory on the first write.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, capacity=1024, index=None):
+        self.dim = dim
+        self.index = index
+        self._lock = threading.RLock()
+        self._matrix = np.empty((capacity, dim), dtype=EMBEDDING_DTYPE)
+        self._sq_norms = np.empty(capacity, dtype=EMBEDDING_DTYPE)
+        self._ids = []
+        self._rows = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, employee_id):
+        return employee_id in self._rows
+
+    @property
+    def ids(self):
+        with self._lock:
+            return list(self._ids)
+
+    @property
+    def matrix(self):
+        """Read-only view of the active rows"""
+        with self._lock:
+            view = self._matrix[:len(self._ids)]
+            view.flags.writeable = False
+            return view
+
+    def load(self, employee_ids, encodings, index_path=None, copy=True):
+        """Replace the whole gallery with the given ids and (n, dim) encodings
+
+        When an index is attached and index_path holds a saved copy, its
+        centroids and assignments are reused instead of re-running k-means.
+        With copy=False and no duplicate ids, encodings is used as the matrix
+        as-is, so a memory-mapped array stays shared with other processes.
+        """
+        encodings = np.asarray(encodings, dtype=EMBEDDING_DTYPE).reshape(-1, self.dim)
+        employee_ids = list(employee_ids)
+        if len(employee_ids) != len(encodings):
+            raise ValueError('employee_ids and encodings must have the same length')
+
+        # Later rows win when an id appears twice
+        rows = {employee_id: row for row, employee_id in enumerate(employee_ids)}
+        if len(rows) != len(employee_ids):
+            keep = sorted(rows.values())
+            employee_ids = [employee_ids[row] for row in keep]
+            encodings = encodings[keep]
+            rows = {employee_id: row for row, employee_id in enumerate(employee_ids)}
+
+        if copy:
+            capacity = max(len(encodings), 1024)
+            matrix = np.empty((capacity, self.dim), dtype=EMBEDDING_DTYPE)
+            matrix[:len(encodings)] = encodings
+        else:
+            capacity = len(encodings)
+            matrix = encodings
+        sq_norms = np.empty(capacity, dtype=EMBEDDING_DTYPE)
+        sq_norms[:len(encodings)] = np.einsum('ij,ij->i', encodings, encodings)
+
+        with self._lock:
+            self._matrix = matrix
+            self._sq_norms = sq_norms
+            self._ids = employee_ids
+            self._rows = rows
+            saved = None
+            if self.index is not None and index_path:
+                saved = self.index.load(index_path)
+            self._reindex(saved)
+
+    def upsert(self, employee_id, encoding):
+        """Add or replace a single employee's encoding without a full reload"""
+        encoding = np.asarray(encoding, dtype=EMBEDDING_DTYPE).reshape(self.dim)
+        with self._lock:
+            if not self._matrix.flags.writeable:
+                self._grow()
+            row = self._rows.get(employee_id)
+            if row is None:
+                row = len(self._ids)
+                if row == len(self._matrix):
+                    self._grow()
+                self._ids.append(employee_id)
+                self._rows[employee_id] = row
+            self._matrix[row] = encoding
+            self._sq_norms[row] = encoding @ encoding
+            if self.index is not None:
+                if self.index.needs_retrain(len(self._ids)):
+                    self.index.build(self._matrix[:len(self._ids)])
+                elif self.index.is_trained:
+                    self.index.assign_rows(row, encoding[None, :])
+            return row
+
+    def upsert_many(self, employee_ids, encodings):
+        """Add or replace many encodings with one matrix rebuild and one index update"""
+        encodings = np.asarray(encodings, dtype=EMBEDDING_DTYPE).reshape(-1, self.dim)
+        with self._lock:
+            size = len(self._ids)
+            self.load(self._ids + list(employee_ids),
+                      np.concatenate([self._matrix[:size], encodings]))
+
+    def remove(self, employee_id):
+        """Drop an employee by moving the last row into its slot"""
+        with self._lock:
+            row = self._rows.pop(employee_id, None)
+            if row is None:
+                return False
+            if not self._matrix.flags.writeable:
+                self._grow()
+            last = len(self._ids) - 1
+            if row != last:
+                moved_id = self._ids[last]
+                self._matrix[row] = self._matrix[last]
+                self._sq_norms[row] = self._sq_norms[last]
+                self._ids[row] = moved_id
+                self._rows[moved_id] = row
+            if self.index is not None and self.index.is_trained:
+                self.index.move_row(last, row)
+            self._ids.pop()
+            return True
+
+    def distances(self, encodings):
+        """Euclidean distances from each query encoding to every known face"""
+        queries = np.asarray(encodings, dtype=EMBEDDING_DTYPE).reshape(-1, self.dim)
+        with self._lock:
+            size = len(self._ids)
+            matrix = self._matrix[:size]
+            sq_norms = self._sq_norms[:size]
+            # |q - g|^2 = |q|^2 + |g|^2 - 2 q.g, computed for all pairs at once
+            sq = np.einsum('ij,ij->i', queries, queries)[:, None] + sq_norms[None, :]
+            sq -= 2.0 * (queries @ matrix.T)
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+
+    def match(self, encodings, tolerance=0.6, exact=False):
+        """Return (employee_id or None, distance) for each query encoding
+
+        Uses the attached index when it is trained and the gallery is large
+        enough, unless exact=True forces a full scan.
+        """
+        queries = np.asarray(encodings, dtype=EMBEDDING_DTYPE).reshape(-1, self.dim)
+        if len(queries) == 0:
+            return []
+        with self._lock:
+            ids = list(self._ids)
+            if not ids:
+                return [(None, float('inf'))] * len(queries)
+            if not exact and self._use_index():
+                size = len(ids)
+                best, best_distances = self.index.search(
+                    queries, self._matrix[:size], self._sq_norms[:size])
+            else:
+                distances = self.distances(queries)
+                best = np.argmin(distances, axis=1)
+                best_distances = distances[np.arange(len(queries)), best]
+
+        return [
+            (ids[index] if index >= 0 and distance <= tolerance else None, float(distance))
+            for index, distance in zip(best, best_distances)
+        ]
+
+    def save_index(self, path):
+        if self.index is None:
+            return
+        with self._lock:
+            self.index.save(path, self._ids)
+
+    def save_snapshot(self, path, revision):
+        """Write the gallery as <path> (ids and metadata) plus a raw <stem>.r<revision>.npy matrix
+
+        The matrix file name carries the revision, so a reader never pairs
+        one revision's ids with another's rows; older matrices are removed.
+        """
+        with self._lock:
+            size = len(self._ids)
+            ids = list(self._ids)
+            matrix = self._matrix[:size]
+            stem = os.path.splitext(path)[0]
+            matrix_name = f'{os.path.basename(stem)}.r{revision}.npy'
+            matrix_path = os.path.join(os.path.dirname(path), matrix_name)
+            with open(matrix_path + '.tmp', 'wb') as matrix_file:
+                np.save(matrix_file, matrix)
+            os.replace(matrix_path + '.tmp', matrix_path)
+
+        with open(path + '.tmp', 'w') as meta_file:
+            json.dump({'version': EMBEDDING_VERSION, 'revision': revision,
+                       'matrix': matrix_name, 'ids': ids}, meta_file)
+        os.replace(path + '.tmp', path)
+
+        for stale in glob.glob(glob.escape(stem) + '.r*.npy'):
+            if os.path.basename(stale) != matrix_name:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass  # still mapped by a process on a platform that forbids it
+
+    def load_snapshot(self, path, revision, index_path=None):
+        """Memory-map a snapshot written by save_snapshot; False if missing or not at revision"""
+        try:
+            with open(path) as meta_file:
+                meta = json.load(meta_file)
+            if meta['version'] != EMBEDDING_VERSION or meta['revision'] != revision:
+                return False
+            matrix = np.load(os.path.join(os.path.dirname(path), meta['matrix']), mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return False
+        if matrix.dtype != EMBEDDING_DTYPE or matrix.shape != (len(meta['ids']), self.dim):
+            return False
+        self.load(meta['ids'], matrix, index_path=index_path, copy=False)
+        return True
+
+    def _use_index(self):
+        return (self.index is not None and self.index.is_trained
+                and len(self._ids) >= self.index.min_size)
+
+    def _reindex(self, saved=None):
+        if self.index is None:
+            return
+        size = len(self._ids)
+        matrix = self._matrix[:size]
+        if saved is not None and self.index.is_trained and not self.index.needs_retrain(size):
+            # Reuse saved assignments; only unseen employees get assigned afresh
+            labels = np.array([saved.get(employee_id, -1) for employee_id in self._ids], dtype=np.int32)
+            missing = np.flatnonzero(labels < 0)
+            if len(missing):
+                labels[missing] = self.index.nearest_lists(matrix[missing])[:, 0]
+            self.index.set_assignments(labels)
+        elif self.index.needs_retrain(size):
+            self.index.build(matrix)
+        elif self.index.is_trained:
+            # Replaces every assignment, so a reload with fewer faces drops the stale tail
+            self.index.set_assignments(self.index.nearest_lists(matrix)[:, 0])
+
+    def _grow(self):
+        # Also turns a memory-mapped matrix into a private, writable copy
+        capacity = max(len(self._matrix) * 2, 1024)
+        matrix = np.empty((capacity, self.dim), dtype=EMBEDDING_DTYPE)
+        matrix[:len(self._matrix)] = self._matrix
+        sq_norms = np.empty(capacity, dtype=EMBEDDING_DTYPE)
+        sq_norms[:len(self._sq_norms)] = self._sq_norms
+        self._matrix = matrix
+        self._sq_norms = sq_norms
@@ -0,0 +1,258 @@
+"""Local socket protocol between web workers and the recognition service
+
+Requests are {'op': name, 'args': [...]} dicts; replies are
+{'ok': bool, 'result' | 'error', 'more': bool}. Streaming ops send one reply
+per item with more=True and finish with more=False. A 'subscribe' request
+turns the connection into a one-way feed of {'events': [...]} (committed
+attendance events; empty as a heartbeat) and {'staff_changed': True}
+messages. Only the stdlib multiprocessing.connection module is used.
+Messages are pickles, so the connection is authenticated with a secret:
+PAYROLL_IPC_KEY, or else a random key the service writes to
+Config.RECOGNITION_KEY_FILE, readable by its owner only.
+"""
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import closing
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from config import Config
+
+# Ops a client may call, and the ones whose result is a generator
+OPS = ('ping', 'stats', 'add_face', 'staff_changed', 'import_staff', 'metrics_text')
+STREAMING_OPS = ('import_staff',)
+
+
+class RecognitionError(RuntimeError):
+    """The recognition service received the request but the op failed"""
+
+
+def load_authkey(create=False):
+    """The shared secret: Config.RECOGNITION_AUTHKEY, else the contents of the key file
+
+    With create=True (the service) a missing key file is created with a new
+    random key and mode 0600. A key file other users can read is refused.
+    """
+    if Config.RECOGNITION_AUTHKEY:
+        return Config.RECOGNITION_AUTHKEY
+    path = Config.RECOGNITION_KEY_FILE
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No IPC key in {path}; start recognition_service.py first '
+                                f'or set PAYROLL_IPC_KEY')
+    if os.name == 'posix' and os.stat(path).st_mode & 0o077:
+        raise PermissionError(f'{path} must be readable by its owner only (chmod 600 {path})')
+    with open(path) as f:
+        key = f.read().strip()
+    if not key:
+        raise PermissionError(f'{path} is empty; delete it and restart the recognition service')
+    return key.encode()
+
+
+class Server:
+    """Accepts local connections and runs each request against a handler object
+
+    Every connection gets its own thread. publish() fans attendance events
+    out to subscribers through bounded per-subscriber queues, so a slow web
+    worker loses events instead of stalling the database writer.
+    """
+
+    def __init__(self, handler, address=None, authkey=None, on_error=None):
+        self.handler = handler
+        self.address = address or Config.RECOGNITION_ADDRESS
+        self.authkey = authkey or load_authkey(create=True)
+        self.on_error = on_error
+        self._listener = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._running = False
+
+    def start(self):
+        self._listener = Listener(self.address, authkey=self.authkey)
+        self._running = True
+        threading.Thread(target=self._accept_loop, name='ipc-accept', daemon=True).start()
+
+    def close(self):
+        self._running = False
+        if self._listener is not None:
+            self._listener.close()
+
+    def publish(self, events):
+        self._broadcast({'events': events})
+
+    def publish_staff_changed(self):
+        self._broadcast({'staff_changed': True})
+
+    def _broadcast(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for messages in subscribers:
+            try:
+                messages.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                if not self._running:
+                    break
+                continue  # failed handshake or authentication
+            except Exception as e:
+                self._error(f'IPC accept error: {str(e)}')
+                continue
+            if not self._running:
+                # close() doesn't wake a blocked accept(), so the last one can land here
+                conn.close()
+                break
+            threading.Thread(target=self._serve, args=(conn,), name='ipc-conn', daemon=True).start()
+
+    def _serve(self, conn):
+        with closing(conn):
+            try:
+                while True:
+                    request = conn.recv()
+                    op = request.get('op')
+                    if op == 'subscribe':
+                        self._feed(conn)
+                        return
+                    if op not in OPS:
+                        conn.send({'ok': False, 'error': f'Unknown op {op}', 'more': False})
+                        continue
+                    try:
+                        result = getattr(self.handler, op)(*request.get('args', ()))
+                        if op in STREAMING_OPS:
+                            for item in result:
+                                conn.send({'ok': True, 'result': item, 'more': True})
+                            result = None
+                        conn.send({'ok': True, 'result': result, 'more': False})
+                    except Exception as e:
+                        self._error(f'IPC {op} failed: {str(e)}')
+                        conn.send({'ok': False, 'error': str(e), 'more': False})
+            except (EOFError, OSError):
+                pass  # client went away
+
+    def _feed(self, conn):
+        messages = queue.Queue(maxsize=1000)
+        with self._lock:
+            self._subscribers.append(messages)
+        try:
+            while self._running:
+                try:
+                    message = messages.get(timeout=15)
+                except queue.Empty:
+                    message = {'events': []}  # heartbeat; also notices a dead client
+                conn.send(message)
+        finally:
+            with self._lock:
+                self._subscribers.remove(messages)
+
+    def _error(self, message):
+        if self.on_error:
+            self.on_error(message)
+
+
+class RecognitionClient:
+    """The recognition service as seen from a web worker
+
+    Has the same methods as recognition_service.RecognitionService. Each call
+    opens a short-lived local connection; failures raise OSError (service
+    down or too slow) or RecognitionError (the op itself failed).
+    """
+
+    def __init__(self, address=None, authkey=None, timeout=None):
+        self.address = address or Config.RECOGNITION_ADDRESS
+        # Read on first use: the service creates the key file when it starts
+        self.authkey = authkey
+        self.timeout = Config.RECOGNITION_TIMEOUT if timeout is None else timeout
+
+    def ping(self):
+        return self._call('ping')
+
+    def stats(self):
+        return self._call('stats')
+
+    def add_face(self, image, employee_id):
+        data = image if isinstance(image, bytes) else image.read()
+        return self._call('add_face', data, employee_id)
+
+    def staff_changed(self):
+        return self._call('staff_changed')
+
+    def metrics_text(self):
+        return self._call('metrics_text')
+
+    def import_staff(self, staff_csv, photos=None):
+        """Yield progress dicts; photos must be a path the service can read (same host)"""
+        if not isinstance(staff_csv, str):
+            staff_csv = staff_csv.read()
+        with closing(self._connect()) as conn:
+            conn.send({'op': 'import_staff', 'args': [staff_csv, photos]})
+            while True:
+                reply = self._receive(conn)
+                if not reply['more']:
+                    return
+                yield reply['result']
+
+    def subscribe(self, callback, on_staff_changed=None, retry_interval=5.0):
+        """Call callback(events) for every attendance commit, reconnecting in the background
+
+        on_staff_changed() runs when any process changes staff, and on every
+        (re)connect, since anything may have changed while disconnected.
+        """
+        def listen():
+            while True:
+                try:
+                    with closing(self._connect()) as conn:
+                        conn.send({'op': 'subscribe'})
+                        if on_staff_changed:
+                            on_staff_changed()
+                        while True:
+                            message = conn.recv()
+                            if message.get('events'):
+                                callback(message['events'])
+                            if message.get('staff_changed') and on_staff_changed:
+                                on_staff_changed()
+                except Exception:
+                    # Service gone, or the callback failed; either way keep the feed alive
+                    time.sleep(retry_interval)
+
+        thread = threading.Thread(target=listen, name='ipc-subscribe', daemon=True)
+        thread.start()
+        return thread
+
+    def _connect(self):
+        if self.authkey is None:
+            self.authkey = load_authkey()
+        try:
+            return Client(self.address, authkey=self.authkey)
+        except AuthenticationError as e:
+            raise ConnectionError(f'Recognition service rejected the authkey: {e}') from e
+
+    def _call(self, op, *args):
+        with closing(self._connect()) as conn:
+            conn.send({'op': op, 'args': list(args)})
+            return self._receive(conn)['result']
+
+    def _receive(self, conn):
+        if not conn.poll(self.timeout):
+            raise TimeoutError(f'Recognition service did not answer within {self.timeout}s')
+        try:
+            reply = conn.recv()
+        except EOFError as e:
+            raise ConnectionError('Recognition service closed the connection') from e
+        if not reply['ok']:
+            raise RecognitionError(reply['error'])
+        return reply
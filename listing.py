@@ -0,0 +1,272 @@
+import base64
+import json
+from datetime import date
+
+import archive
+
+
+class Resource:
+    """A listable table: projectable fields, filters and keyset sort keys
+
+    fields maps public names to SQL expressions, so only named columns are
+    ever selected (embedding blobs are never listed). Sort keys must be NOT
+    NULL so (key, id) is a total order for keyset pagination. A resource
+    with a partition_key is split into monthly archives (see archive.py) and
+    is read from every partition the key's filters can reach.
+    """
+
+    def __init__(self, table, alias, fields, filters, sorts, default_fields, default_sort,
+                 join=None, partition_key=None):
+        self.table = table
+        self.alias = alias
+        self.fields = fields
+        self.filters = filters
+        self.sorts = sorts
+        self.default_fields = default_fields
+        self.default_sort = default_sort
+        self.join = join
+        self.partition_key = partition_key
+
+
+STAFF_FIELDS = {
+    'id': 's.id',
+    'employee_id': 's.employee_id',
+    'name': 's.name',
+    'department': 's.department',
+    'position': 's.position',
+    'salary': 's.salary',
+    'shift_start': 's.shift_start',
+    'shift_end': 's.shift_end',
+    'created_at': 's.created_at',
+    'has_face': 'EXISTS (SELECT 1 FROM face_embeddings f WHERE f.employee_id = s.employee_id)',
+}
+
+RESOURCES = {
+    'staff': Resource(
+        'staff', 's', STAFF_FIELDS,
+        filters={'department': 's.department = ?', 'position': 's.position = ?',
+                 'employee_id': 's.employee_id = ?', 'q': 's.name LIKE ? || \'%\''},
+        sorts={'id': 's.id', 'employee_id': 's.employee_id', 'name': 's.name',
+               'department': 's.department', 'salary': 's.salary'},
+        default_fields=['id', 'employee_id', 'name', 'department', 'position', 'salary'],
+        default_sort='employee_id',
+    ),
+    'attendance': Resource(
+        'attendance', 'a',
+        {
+            'id': 'a.id',
+            'employee_id': 'a.employee_id',
+            'date': 'a.date',
+            'time_in': 'a.time_in',
+            'time_out': 'a.time_out',
+            'late_minutes': 'a.late_minutes',
+            'overtime_minutes': 'a.overtime_minutes',
+            'worked_minutes': 'a.worked_minutes',
+            'early_leave_minutes': 'a.early_leave_minutes',
+            'status': 'a.status',
+            'name': 's.name',
+            'department': 's.department',
+        },
+        filters={'date': 'a.date = ?', 'date_from': 'a.date >= ?', 'date_to': 'a.date <= ?',
+                 'employee_id': 'a.employee_id = ?', 'status': 'a.status = ?',
+                 'department': 's.department = ?'},
+        sorts={'id': 'a.id', 'date': 'a.date', 'employee_id': 'a.employee_id'},
+        default_fields=['id', 'employee_id', 'name', 'date', 'time_in', 'time_out',
+                        'late_minutes', 'overtime_minutes', 'status'],
+        default_sort='-date',
+        join='LEFT JOIN staff s ON s.employee_id = a.employee_id',
+        partition_key='a.date',
+    ),
+    'payroll': Resource(
+        'payroll', 'p',
+        {
+            'id': 'p.id',
+            'employee_id': 'p.employee_id',
+            'month_year': 'p.month_year',
+            'basic_salary': 'p.basic_salary',
+            'late_deductions': 'p.late_deductions',
+            'overtime_bonus': 'p.overtime_bonus',
+            'net_salary': 'p.net_salary',
+            'generated_at': 'p.generated_at',
+            'name': 's.name',
+            'department': 's.department',
+        },
+        filters={'month_year': 'p.month_year = ?', 'employee_id': 'p.employee_id = ?',
+                 'department': 's.department = ?'},
+        sorts={'id': 'p.id', 'employee_id': 'p.employee_id', 'month_year': 'p.month_year',
+               'net_salary': 'p.net_salary'},
+        default_fields=['id', 'employee_id', 'name', 'month_year', 'basic_salary',
+                        'late_deductions', 'overtime_bonus', 'net_salary'],
+        default_sort='employee_id',
+        join='LEFT JOIN staff s ON s.employee_id = p.employee_id',
+    ),
+    'logs': Resource(
+        'system_logs', 'l',
+        {'id': 'l.id', 'timestamp': 'l.timestamp', 'level': 'l.level', 'module': 'l.module',
+         'message': 'l.message'},
+        filters={'level': 'l.level = ?', 'module': 'l.module = ?'},
+        sorts={'id': 'l.id'},
+        default_fields=['id', 'timestamp', 'level', 'module', 'message'],
+        default_sort='-id',
+    ),
+}
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+DATE_FILTERS = ('date', 'date_from', 'date_to')
+
+
+def encode_cursor(key, row_id):
+    return base64.urlsafe_b64encode(json.dumps([key, row_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        key, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return key, int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+class Page:
+    """One keyset page; iterate to stream rows, then read next_cursor
+
+    Rows come straight off the database cursor in fetchmany chunks, so memory
+    stays bounded by the chunk size whatever the page limit.
+    """
+
+    def __init__(self, cursor, fields, limit, chunk_size=200):
+        self.fields = fields
+        self.limit = limit
+        self.next_cursor = None
+        self._cursor = cursor
+        self._chunk_size = chunk_size
+
+    def __iter__(self):
+        seen = 0
+        last = None
+        while True:
+            rows = self._cursor.fetchmany(self._chunk_size)
+            if not rows:
+                return
+            for row in rows:
+                if seen == self.limit:
+                    # The extra row only proves there is a next page
+                    self.next_cursor = encode_cursor(last[-2], last[-1])
+                    return
+                seen += 1
+                last = row
+                yield dict(zip(self.fields, row))
+
+
+def parse_args(resource, args):
+    """(fields, sort, filters, cursor, limit) from request args, validated against the resource"""
+    fields = args.get('fields')
+    fields = fields.split(',') if fields else list(resource.default_fields)
+    unknown = [field for field in fields if field not in resource.fields]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+
+    sort = args.get('sort') or resource.default_sort
+    if sort.lstrip('-') not in resource.sorts:
+        raise ValueError(f'Cannot sort by {sort.lstrip("-")}; use one of {", ".join(resource.sorts)}')
+
+    filters = {name: args[name] for name in resource.filters if args.get(name)}
+    for name in DATE_FILTERS:
+        if name in filters:
+            try:
+                date.fromisoformat(filters[name])
+            except ValueError:
+                raise ValueError(f'{name} must be a YYYY-MM-DD date')
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    cursor = args.get('cursor')
+    if cursor:
+        decode_cursor(cursor)
+    return fields, sort, filters, cursor, limit
+
+
+class _Rows:
+    """Rows gathered from several partitions, served like a cursor for Page"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._offset = 0
+
+    def fetchmany(self, size):
+        rows = self._rows[self._offset:self._offset + size]
+        self._offset += len(rows)
+        return rows
+
+
+def query_page(conn, name, fields=None, sort=None, filters=None, cursor=None, limit=DEFAULT_LIMIT):
+    """Run one keyset page query on conn and return a Page to iterate
+
+    sort is a sort key, prefixed with '-' for descending. The cursor is the
+    next_cursor of the previous page.
+    """
+    resource = RESOURCES[name]
+    fields = fields or resource.default_fields
+    sort = sort or resource.default_sort
+    descending = sort.startswith('-')
+    sort_expr = resource.sorts[sort.lstrip('-')]
+    id_expr = f'{resource.alias}.id'
+
+    where, params = [], []
+    for filter_name, value in (filters or {}).items():
+        where.append(resource.filters[filter_name])
+        params.append(value)
+    if cursor:
+        key, row_id = decode_cursor(cursor)
+        where.append(f'({sort_expr}, {id_expr}) {"<" if descending else ">"} (?, ?)')
+        params.extend([key, row_id])
+
+    # Only join staff when a staff column is selected or filtered on
+    expressions = [resource.fields[field] for field in fields] + \
+        [resource.filters[filter_name] for filter_name in (filters or {})]
+    needs_join = resource.join and any(expr.startswith('s.') for expr in expressions)
+    order = 'DESC' if descending else 'ASC'
+
+    def page_sql(schema='main', bounds=()):
+        clauses = where + [f'{resource.partition_key} {op} ?' for op, _ in bounds]
+        return (f'SELECT {", ".join(resource.fields[field] for field in fields)}, {sort_expr}, {id_expr} '
+                f'FROM {schema}.{resource.table} {resource.alias} '
+                f'{resource.join if needs_join else ""} '
+                f'{"WHERE " + " AND ".join(clauses) if clauses else ""} '
+                f'ORDER BY {sort_expr} {order}, {id_expr} {order} LIMIT ?')
+
+    pieces = [(None, None, None)]
+    if resource.partition_key:
+        filters = filters or {}
+        pieces = archive.segments(conn, filters.get('date') or filters.get('date_from'),
+                                  filters.get('date') or filters.get('date_to'))
+    if len(pieces) == 1 and pieces[0][0] is None:
+        return Page(conn.execute(page_sql(), params + [limit + 1]), fields, limit)
+
+    # Archived months live in their own files: run the page query on each partition in
+    # range and merge. Each piece returns at most limit + 1 rows, read before it is detached.
+    by_partition_key = sort_expr == resource.partition_key
+    rows = []
+    for month_year, lo, hi in (reversed(pieces) if descending else pieces):
+        bounds = [(op, value) for op, value in (('>=', lo), ('<=', hi)) if value is not None]
+        with archive.attached(conn, month_year) as schema:
+            rows.extend(conn.execute(page_sql(schema, bounds),
+                                     params + [value for _, value in bounds] + [limit + 1]).fetchall())
+        if by_partition_key and len(rows) > limit:
+            # Pieces are in key order, so later ones cannot reach this page
+            break
+    if not by_partition_key:
+        rows.sort(key=lambda row: (row[-2], row[-1]), reverse=descending)
+    return Page(_Rows(rows[:limit + 1]), fields, limit)
+
+
+def stream_json(db, name, fields, sort, filters, cursor, limit):
+    """Yield a {'success', 'items', 'next_cursor'} JSON document a row at a time"""
+    with db.read() as conn:
+        page = query_page(conn, name, fields, sort, filters, cursor, limit)
+        yield '{"success": true, "items": ['
+        for index, item in enumerate(page):
+            yield (',' if index else '') + json.dumps(item, default=str)
+        yield '], "next_cursor": ' + json.dumps(page.next_cursor) + '}'
@@ -0,0 +1,79 @@
+import time
+
+import cv2
+
+
+class MotionGate:
+    """Cheap change detector run ahead of face detection
+
+    Each frame is shrunk to a small blurred grayscale image and compared with
+    a running-average background. Frames with no change are skipped so HOG
+    detection and encoding never run on an empty entrance; frames with
+    activity report the bounding box of the moving region so only that crop
+    is sent on. A full frame is still let through every idle_interval
+    seconds so a person standing still is not missed.
+    """
+
+    def __init__(self, enabled=True, width=160, threshold=25, min_area=0.002, padding=0.2,
+                 background_rate=0.05, idle_interval=5.0):
+        self.enabled = enabled
+        self.width = width
+        self.threshold = threshold
+        self.min_area = min_area
+        self.padding = padding
+        self.background_rate = background_rate
+        self.idle_interval = idle_interval
+        self.checked = 0
+        self.skipped = 0
+        self.score = 0.0
+        self._background = None
+        self._last_pass = 0.0
+
+    def check(self, frame):
+        """Return (active, roi); roi is (left, top, right, bottom) in frame pixels or None"""
+        self.checked += 1
+        if not self.enabled:
+            return True, None
+
+        height, width = frame.shape[:2]
+        small_height = max(1, int(height * self.width / width))
+        small = cv2.resize(frame, (self.width, small_height), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype('float32')
+            self._last_pass = time.monotonic()
+            return True, None
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        cv2.accumulateWeighted(gray, self._background, self.background_rate)
+        _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        changed = cv2.countNonZero(mask)
+        self.score = changed / mask.size
+
+        now = time.monotonic()
+        if self.score < self.min_area:
+            if now - self._last_pass >= self.idle_interval:
+                self._last_pass = now
+                return True, None
+            self.skipped += 1
+            return False, None
+
+        self._last_pass = now
+        x, y, w, h = cv2.boundingRect(cv2.findNonZero(mask))
+        scale = width / self.width
+        pad_x, pad_y = w * self.padding, h * self.padding
+        left = max(0, int((x - pad_x) * scale))
+        top = max(0, int((y - pad_y) * scale))
+        right = min(width, int((x + w + pad_x) * scale))
+        bottom = min(height, int((y + h + pad_y) * scale))
+        return True, (left, top, right, bottom)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'checked': self.checked,
+            'skipped': self.skipped,
+            'skip_rate': round(self.skipped / self.checked, 4) if self.checked else 0.0,
+            'score': round(self.score, 4),
+        }
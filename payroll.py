@@ -0,0 +1,228 @@
+import argparse
+from datetime import date
+
+import numpy as np
+
+from config import Config
+
+
+def month_range(month_year):
+    """Return the [start, end) ISO dates for a 'YYYY-MM' month"""
+    try:
+        year, month = (int(part) for part in month_year.split('-'))
+        start = date(year, month, 1)
+    except (ValueError, AttributeError):
+        raise ValueError(f'Invalid month_year {month_year!r}, expected YYYY-MM')
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+
+def accrue(cursor, employee_id, day, late_minutes=0, overtime_minutes=0, days_present=0):
+    """Add attendance deltas to the employee's running monthly totals
+
+    Call with the same cursor that writes the attendance row so both land in
+    one transaction.
+    """
+    month_year = str(day)[:7]
+    cursor.execute('''
+        INSERT INTO payroll_accruals
+        (employee_id, month_year, late_minutes, overtime_minutes, days_present)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (employee_id, month_year) DO UPDATE SET
+            late_minutes = late_minutes + excluded.late_minutes,
+            overtime_minutes = overtime_minutes + excluded.overtime_minutes,
+            days_present = days_present + excluded.days_present,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (employee_id, month_year, late_minutes, overtime_minutes, days_present))
+
+
+class PayrollEngine:
+    """Set-based payroll generation for every employee in one pass
+
+    Late and overtime minutes come from payroll_accruals, which the
+    attendance write path keeps current, so reading a month is one lookup
+    per employee. Pay is computed for all employees at once with NumPy, and
+    results are written with one executemany inside a single transaction.
+    reconcile() rebuilds the accruals from raw attendance with a grouped
+    date-range query and reports any drift.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def calculate(salaries, late_minutes, overtime_minutes):
+        """Vectorized late deductions, overtime bonus and net salary"""
+        salaries = np.asarray(salaries, dtype=np.float64)
+        hourly_rates = salaries / (Config.WORKING_DAYS_PER_MONTH * Config.WORKING_HOURS_PER_DAY)
+        late_deductions = np.asarray(late_minutes, dtype=np.float64) / 60 * hourly_rates \
+            * Config.LATE_DEDUCTION_RATE
+        overtime_bonus = np.asarray(overtime_minutes, dtype=np.float64) / 60 * hourly_rates \
+            * Config.OVERTIME_RATE
+        net_salaries = salaries - late_deductions + overtime_bonus
+        return late_deductions, overtime_bonus, net_salaries
+
+    def fetch_totals(self, cursor, month_year):
+        """(employee_ids, salaries, late_minutes, overtime_minutes) for every employee"""
+        month_range(month_year)
+        cursor.execute('''
+            SELECT s.employee_id, s.salary,
+                   COALESCE(a.late_minutes, 0), COALESCE(a.overtime_minutes, 0)
+            FROM staff s
+            LEFT JOIN payroll_accruals a
+                ON a.employee_id = s.employee_id AND a.month_year = ?
+        ''', (month_year,))
+        rows = cursor.fetchall()
+        if not rows:
+            return [], np.empty(0), np.empty(0), np.empty(0)
+        employee_ids, salaries, late, overtime = zip(*rows)
+        return list(employee_ids), np.array(salaries), np.array(late), np.array(overtime)
+
+    def generate(self, month_year):
+        """Generate (or regenerate) payroll for all employees; returns the row count"""
+        with self.db.read() as conn:
+            employee_ids, salaries, late, overtime = self.fetch_totals(conn.cursor(), month_year)
+        late_deductions, overtime_bonus, net_salaries = self.calculate(salaries, late, overtime)
+
+        rows = list(zip(employee_ids, [month_year] * len(employee_ids), salaries.tolist(),
+                        late_deductions.tolist(), overtime_bonus.tolist(), net_salaries.tolist()))
+
+        # Upsert on the (employee_id, month_year) key and drop rows for departed staff
+        with self.db.write() as batch:
+            batch.executemany('''
+                INSERT INTO payroll
+                (employee_id, month_year, basic_salary, late_deductions, overtime_bonus, net_salary)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (employee_id, month_year) DO UPDATE SET
+                    basic_salary = excluded.basic_salary,
+                    late_deductions = excluded.late_deductions,
+                    overtime_bonus = excluded.overtime_bonus,
+                    net_salary = excluded.net_salary,
+                    generated_at = CURRENT_TIMESTAMP
+            ''', rows)
+            batch.execute('''
+                DELETE FROM payroll
+                WHERE month_year = ? AND employee_id NOT IN (SELECT employee_id FROM staff)
+            ''', (month_year,))
+        return len(employee_ids)
+
+    def preview(self, month_year):
+        """Payroll so far for the month, computed from accruals without writing anything"""
+        with self.db.read() as conn:
+            employee_ids, salaries, late, overtime = self.fetch_totals(conn.cursor(), month_year)
+        late_deductions, overtime_bonus, net_salaries = self.calculate(salaries, late, overtime)
+        return {
+            'month_year': month_year,
+            'employees': len(employee_ids),
+            'late_minutes': int(late.sum()),
+            'overtime_minutes': int(overtime.sum()),
+            'basic_salary': float(salaries.sum()),
+            'late_deductions': float(late_deductions.sum()),
+            'overtime_bonus': float(overtime_bonus.sum()),
+            'net_salary': float(net_salaries.sum()),
+        }
+
+    def reconcile(self, month_year=None):
+        """Rebuild payroll_accruals from raw attendance and report rows that drifted
+
+        Limited to one 'YYYY-MM' month when given, otherwise every month.
+        Archived months are left alone: their attendance is no longer in this
+        database, and their accruals were final when they were archived.
+        """
+        where, params = "WHERE substr(date, 1, 7) NOT IN (SELECT month_year FROM attendance_archives)", ()
+        if month_year:
+            where, params = 'WHERE date >= ? AND date < ?', month_range(month_year)
+
+        def rebuild(cursor):
+            if month_year and cursor.execute('SELECT 1 FROM attendance_archives WHERE month_year = ?',
+                                             (month_year,)).fetchone():
+                raise ValueError(f'{month_year} is archived; reopen it with archive.py first')
+            cursor.execute('DROP TABLE IF EXISTS temp.fresh_accruals')
+            cursor.execute(f'''
+                CREATE TEMP TABLE fresh_accruals AS
+                SELECT employee_id, substr(date, 1, 7) AS month_year,
+                       COALESCE(SUM(late_minutes), 0) AS late_minutes,
+                       COALESCE(SUM(overtime_minutes), 0) AS overtime_minutes,
+                       COUNT(time_in) AS days_present
+                FROM attendance
+                {where}
+                GROUP BY employee_id, substr(date, 1, 7)
+            ''', params)
+
+            # Accrual rows with no attendance behind them are drift too
+            orphan_filter, orphan_params = ('f.employee_id IS NULL AND a.month_year NOT IN '
+                                            '(SELECT month_year FROM attendance_archives)'), ()
+            if month_year:
+                orphan_filter, orphan_params = orphan_filter + ' AND a.month_year = ?', (month_year,)
+            cursor.execute(f'''
+                SELECT f.employee_id, f.month_year,
+                       a.late_minutes, f.late_minutes,
+                       a.overtime_minutes, f.overtime_minutes,
+                       a.days_present, f.days_present
+                FROM fresh_accruals f
+                LEFT JOIN payroll_accruals a
+                    ON a.employee_id = f.employee_id AND a.month_year = f.month_year
+                WHERE a.employee_id IS NULL
+                   OR a.late_minutes != f.late_minutes
+                   OR a.overtime_minutes != f.overtime_minutes
+                   OR a.days_present != f.days_present
+                UNION ALL
+                SELECT a.employee_id, a.month_year,
+                       a.late_minutes, 0, a.overtime_minutes, 0, a.days_present, 0
+                FROM payroll_accruals a
+                LEFT JOIN fresh_accruals f
+                    ON f.employee_id = a.employee_id AND f.month_year = a.month_year
+                WHERE {orphan_filter}
+            ''', orphan_params)
+            drift = [
+                {
+                    'employee_id': row[0],
+                    'month_year': row[1],
+                    'late_minutes': (row[2], row[3]),
+                    'overtime_minutes': (row[4], row[5]),
+                    'days_present': (row[6], row[7]),
+                }
+                for row in cursor.fetchall()
+            ]
+
+            if month_year:
+                cursor.execute('DELETE FROM payroll_accruals WHERE month_year = ?', (month_year,))
+            else:
+                cursor.execute('DELETE FROM payroll_accruals '
+                               'WHERE month_year NOT IN (SELECT month_year FROM attendance_archives)')
+            cursor.execute('''
+                INSERT INTO payroll_accruals
+                (employee_id, month_year, late_minutes, overtime_minutes, days_present)
+                SELECT employee_id, month_year, late_minutes, overtime_minutes, days_present
+                FROM fresh_accruals
+            ''')
+            rebuilt = cursor.rowcount
+            cursor.execute('DROP TABLE temp.fresh_accruals')
+            return {'rebuilt': rebuilt, 'drift': drift}
+
+        # Runs on the writer thread so the temp table and rebuild share one transaction
+        return self.db.transact(rebuild)
+
+
+def main():
+    from database import Database
+
+    parser = argparse.ArgumentParser(description='Payroll maintenance commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+    reconcile = commands.add_parser('reconcile', help='rebuild accruals from attendance and report drift')
+    reconcile.add_argument('month_year', nargs='?', help='YYYY-MM (default: all months)')
+    reconcile.add_argument('--db', default='payroll.db')
+    args = parser.parse_args()
+
+    engine = PayrollEngine(Database(args.db))
+    result = engine.reconcile(args.month_year)
+    for row in result['drift']:
+        print(f"{row['employee_id']} {row['month_year']}: "
+              f"late {row['late_minutes'][0]} -> {row['late_minutes'][1]}, "
+              f"overtime {row['overtime_minutes'][0]} -> {row['overtime_minutes'][1]}, "
+              f"days {row['days_present'][0]} -> {row['days_present'][1]}")
+    print(f"Rebuilt {result['rebuilt']} accrual rows, {len(result['drift'])} drifted")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,530 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+
+from detection import face_crops, measure_scales
+from facial_recognition import (DETECTION_SCALE, FACE_MATCHES, FACES_DETECTED, STAGE_SECONDS,
+                                 detect_faces, draw_face, encode_crops, encode_faces, prepare_frame,
+                                 to_frame_box, worker_context)
+import metrics
+from metrics import timed_call
+from motion import MotionGate
+from tracker import FaceTracker
+
+FRAMES_PROCESSED = metrics.counter('payroll_frames_processed_total',
+                                   'Frames that completed detection, by camera', ('camera',))
+FRAMES_DROPPED = metrics.counter('payroll_frames_dropped_total',
+                                 'Frames or attendance events discarded, by stage', ('stage',))
+
+
+class StageStats:
+    """Latency and drop counters for one pipeline stage, mirrored to /metrics when named"""
+
+    def __init__(self, stage=None):
+        self._histogram = STAGE_SECONDS.labels(stage) if stage else None
+        self._drops = FRAMES_DROPPED.labels(stage) if stage else None
+        self._lock = threading.Lock()
+        self.count = 0
+        self.drops = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            self.count += 1
+            self.total_ms += ms
+            self.last_ms = ms
+            self.max_ms = max(self.max_ms, ms)
+        if self._histogram:
+            self._histogram.observe(seconds)
+
+    def drop(self, count=1):
+        with self._lock:
+            self.drops += count
+        if self._drops:
+            self._drops.inc(count)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'drops': self.drops,
+                'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+                'last_ms': round(self.last_ms, 3),
+                'max_ms': round(self.max_ms, 3),
+            }
+
+
+class LatestFrameBuffer:
+    """Bounded frame buffer that discards the oldest frame when full"""
+
+    def __init__(self, maxsize=1, stats=None, ready_event=None):
+        self._frames = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self._stats = stats
+        self.ready_event = ready_event
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame):
+        with self._cond:
+            if len(self._frames) == self._frames.maxlen and self._stats:
+                self._stats.drop()
+            self._frames.append(frame)
+            self._cond.notify()
+        if self.ready_event is not None:
+            self.ready_event.set()
+
+    def get(self, timeout=None):
+        """Newest frame in the buffer (older ones are discarded), or None on timeout"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._frames, timeout):
+                return None
+            frame = self._frames.pop()
+            if self._frames and self._stats:
+                self._stats.drop(len(self._frames))
+            self._frames.clear()
+            return frame
+
+
+class CameraStream:
+    """One camera source: a grab thread that reconnects with exponential backoff
+
+    Every grabbed frame goes through the stream's MotionGate first; idle
+    frames never reach the buffer, and active ones are queued together with
+    the region that changed. The scheduler favours streams with motion.
+    Each stream keeps its own FaceTracker so faces are followed per camera,
+    and its own detector and detection scale; with a ScaleTuner the scale is
+    re-chosen from measurements of this camera's frames.
+    """
+
+    def __init__(self, name, camera_url, queue_size=2, target_fps=5, motion_gate=None,
+                 tracker=None, backoff_initial=1.0, backoff_max=30.0, max_read_failures=10,
+                 detector='hog', scale=None, tuner=None):
+        self.name = name
+        self.camera_url = camera_url
+        self.target_fps = target_fps
+        self.detector = detector
+        # None takes the pipeline's scale when the stream is added
+        self.scale = tuner.scale if tuner else scale
+        self.tuner = tuner
+        self.motion_gate = motion_gate or MotionGate()
+        self.tracker = tracker or FaceTracker()
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_read_failures = max_read_failures
+
+        self.grab_stats = StageStats('grab')
+        self.frames = LatestFrameBuffer(queue_size, self.grab_stats)
+        self.is_running = False
+        self.connected = False
+        self.reconnects = 0
+        self.motion = False
+        self.processed = 0
+        self.last_dispatch = 0.0
+        self.current_frame = None
+        self._started_at = None
+        self._thread = None
+        self._on_error = None
+
+    def start(self, on_error=None):
+        self._on_error = on_error
+        self.is_running = True
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._grab_loop, name=f'camera-grab-{self.name}',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self.is_running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def is_due(self, now):
+        """Frame waiting and this stream's fps budget allows another dispatch"""
+        if not len(self.frames):
+            return False
+        return not self.target_fps or now - self.last_dispatch >= 1.0 / self.target_fps
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0
+        return {
+            'url': str(self.camera_url),
+            'connected': self.connected,
+            'motion': self.motion,
+            'reconnects': self.reconnects,
+            'fps': round(self.processed / elapsed, 2) if elapsed else 0.0,
+            'queue_depth': len(self.frames),
+            'tracks': len(self.tracker),
+            'detector': self.detector,
+            'scale': self.scale,
+            'autotune': self.tuner.stats() if self.tuner else None,
+            'grab': self.grab_stats.snapshot(),
+            'motion_gate': self.motion_gate.stats(),
+        }
+
+    def _grab_loop(self):
+        backoff = self.backoff_initial
+        while self.is_running:
+            cap = cv2.VideoCapture(self.camera_url)
+            failures = 0
+            self.connected = cap.isOpened()
+
+            while self.is_running and self.connected:
+                start = time.perf_counter()
+                ret, frame = cap.read()
+                if not ret:
+                    self.grab_stats.drop()
+                    failures += 1
+                    if failures >= self.max_read_failures:
+                        self.connected = False
+                        break
+                    time.sleep(0.05)
+                    continue
+                failures = 0
+                backoff = self.backoff_initial
+                self.grab_stats.record(time.perf_counter() - start)
+
+                active, roi = self.motion_gate.check(frame)
+                self.motion = roi is not None
+                if active:
+                    self.frames.put((frame, roi))
+
+            cap.release()
+            if not self.is_running:
+                break
+
+            self.reconnects += 1
+            if self._on_error:
+                self._on_error(f'Camera {self.name} disconnected, reconnecting in {backoff:.0f}s')
+            deadline = time.monotonic() + backoff
+            while self.is_running and time.monotonic() < deadline:
+                time.sleep(0.1)
+            backoff = min(backoff * 2, self.backoff_max)
+
+
+class FramePipeline:
+    """Staged camera pipeline: grab -> detect (worker pool) -> track/encode/match -> sink
+
+    Each CameraStream's grab thread reads its camera as fast as it delivers so
+    RTSP buffers never go stale, and only the newest frames are kept. One
+    scheduler hands frames from all streams to a shared pool of worker
+    processes, round-robin by last dispatch time with streams showing motion
+    served first. On the results thread detections are tracked; only faces
+    whose identity is not yet confirmed are sent back to the pool for
+    encoding and matched against the shared gallery; with encode_full_res
+    those faces are cropped from the full-resolution frame rather than the
+    downscaled detection image. Each track emits
+    attendance once, further limited to once per attendance_cooldown seconds
+    per employee across all cameras, and writes go to a separate sink thread.
+    """
+
+    # worker_queue is time spent waiting for, and shipping frames to, the worker pool
+    STAGES = ('prepare', 'worker_queue', 'detect', 'encode', 'match', 'sink')
+
+    def __init__(self, streams, face_system, on_recognized, workers=1, headless=True,
+                 scale=DETECTION_SCALE, attendance_cooldown=300, encode_full_res=True,
+                 crop_size=None, window_name='Payroll System - Face Recognition'):
+        self.face_system = face_system
+        self.on_recognized = on_recognized
+        self.attendance_cooldown = attendance_cooldown
+        self.workers = workers
+        self.headless = headless
+        self.scale = scale
+        self.encode_full_res = encode_full_res
+        self.crop_size = crop_size
+        self.window_name = window_name
+
+        self.stage_stats = {stage: StageStats(stage) for stage in self.STAGES}
+        self.attendance_queue = queue.Queue(maxsize=1000)
+        self.is_running = False
+        self._frame_ready = threading.Event()
+        self._streams = {}
+        self._streams_lock = threading.Lock()
+        self._results = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max(workers, 1) * 2)
+        self._executor = None
+        self._threads = []
+        self._started_at = None
+        self._last_emitted = {}
+        for stream in streams:
+            self.add_stream(stream)
+
+    @property
+    def streams(self):
+        with self._streams_lock:
+            return list(self._streams.values())
+
+    @property
+    def current_frame(self):
+        """Most recent annotated frame from any stream"""
+        frames = [stream.current_frame for stream in self.streams if stream.current_frame is not None]
+        return frames[-1] if frames else None
+
+    def add_stream(self, stream):
+        stream.frames.ready_event = self._frame_ready
+        if stream.scale is None:
+            stream.scale = self.scale
+        with self._streams_lock:
+            self._streams[stream.name] = stream
+        if self.is_running:
+            stream.start(self._log_error)
+
+    def remove_stream(self, name):
+        with self._streams_lock:
+            stream = self._streams.pop(name, None)
+        if stream:
+            stream.stop()
+        return stream is not None
+
+    def start(self):
+        if self.workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_context())
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        self.is_running = True
+        self._started_at = time.monotonic()
+        for stream in self.streams:
+            stream.start(self._log_error)
+        self._threads = [
+            threading.Thread(target=loop, name=f'camera-{name}', daemon=True)
+            for name, loop in (('dispatch', self._dispatch_loop),
+                               ('results', self._results_loop), ('sink', self._sink_loop))
+        ]
+        for thread in self._threads:
+            thread.start()
+        metrics.REGISTRY.add_collector(self._collect_metrics)
+
+    def stop(self, timeout=5):
+        self.is_running = False
+        metrics.REGISTRY.remove_collector(self._collect_metrics)
+        for stream in self.streams:
+            stream.stop(timeout)
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0
+        processed = sum(stream.processed for stream in self.streams)
+        return {
+            'running': self.is_running,
+            'fps': round(processed / elapsed, 2) if elapsed else 0.0,
+            'stages': {stage: stats.snapshot() for stage, stats in self.stage_stats.items()},
+            'queues': {
+                'in_flight': self._results.qsize(),
+                'attendance': self.attendance_queue.qsize(),
+            },
+            'cameras': {stream.name: stream.stats() for stream in self.streams},
+        }
+
+    def _collect_metrics(self):
+        streams = self.streams
+        return [
+            ('payroll_pipeline_queue_depth', 'gauge', 'Frames in flight and queued attendance events',
+             [({'queue': 'in_flight'}, self._results.qsize()),
+              ({'queue': 'attendance'}, self.attendance_queue.qsize())]),
+            ('payroll_camera_queue_depth', 'gauge', 'Frames waiting in each camera buffer',
+             [({'camera': stream.name}, len(stream.frames)) for stream in streams]),
+            ('payroll_camera_connected', 'gauge', '1 while the camera is delivering frames',
+             [({'camera': stream.name}, int(stream.connected)) for stream in streams]),
+            ('payroll_camera_tracks', 'gauge', 'Faces currently tracked per camera',
+             [({'camera': stream.name}, len(stream.tracker)) for stream in streams]),
+        ]
+
+    def _log_error(self, message):
+        self.face_system.db.log_event('ERROR', 'Camera', message)
+
+    def _next_stream(self):
+        """Due stream to serve next: motion first, then least recently served"""
+        now = time.monotonic()
+        due = [stream for stream in self.streams if stream.is_due(now)]
+        if not due:
+            return None
+        return min(due, key=lambda stream: (not stream.motion, stream.last_dispatch))
+
+    def _dispatch_loop(self):
+        while self.is_running:
+            # Wait for a free worker before picking a frame so we always send the newest one
+            if not self._slots.acquire(timeout=0.5):
+                continue
+
+            stream = self._next_stream()
+            if stream is None:
+                self._slots.release()
+                self._frame_ready.clear()
+                self._frame_ready.wait(0.02)
+                continue
+            item = stream.frames.get(timeout=0)
+            stream.last_dispatch = time.monotonic()
+            if item is None:
+                self._slots.release()
+                continue
+
+            # Only the moving region (if the gate found one) goes to detection
+            frame, roi = item
+            left, top, right, bottom = roi or (0, 0, frame.shape[1], frame.shape[0])
+            scale = stream.scale
+            try:
+                start = time.perf_counter()
+                rgb_small_frame = prepare_frame(frame[top:bottom, left:right], scale)
+                self.stage_stats['prepare'].record(time.perf_counter() - start)
+                future = self._executor.submit(timed_call, detect_faces, rgb_small_frame,
+                                               stream.detector)
+                if stream.tuner and stream.tuner.wants_sample(stream.last_dispatch):
+                    self._executor.submit(measure_scales, frame[top:bottom, left:right],
+                                          stream.tuner.scales, stream.detector).add_done_callback(
+                        lambda done, stream=stream: self._tuned(stream, done))
+            except Exception as e:
+                self._slots.release()
+                self._log_error(f'Frame dispatch error: {str(e)}')
+                continue
+
+            self._results.put(('detected', stream, frame, rgb_small_frame, scale, (left, top), future,
+                               time.perf_counter()))
+
+    def _tuned(self, stream, future):
+        """Feed a calibration measurement to the stream's tuner (executor callback thread)"""
+        try:
+            if stream.tuner.add(future.result()):
+                stream.scale = stream.tuner.scale
+                self.face_system.db.log_event(
+                    'INFO', 'Camera', f'Camera {stream.name} detection scale set to {stream.scale} '
+                                      f'({stream.tuner.results[stream.scale]})')
+        except Exception as e:
+            self._log_error(f'Scale calibration error on {stream.name}: {str(e)}')
+
+    def _results_loop(self):
+        while self.is_running:
+            try:
+                kind, *item = self._results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if kind == 'encoded':
+                try:
+                    self._apply_encodings(*item)
+                except Exception as e:
+                    self.stage_stats['match'].drop()
+                    self._log_error(f'Recognition error: {str(e)}')
+                continue
+
+            stream, frame, rgb_small_frame, scale, offset, future, submitted = item
+
+            try:
+                face_locations, detect_s = future.result()
+            except Exception as e:
+                self.stage_stats['detect'].drop()
+                self._log_error(f'Detection error: {str(e)}')
+                continue
+            finally:
+                self._slots.release()
+            self.stage_stats['detect'].record(detect_s)
+            self.stage_stats['worker_queue'].record(time.perf_counter() - submitted - detect_s)
+            FACES_DETECTED.inc(len(face_locations))
+
+            try:
+                self._process_detections(stream, frame, rgb_small_frame, scale, offset,
+                                         face_locations)
+            except Exception as e:
+                self.stage_stats['encode'].drop()
+                self._log_error(f'Recognition error: {str(e)}')
+            stream.current_frame = frame
+            stream.processed += 1
+            FRAMES_PROCESSED.labels(stream.name).inc()
+
+            if not self.headless:
+                cv2.imshow(f'{self.window_name} [{stream.name}]', frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    self.is_running = False
+
+        if not self.headless:
+            cv2.destroyAllWindows()
+
+    def _process_detections(self, stream, frame, rgb_small_frame, scale, offset, face_locations):
+        """Track faces, send unconfirmed tracks off for encoding, and emit attendance once per track
+
+        Encoding runs in the worker pool without blocking this thread; its
+        result comes back through the results queue (see _apply_encodings).
+        """
+        tracker = stream.tracker
+        boxes = [to_frame_box(location, scale, offset) for location in face_locations]
+        tracks = tracker.update(boxes, time.monotonic())
+
+        pending = [i for i, track in enumerate(tracks) if tracker.needs_encoding(track)]
+        if pending:
+            if self.encode_full_res:
+                # Small crops from the full frame: more detail, and far less to ship than the frame
+                job = (encode_crops, face_crops(frame, [boxes[i] for i in pending], self.crop_size))
+            else:
+                job = (encode_faces, rgb_small_frame, [face_locations[i] for i in pending])
+            submitted = time.perf_counter()
+            future = self._executor.submit(timed_call, *job)
+            encoding = [tracks[i] for i in pending]
+            for track in encoding:
+                track.encoding = True
+            future.add_done_callback(
+                lambda done: self._results.put(('encoded', stream, encoding, done, submitted)))
+
+        for track in tracks:
+            if track.employee_id is None:
+                continue
+            draw_face(frame, track.box, track.employee_id)
+            self._emit_track(track)
+
+    def _apply_encodings(self, stream, tracks, future, submitted):
+        """Match a finished encode job against the gallery and vote on its tracks"""
+        for track in tracks:
+            track.encoding = False
+        try:
+            face_encodings, encode_s = future.result()
+        except Exception:
+            self.stage_stats['encode'].drop()
+            raise
+        self.stage_stats['encode'].record(encode_s)
+        self.stage_stats['worker_queue'].record(time.perf_counter() - submitted - encode_s)
+
+        start = time.perf_counter()
+        matches = self.face_system.gallery.match(face_encodings, self.face_system.tolerance)
+        self.stage_stats['match'].record(time.perf_counter() - start)
+        for track, (employee_id, _) in zip(tracks, matches):
+            FACE_MATCHES.labels('unknown' if employee_id is None else 'matched').inc()
+            track.add_match(employee_id, stream.tracker.confirm_matches)
+            if track.employee_id is not None:
+                self._emit_track(track)
+
+    def _emit_track(self, track):
+        if not track.emitted:
+            track.emitted = True
+            self._emit_attendance(track.employee_id)
+
+    def _emit_attendance(self, employee_id):
+        now = time.monotonic()
+        last = self._last_emitted.get(employee_id)
+        if last is not None and now - last < self.attendance_cooldown:
+            return
+        self._last_emitted[employee_id] = now
+        try:
+            self.attendance_queue.put_nowait(employee_id)
+        except queue.Full:
+            self.stage_stats['sink'].drop()
+
+    def _sink_loop(self):
+        stats = self.stage_stats['sink']
+        while self.is_running or not self.attendance_queue.empty():
+            try:
+                employee_id = self.attendance_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            self.on_recognized(employee_id)
+            stats.record(time.perf_counter() - start)
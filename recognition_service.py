@@ -0,0 +1,110 @@
+"""The recognition role: one process that owns the gallery, the cameras and face enrollment
+
+    python recognition_service.py            # capture + serve web workers on RECOGNITION_ADDRESS
+    python recognition_service.py --no-capture
+
+Web workers (create_app('web')) never load OpenCV or dlib; they send face
+uploads, bulk imports and stats requests here over ipc, and receive
+attendance events for their dashboards.
+"""
+import argparse
+import io
+import signal
+import threading
+
+from camera import CameraManager
+from config import Config
+from enrollment import BulkImporter
+from facial_recognition import FaceRecognitionSystem
+import ipc
+import metrics
+
+
+class RecognitionService:
+    """Gallery, camera pipeline and enrollment behind the methods ipc.OPS exposes
+
+    In the single-process 'all' role the web app calls these methods
+    directly; otherwise serve() puts them behind an ipc.Server.
+    """
+
+    def __init__(self, face_system=None, camera_urls=None):
+        self.face_system = face_system or FaceRecognitionSystem()
+        self.db = self.face_system.db
+        self.camera_system = CameraManager(Config.CAMERA_URLS if camera_urls is None else camera_urls,
+                                           face_system=self.face_system)
+        # Called with each committed batch of attendance events
+        self.listeners = self.camera_system.attendance.listeners
+        self.server = None
+
+    def start_capture(self):
+        self.camera_system.start_capture()
+
+    def serve(self, address=None, authkey=None):
+        self.server = ipc.Server(self, address, authkey,
+                                 on_error=lambda message: self.db.log_event('ERROR', 'IPC', message))
+        self.server.start()
+        self.listeners.append(self.server.publish)
+        self.db.log_event('INFO', 'IPC', f'Recognition service listening on {self.server.address}')
+
+    def stop(self):
+        if self.server is not None:
+            self.listeners.remove(self.server.publish)
+            self.server.close()
+        if self.camera_system.is_running:
+            self.camera_system.stop_capture()
+
+    def ping(self):
+        return {'gallery': len(self.face_system.gallery), 'capturing': self.camera_system.is_running}
+
+    def stats(self):
+        return self.camera_system.stats()
+
+    def add_face(self, image, employee_id):
+        """Enroll from image bytes or a file object"""
+        if isinstance(image, bytes):
+            image = io.BytesIO(image)
+        return self.face_system.add_employee_face(image, employee_id)
+
+    def staff_changed(self):
+        self.camera_system.attendance.shifts.invalidate()
+        # Every web worker keeps its own staff caches
+        if self.server is not None:
+            self.server.publish_staff_changed()
+
+    def import_staff(self, staff_csv, photos=None):
+        """Bulk import progress dicts; staff_csv is CSV text or a text file object"""
+        if isinstance(staff_csv, str):
+            staff_csv = io.StringIO(staff_csv, newline='')
+        try:
+            yield from BulkImporter(self.face_system).run(staff_csv, photos)
+        finally:
+            self.staff_changed()
+
+    def metrics_text(self):
+        return metrics.REGISTRY.render()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the recognition service for web workers')
+    parser.add_argument('--no-capture', action='store_true', help='serve enrollment only')
+    args = parser.parse_args()
+
+    service = RecognitionService()
+    service.serve()
+    if not args.no_capture:
+        service.start_capture()
+    print(f'Recognition service listening on {service.server.address} '
+          f'({len(service.face_system.gallery)} known faces)')
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    service.stop()
+    service.db.flush_logs()
+
+
+if __name__ == '__main__':
+    main()
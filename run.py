@@ -1,16 +1,27 @@
-from app import app, camera_system
-import threading
+import argparse
 
+from app import ROLES, create_app
 
-def start_system():
-    # Initialize and start camera system in separate thread
-    camera_thread = threading.Thread(target=camera_system.start_capture)
-    camera_thread.daemon = True
-    camera_thread.start()
 
-    # Start Flask application
-    app.run(debug=True, host='0.0.0.0', port=5001, use_reloader=True)
+def start_system(role=None, host='0.0.0.0', port=5001, debug=False):
+    app = create_app(role)
+    services = app.extensions['payroll']
+    if services.role == 'all':
+        # Cameras run in this process; the reloader would start them a second time
+        # in its child, so code reloading is never enabled here
+        services.recognition.start_capture()
+    app.run(debug=debug, host=host, port=port, use_reloader=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the payroll web app (development server)')
+    parser.add_argument('--role', choices=ROLES, help="'web' needs recognition_service.py running")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--debug', action='store_true', help='enable the debugger (no reloader)')
+    args = parser.parse_args()
+    start_system(args.role, args.host, args.port, args.debug)
 
 
 if __name__ == '__main__':
-    start_system()
\ No newline at end of file
+    main()
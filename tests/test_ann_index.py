@@ -0,0 +1,30 @@
+import numpy as np
+
+from ann_index import IVFIndex, cluster_sums, kmeans
+from gallery import FaceGallery
+
+
+def test_cluster_sums_with_trailing_empty_clusters():
+    points = np.array([[0.0], [1.0], [2.0], [3.0]])
+    sums = cluster_sums(points, np.array([0, 0, 1, 1]), 3)
+    assert sums[:, 0].tolist() == [1.0, 5.0, 0.0]
+
+
+def test_kmeans_separates_well_spread_clusters():
+    rng = np.random.default_rng(1)
+    centers = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+    points = np.concatenate([center + rng.standard_normal((50, 2)) * 0.1 for center in centers])
+    centroids = kmeans(points, 3, seed=1)
+    assert np.allclose(np.sort(centroids, axis=0), np.sort(centers, axis=0), atol=0.1)
+
+
+def test_reload_with_fewer_faces_drops_stale_assignments():
+    rng = np.random.default_rng(0)
+    gallery = FaceGallery(index=IVFIndex(n_lists=16, min_size=500, retrain_growth=100))
+    gallery.load([f'E{i}' for i in range(3000)], rng.standard_normal((3000, 128)))
+    assert gallery.index.is_trained
+
+    encodings = rng.standard_normal((1000, 128))
+    gallery.load([f'F{i}' for i in range(1000)], encodings)
+    matches = gallery.match(encodings[:50], tolerance=0.5)
+    assert [employee_id for employee_id, _ in matches] == [f'F{i}' for i in range(50)]
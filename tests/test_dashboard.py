@@ -0,0 +1,46 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from dashboard import DashboardStats
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'payroll.db'))
+    db.init_db()
+    yield db
+    db.close()
+
+
+def event(employee_id, name=None):
+    now = datetime.now()
+    return {'employee_id': employee_id, 'name': name, 'kind': 'time_in', 'date': now.date().isoformat(),
+            'time': now.isoformat(' '), 'late_minutes': 0, 'overtime_minutes': 0}
+
+
+def test_version_from_before_a_restart_gets_a_snapshot(db):
+    stats = DashboardStats(db, ttl=60)
+    stats.snapshot()
+    started = time.monotonic()
+    assert stats.wait_for_changes(f'{stats.epoch}.{stats.version + 5}', timeout=5) is None
+    assert time.monotonic() - started < 1
+
+
+def test_version_from_another_worker_gets_a_snapshot(db):
+    stats, other = DashboardStats(db, ttl=60), DashboardStats(db, ttl=60)
+    version = other.snapshot()['version']
+    stats.snapshot()
+    assert stats.wait_for_changes(version, timeout=5) is None
+    assert stats.wait_for_changes('garbage', timeout=5) is None
+
+
+def test_deltas_since_a_version(db):
+    stats = DashboardStats(db, ttl=60)
+    version = stats.snapshot()['version']
+    stats.apply([event('E1', 'Ada')])
+    deltas = stats.wait_for_changes(version, timeout=1)
+    assert [delta['event']['name'] for delta in deltas] == ['Ada']
+    assert stats.wait_for_changes(deltas[-1]['version'], timeout=0.05) == []
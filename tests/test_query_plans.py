@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+from database import MIGRATIONS, Database
+
+# The schema payroll.db had before migrations existed (user_version 0)
+BASELINE_SCHEMA = '''
+    CREATE TABLE staff (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        employee_id TEXT UNIQUE NOT NULL,
+        name TEXT NOT NULL,
+        department TEXT NOT NULL,
+        position TEXT NOT NULL,
+        salary REAL NOT NULL,
+        shift_start TIME NOT NULL,
+        shift_end TIME NOT NULL,
+        face_embedding BLOB,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE attendance (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        employee_id TEXT NOT NULL,
+        date DATE NOT NULL,
+        time_in TIMESTAMP,
+        time_out TIMESTAMP,
+        late_minutes INTEGER DEFAULT 0,
+        overtime_minutes INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'Present',
+        FOREIGN KEY (employee_id) REFERENCES staff (employee_id)
+    );
+    CREATE TABLE payroll (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        employee_id TEXT NOT NULL,
+        month_year TEXT NOT NULL,
+        basic_salary REAL NOT NULL,
+        late_deductions REAL DEFAULT 0,
+        overtime_bonus REAL DEFAULT 0,
+        net_salary REAL NOT NULL,
+        generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (employee_id) REFERENCES staff (employee_id)
+    );
+    CREATE TABLE system_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        level TEXT NOT NULL,
+        module TEXT NOT NULL,
+        message TEXT NOT NULL
+    );
+    INSERT INTO staff (employee_id, name, department, position, salary, shift_start, shift_end)
+    VALUES ('E001', 'Ada', 'Ops', 'Clerk', 3000, '09:00', '17:00');
+    INSERT INTO attendance (employee_id, date, time_in, time_out, late_minutes, overtime_minutes)
+    VALUES ('E001', '2024-01-02', '2024-01-02 09:10:00', '2024-01-02 17:30:00', 10, 30);
+    INSERT INTO payroll (employee_id, month_year, basic_salary, net_salary)
+    VALUES ('E001', '2024-01', 3000, 3000);
+    INSERT INTO system_logs (level, module, message) VALUES ('INFO', 'System', 'started');
+'''
+
+
+@pytest.fixture
+def close_later():
+    databases = []
+    yield databases.append
+    for db in databases:
+        db.close()
+
+
+def test_new_database_serves_hot_queries_from_indexes(tmp_path, close_later):
+    db = Database(str(tmp_path / 'payroll.db'))
+    close_later(db)
+    assert db.check_query_plans() == {}
+
+
+def test_migrating_a_baseline_database(tmp_path, close_later):
+    path = str(tmp_path / 'payroll.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+
+    db = Database(path)
+    close_later(db)
+    assert db.schema_version() == MIGRATIONS[-1][0]
+    assert db.check_query_plans() == {}
+    with db.read() as conn:
+        assert conn.execute('SELECT employee_id, date, late_minutes FROM attendance').fetchall() == \
+            [('E001', '2024-01-02', 10)]
+
+
+def test_dropped_index_is_reported(tmp_path, close_later):
+    db = Database(str(tmp_path / 'payroll.db'))
+    close_later(db)
+    assert db.check_query_plans() == {}
+    db.transact(lambda cursor: cursor.execute('DROP INDEX idx_system_logs_time'))
+    assert 'logs_recent' in db.check_query_plans()
@@ -0,0 +1,115 @@
+import itertools
+from collections import Counter
+
+
+def iou(box_a, box_b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top = max(box_a[0], box_b[0])
+    right = min(box_a[1], box_b[1])
+    bottom = min(box_a[2], box_b[2])
+    left = max(box_a[3], box_b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (box_a[1] - box_a[3]) * (box_a[2] - box_a[0])
+    area_b = (box_b[1] - box_b[3]) * (box_b[2] - box_b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+def _centroid_distance(box_a, box_b):
+    """Distance between box centres, relative to the size of box_a"""
+    ay, ax = (box_a[0] + box_a[2]) / 2, (box_a[1] + box_a[3]) / 2
+    by, bx = (box_b[0] + box_b[2]) / 2, (box_b[1] + box_b[3]) / 2
+    size = max(box_a[2] - box_a[0], box_a[1] - box_a[3], 1)
+    return ((ay - by) ** 2 + (ax - bx) ** 2) ** 0.5 / size
+
+
+class Track:
+    """One face followed across frames until its identity is confirmed"""
+
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.encodes = 0
+        self.frames_since_encode = 0
+        self.votes = Counter()
+        self.employee_id = None
+        self.emitted = False
+        self.encoding = False  # an encode job for this track is in flight
+
+    def add_match(self, employee_id, confirm_matches):
+        """Record one encode+match result; confirms identity after enough agreeing votes"""
+        self.encodes += 1
+        self.frames_since_encode = 0
+        if employee_id is None:
+            return
+        self.votes[employee_id] += 1
+        candidate, count = self.votes.most_common(1)[0]
+        if count >= confirm_matches:
+            self.employee_id = candidate
+
+
+class FaceTracker:
+    """IoU tracker with a centroid fallback, one per camera stream
+
+    Detections are greedily associated with live tracks by IoU (or, failing
+    that, by centre distance for fast movers). A track is encoded only until
+    its identity is confirmed, at most max_encodes times, retrying every
+    retry_frames frames while the face is still unknown.
+    """
+
+    def __init__(self, iou_threshold=0.3, centroid_threshold=0.5, max_age=2.0,
+                 confirm_matches=1, max_encodes=3, retry_frames=3):
+        self.iou_threshold = iou_threshold
+        self.centroid_threshold = centroid_threshold
+        self.max_age = max_age
+        self.confirm_matches = confirm_matches
+        self.max_encodes = max_encodes
+        self.retry_frames = retry_frames
+        self.tracks = {}
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def update(self, boxes, now):
+        """Associate this frame's boxes with tracks; returns the Track for each box"""
+        for track_id in [tid for tid, t in self.tracks.items() if now - t.last_seen > self.max_age]:
+            del self.tracks[track_id]
+
+        pairs = []
+        for track in self.tracks.values():
+            for index, box in enumerate(boxes):
+                overlap = iou(track.box, box)
+                if overlap >= self.iou_threshold:
+                    pairs.append((1.0 + overlap, track, index))
+                elif _centroid_distance(track.box, box) <= self.centroid_threshold:
+                    pairs.append((1.0 - _centroid_distance(track.box, box), track, index))
+        pairs.sort(key=lambda pair: pair[0], reverse=True)
+
+        assigned = [None] * len(boxes)
+        used = set()
+        for _, track, index in pairs:
+            if assigned[index] is not None or track.track_id in used:
+                continue
+            assigned[index] = track
+            used.add(track.track_id)
+            track.box = boxes[index]
+            track.last_seen = now
+            track.hits += 1
+            track.frames_since_encode += 1
+
+        for index, box in enumerate(boxes):
+            if assigned[index] is None:
+                track = Track(next(self._ids), box, now)
+                self.tracks[track.track_id] = track
+                assigned[index] = track
+        return assigned
+
+    def needs_encoding(self, track):
+        if track.employee_id is not None or track.encoding or track.encodes >= self.max_encodes:
+            return False
+        return track.encodes == 0 or track.frames_since_encode >= self.retry_frames
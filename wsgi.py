@@ -0,0 +1,12 @@
+"""WSGI entry point
+
+    python recognition_service.py &
+    PAYROLL_ROLE=web gunicorn -w 4 -b 0.0.0.0:5001 wsgi:app
+
+Web workers stay small (no OpenCV, dlib or gallery) and talk to the single
+recognition service. Don't use --preload: each worker opens its own database
+pool and IPC subscription after the fork.
+"""
+from app import create_app
+
+app = create_app()